@@ -0,0 +1,70 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark flattening traces and computing latency statistics against a hand-written recursive aggregation.
+
+Run with `python benchmarks/bench_analytics.py`.
+"""
+import collections
+import json
+import time
+
+from synthetic_traces import make_trace_builder
+
+from llmtracer.analytics import flatten_traces, latency_stats
+
+NUM_NODES = [100_000, 1_000_000]
+NUM_TRACES = 10
+
+
+def recursive_totals(node, totals):
+    totals[node.name] += node.end_time_ms - node.start_time_ms
+    for child in node.children:
+        recursive_totals(child, totals)
+
+
+def bench_num_nodes(num_nodes: int) -> dict[str, float]:
+    traces = [make_trace_builder(num_nodes // NUM_TRACES, prompt_words=1, seed=i).build() for i in range(NUM_TRACES)]
+
+    start = time.perf_counter()
+    totals: dict = collections.Counter()
+    for trace in traces:
+        for node in trace.traces:
+            recursive_totals(node, totals)
+    recursive_totals_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    flat_trace = flatten_traces(traces)
+    flatten_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = latency_stats(flat_trace)
+    latency_stats_s = time.perf_counter() - start
+    assert dict(zip(stats.keys, stats.total_ms.tolist())) == {name: total for name, total in totals.items()}
+
+    return {
+        "recursive_totals_s": recursive_totals_s,
+        "flatten_s": flatten_s,
+        "latency_stats_s": latency_stats_s,
+    }
+
+
+def run() -> dict[str, dict[str, float]]:
+    return {f"{num_nodes}_nodes": bench_num_nodes(num_nodes) for num_nodes in NUM_NODES}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
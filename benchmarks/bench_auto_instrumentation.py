@@ -0,0 +1,94 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Compare decorator-free auto-instrumentation (`sys.monitoring`) with `trace_calls`.
+
+Also measures what auto-instrumentation costs code outside of the module filters (after its events are disabled).
+
+Run with `python benchmarks/bench_auto_instrumentation.py`. Requires Python 3.12+.
+"""
+import json
+import textwrap
+from functools import partial
+
+from timing import best_time_per_call_ns
+
+from llmtracer import build_trace, trace_calls
+from llmtracer.auto_instrumentation import AUTO_INSTRUMENTATION_SUPPORTED, auto_trace_calls
+
+NUM_CALLS = 2_000
+
+
+def plain(prompt: str):
+    return prompt
+
+
+decorated = trace_calls(plain)
+
+# Stands in for third-party code (a different module that is not traced).
+third_party = {}
+exec(
+    compile(
+        textwrap.dedent(
+            """
+            def helper(prompt):
+                return prompt
+
+            def library_call():
+                return helper(helper("prompt"))
+            """
+        ),
+        "third_party.py",
+        "exec",
+    ),
+    third_party,
+)
+library_call = third_party["library_call"]
+
+
+def bench_traced(function, auto: bool) -> float:
+    # `partial` is not Python code, so only the benchmarked function is traced.
+    call = partial(function, "prompt")
+    builder = build_trace(module_filters=__name__, stack_frame_context=0)
+    if auto:
+        with auto_trace_calls(__name__), builder.scope():
+            return best_time_per_call_ns(call, NUM_CALLS, repeats=3)
+    with builder.scope():
+        return best_time_per_call_ns(call, NUM_CALLS, repeats=3)
+
+
+def run() -> dict[str, float]:
+    if not AUTO_INSTRUMENTATION_SUPPORTED:
+        return {"skipped": "requires Python 3.12+"}  # type: ignore
+
+    results = {
+        "decorator_ns": bench_traced(decorated, auto=False),
+        "auto_ns": bench_traced(plain, auto=True),
+        "third_party_ns": best_time_per_call_ns(library_call, NUM_CALLS * 10),
+    }
+    # Only the benchmark module is traced (and the timing loop is not part of it).
+    with auto_trace_calls("timing"):
+        results["third_party_instrumented_ns"] = best_time_per_call_ns(library_call, NUM_CALLS * 10)
+    # Traced code still pays for the callbacks when no trace builder is active.
+    with auto_trace_calls(__name__):
+        results["no_builder_ns"] = best_time_per_call_ns(partial(plain, "prompt"), NUM_CALLS * 10)
+    results["no_builder_baseline_ns"] = best_time_per_call_ns(partial(plain, "prompt"), NUM_CALLS * 10)
+    results["decorator_no_builder_ns"] = best_time_per_call_ns(partial(decorated, "prompt"), NUM_CALLS * 10)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
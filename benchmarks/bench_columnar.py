@@ -0,0 +1,88 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark the columnar trace format against JSON: file size, open time and an aggregate query (time per name).
+
+Run with `python benchmarks/bench_columnar.py`.
+"""
+import collections
+import json
+import operator
+import os
+import tempfile
+import time
+
+from synthetic_traces import make_trace_builder
+
+from llmtracer import JsonFileWriter, Trace
+from llmtracer.columnar import ColumnarTrace, write_columnar_trace
+from llmtracer.utils.tree_traversal import iter_preorder
+
+NUM_NODES = [10_000, 100_000]
+
+
+def bench_num_nodes(num_nodes: int, directory: str) -> dict[str, float]:
+    builder = make_trace_builder(num_nodes)
+    trace = builder.build()
+    json_filename = os.path.join(directory, "trace.json")
+    columnar_filename = os.path.join(directory, "trace.llmtc")
+
+    JsonFileWriter(json_filename).on_event_scope_final(builder)
+    start = time.perf_counter()
+    write_columnar_trace(trace, columnar_filename)
+    columnar_write_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    json_trace = Trace.load_file(json_filename)
+    json_open_s = time.perf_counter() - start
+    start = time.perf_counter()
+    totals: dict = collections.Counter()
+    for node in iter_preorder(json_trace.traces, operator.attrgetter("children")):
+        totals[node.name] += node.end_time_ms - node.start_time_ms
+    json_query_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columnar_trace = ColumnarTrace(columnar_filename)
+    columnar_open_s = time.perf_counter() - start
+    start = time.perf_counter()
+    columnar_totals = columnar_trace.total_time_by_name()
+    columnar_query_s = time.perf_counter() - start
+    assert columnar_totals == {name: total for name, total in totals.items() if total}
+
+    start = time.perf_counter()
+    columnar_trace.to_trace()
+    columnar_to_trace_s = time.perf_counter() - start
+    columnar_trace.close()
+
+    return {
+        "json_bytes": os.path.getsize(json_filename),
+        "columnar_bytes": os.path.getsize(columnar_filename),
+        "columnar_write_s": columnar_write_s,
+        "json_open_s": json_open_s,
+        "columnar_open_s": columnar_open_s,
+        "json_query_s": json_query_s,
+        "columnar_query_s": columnar_query_s,
+        "columnar_to_trace_s": columnar_to_trace_s,
+    }
+
+
+def run() -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as directory:
+        return {f"{num_nodes}_nodes": bench_num_nodes(num_nodes, directory) for num_nodes in NUM_NODES}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
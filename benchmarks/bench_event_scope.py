@@ -0,0 +1,73 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark the cost of `event_scope` against the Python stack depth and `stack_frame_context`.
+
+Also compares zero-duration events: `add_event` (a node with stack capture) and `mark` (an entry in the current
+node's timeline).
+
+Run with `python benchmarks/bench_event_scope.py`.
+"""
+import json
+
+from timing import best_time_per_call_ns
+
+from llmtracer import add_event, build_trace, event_scope, mark
+
+STACK_DEPTHS = [0, 10, 50, 200]
+STACK_FRAME_CONTEXTS = [0, 3]
+NUM_SCOPES = 200
+
+
+def at_depth(depth: int, function):
+    """Call `function` with `depth` additional Python frames on the stack."""
+    if depth == 0:
+        return function()
+    return at_depth(depth - 1, function)
+
+
+def enter_scope():
+    with event_scope("scope"):
+        pass
+
+
+def bench_instant_event(stack_depth: int, function) -> float:
+    builder = build_trace(module_filters=__name__, stack_frame_context=0)
+    with builder.scope():
+        return at_depth(stack_depth, lambda: best_time_per_call_ns(function, NUM_SCOPES * 10, repeats=3))
+
+
+def bench(stack_depth: int, stack_frame_context: int) -> float:
+    builder = build_trace(module_filters=__name__, stack_frame_context=stack_frame_context)
+    with builder.scope():
+        return at_depth(stack_depth, lambda: best_time_per_call_ns(enter_scope, NUM_SCOPES, repeats=3))
+
+
+def run() -> dict[str, float]:
+    results = {
+        f"depth_{stack_depth}_context_{stack_frame_context}_us": bench(stack_depth, stack_frame_context) / 1e3
+        for stack_frame_context in STACK_FRAME_CONTEXTS
+        for stack_depth in STACK_DEPTHS
+    }
+    for stack_depth in [0, 50]:
+        add_event_ns = bench_instant_event(stack_depth, lambda: add_event("event"))
+        results[f"add_event_depth_{stack_depth}_us"] = add_event_ns / 1e3
+        results[f"mark_depth_{stack_depth}_us"] = bench_instant_event(stack_depth, lambda: mark("event")) / 1e3
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
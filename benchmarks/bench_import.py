@@ -0,0 +1,55 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark the time it takes to import llmtracer in a fresh interpreter.
+
+Run with `python benchmarks/bench_import.py`.
+"""
+import json
+import subprocess
+import sys
+import time
+
+REPEATS = 5
+
+STATEMENTS = {
+    "import_llmtracer": "import llmtracer",
+    "import_llmtracer_and_trace": "import llmtracer; llmtracer.build_trace().scope().__enter__()",
+    "import_llmtracer_wandb": "import llmtracer; llmtracer.wandb_tracer",
+    "import_llmtracer_trace_viewer": "import llmtracer; llmtracer.TraceViewerIntegration",
+}
+
+
+def time_statement(statement: str) -> float:
+    """Return the best wall-clock time (in seconds) of running the statement in a fresh interpreter."""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run() -> dict[str, float]:
+    baseline = time_statement("pass")
+    results = {"interpreter_startup_s": baseline}
+    for name, statement in STATEMENTS.items():
+        results[f"{name}_s"] = time_statement(statement) - baseline
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
@@ -0,0 +1,127 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Measure the memory per node and the GC pause of a million-node trace builder tree.
+
+Compares the slotted `TraceNodeBuilder` (lazy properties, no parent links in finished nodes) with the previous
+implementation (a regular dataclass with an eager properties dict and a parent link per node).
+
+Run with `python benchmarks/bench_node_memory.py`.
+"""
+import gc
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+
+from llmtracer.trace_builder import TraceNodeBuilder
+from llmtracer.trace_schema import TraceNodeKind
+
+NUM_NODES = 1_000_000
+FANOUT = 10
+# Every n-th node has properties (like a traced call with captured arguments among plain event scopes).
+PROPERTIES_EVERY = 10
+REPEATS = 3
+
+
+@dataclass
+class LegacyTraceNodeBuilder:
+    """The previous `TraceNodeBuilder` (without its methods)."""
+
+    kind: TraceNodeKind
+    name: str | None
+    event_id: int
+    start_time_ms: int
+    delta_frame_infos: list
+    stack_height: int
+
+    end_time_ms: int | None = None
+    tracer_overhead_ms: float = 0.0
+    tracer_overhead_ns_at_start: int = 0
+    parent: 'LegacyTraceNodeBuilder | None' = None
+    children: list['LegacyTraceNodeBuilder'] = field(default_factory=list)
+    properties: dict[str, object] = field(default_factory=dict)
+    aggregate: object = None
+    spilled: object = None
+
+
+def make_tree(node_type, keep_parent: bool):
+    """Build a finished tree with `NUM_NODES` nodes (`FANOUT` children per inner node)."""
+    frame_infos: list = []
+    root = node_type(
+        kind=TraceNodeKind.SCOPE,
+        name="root",
+        event_id=0,
+        start_time_ms=0,
+        delta_frame_infos=frame_infos,
+        stack_height=0,
+    )
+    nodes = [root]
+    for event_id in range(1, NUM_NODES):
+        parent = nodes[(event_id - 1) // FANOUT]
+        node = node_type(
+            kind=TraceNodeKind.CALL,
+            name="call",
+            event_id=event_id,
+            start_time_ms=event_id,
+            end_time_ms=event_id + 1,
+            delta_frame_infos=frame_infos,
+            stack_height=0,
+        )
+        if keep_parent:
+            node.parent = parent
+        if event_id % PROPERTIES_EVERY == 0:
+            node.properties = {"arguments": event_id}
+        parent.children.append(node)
+        nodes.append(node)
+    return root
+
+
+def measure(node_type, keep_parent: bool) -> dict[str, float]:
+    gc.collect()
+    tracemalloc.start()
+    root = make_tree(node_type, keep_parent)
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    gc_pause_s = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        gc.collect()
+        gc_pause_s = min(gc_pause_s, time.perf_counter() - start)
+
+    # Freeing a tree with parent links takes a GC run (reference cycles); without them, reference counting suffices.
+    start = time.perf_counter()
+    del root
+    unreachable = gc.collect()
+    free_s = time.perf_counter() - start
+    return {
+        "bytes_per_node": memory_bytes / NUM_NODES,
+        "gc_pause_ms": gc_pause_s * 1000,
+        "free_ms": free_s * 1000,
+        "unreachable_after_free": unreachable,
+    }
+
+
+def run() -> dict[str, dict[str, float]]:
+    return {
+        "slotted": measure(TraceNodeBuilder, keep_parent=False),
+        "legacy": measure(LegacyTraceNodeBuilder, keep_parent=True),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
@@ -0,0 +1,64 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark `DynamicObjectConverter` (as used by the trace builder) on realistic LangChain chat messages.
+
+Run with `python benchmarks/bench_object_converter.py`. Requires `langchain_core`.
+"""
+import json
+
+from timing import best_time_s
+
+from llmtracer import build_trace
+
+NUM_MESSAGES = 30
+REPEATS = 20
+
+
+def make_messages() -> list:
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    messages: list = [SystemMessage(content="You are a helpful assistant. " * 20)]
+    for i in range(NUM_MESSAGES // 2):
+        messages.append(HumanMessage(content=f"Question {i}: " + "what is the capital of France? " * 10))
+        messages.append(
+            AIMessage(
+                content=f"Answer {i}: " + "Paris is the capital of France. " * 10,
+                additional_kwargs={"function_call": None},
+                response_metadata={"token_usage": {"prompt_tokens": 100 + i, "completion_tokens": 50}},
+            )
+        )
+    return messages[:NUM_MESSAGES]
+
+
+def run() -> dict[str, float]:
+    try:
+        messages = make_messages()
+    except ImportError as e:
+        return {"skipped": str(e)}  # type: ignore
+
+    builder = build_trace(stack_frame_context=0)
+    # The first conversion fills the dispatch cache and the conversion plans.
+    builder.convert_object(messages)
+    convert_s = best_time_s(lambda: builder.convert_object(messages), repeats=REPEATS)
+    return {
+        "convert_messages_us": convert_s * 1e6,
+        "convert_per_message_us": convert_s / NUM_MESSAGES * 1e6,
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
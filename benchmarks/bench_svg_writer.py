@@ -0,0 +1,60 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark `SvgFileWriter` on synthetic traces (see `bench_trace_files.py` for `JsonFileWriter`).
+
+Run with `python benchmarks/bench_svg_writer.py`.
+"""
+import json
+import os
+import tempfile
+import time
+
+from synthetic_traces import make_trace_builder
+
+from llmtracer.handlers.svg_writer import SvgFileWriter
+
+NUM_NODES = [1_000, 10_000, 100_000]
+EXTENSIONS = ["svg", "svgz"]
+
+
+def bench_extension(builder, extension: str, directory: str) -> dict[str, float]:
+    filename = os.path.join(directory, f"trace.{extension}")
+    writer = SvgFileWriter(filename)
+
+    start = time.perf_counter()
+    writer.on_scope_final(builder)
+    write_s = time.perf_counter() - start
+
+    return {
+        "write_s": write_s,
+        "nodes_per_s": builder.id_counter / write_s,
+        "file_bytes": os.path.getsize(filename),
+    }
+
+
+def run() -> dict[str, dict[str, float]]:
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for num_nodes in NUM_NODES:
+            builder = make_trace_builder(num_nodes)
+            for extension in EXTENSIONS:
+                results[f"{num_nodes}_nodes_{extension}"] = bench_extension(builder, extension, directory)
+    return results
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
@@ -0,0 +1,62 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark the overhead of `trace_calls` with and without an active trace builder.
+
+Run with `python benchmarks/bench_trace_calls.py`.
+"""
+import json
+
+from timing import best_time_per_call_ns
+
+from llmtracer import build_trace, trace_calls
+
+NUM_CALLS = 2_000
+
+
+def plain(prompt: str):
+    return prompt
+
+
+@trace_calls
+def traced(prompt: str):
+    return prompt
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def traced_capturing(prompt: str):
+    return prompt
+
+
+def bench_active(function, stack_frame_context: int) -> float:
+    builder = build_trace(module_filters=__name__, stack_frame_context=stack_frame_context)
+    with builder.scope():
+        return best_time_per_call_ns(lambda: function("prompt"), NUM_CALLS, repeats=3)
+
+
+def run() -> dict[str, float]:
+    return {
+        "plain_call_ns": best_time_per_call_ns(lambda: plain("prompt"), NUM_CALLS * 10),
+        "inactive_ns": best_time_per_call_ns(lambda: traced("prompt"), NUM_CALLS * 10),
+        "inactive_capturing_ns": best_time_per_call_ns(lambda: traced_capturing("prompt"), NUM_CALLS * 10),
+        "active_ns": bench_active(traced, stack_frame_context=3),
+        "active_capturing_ns": bench_active(traced_capturing, stack_frame_context=3),
+        "active_no_context_ns": bench_active(traced, stack_frame_context=0),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
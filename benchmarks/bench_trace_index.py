@@ -0,0 +1,69 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark looking up single nodes via the index sidecar against parsing the whole trace file.
+
+Run with `python benchmarks/bench_trace_index.py`.
+"""
+import json
+import os
+import random
+import tempfile
+import time
+
+from synthetic_traces import make_trace_builder
+
+from llmtracer import JsonFileWriter, Trace
+from llmtracer.trace_index import TraceFileReader
+
+NUM_NODES = [10_000, 100_000]
+NUM_LOOKUPS = 100
+
+
+def bench_num_nodes(num_nodes: int, directory: str) -> dict[str, float]:
+    builder = make_trace_builder(num_nodes)
+    filename = os.path.join(directory, "trace.json")
+    JsonFileWriter(filename).on_event_scope_final(builder)
+
+    start = time.perf_counter()
+    Trace.load_file(filename).build_event_id_map()
+    full_parse_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reader = TraceFileReader(filename)
+    open_index_s = time.perf_counter() - start
+
+    event_ids = random.Random(0).sample(list(reader.index.event_id), NUM_LOOKUPS)
+    start = time.perf_counter()
+    for event_id in event_ids:
+        reader.load_node(event_id, depth=1)
+    load_node_s = (time.perf_counter() - start) / NUM_LOOKUPS
+    reader.close()
+
+    return {
+        "full_parse_s": full_parse_s,
+        "open_index_s": open_index_s,
+        "load_node_depth_1_s": load_node_s,
+    }
+
+
+def run() -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as directory:
+        return {f"{num_nodes}_nodes": bench_num_nodes(num_nodes, directory) for num_nodes in NUM_NODES}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
@@ -0,0 +1,71 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark the streaming trace loader against `Trace.load_file`: load time and peak memory (via tracemalloc).
+
+Run with `python benchmarks/bench_trace_loader.py`.
+"""
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from synthetic_traces import make_trace_builder
+
+from llmtracer import JsonFileWriter, Trace
+from llmtracer.trace_loader import load_trace_file
+
+NUM_NODES = [10_000, 100_000]
+
+
+def measure(load) -> tuple[float, float]:
+    """Return the load time in seconds and the peak memory in MB."""
+    gc.collect()
+    start = time.perf_counter()
+    load()
+    load_s = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return load_s, peak / 1e6
+
+
+def bench_num_nodes(num_nodes: int, directory: str) -> dict[str, float]:
+    filename = os.path.join(directory, "trace.json")
+    JsonFileWriter(filename, write_index=False).on_event_scope_final(make_trace_builder(num_nodes))
+
+    results: dict[str, float] = {"file_mb": os.path.getsize(filename) / 1e6}
+    for name, load in {
+        "load_file": lambda: Trace.load_file(filename),
+        "streaming": lambda: load_trace_file(filename),
+        "streaming_slim": lambda: load_trace_file(filename, include_frame_infos=False, max_property_size=64),
+    }.items():
+        results[f"{name}_s"], results[f"{name}_peak_mb"] = measure(load)
+    return results
+
+
+def run() -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as directory:
+        return {f"{num_nodes}_nodes": bench_num_nodes(num_nodes, directory) for num_nodes in NUM_NODES}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
@@ -0,0 +1,62 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark the trace viewer's ingestion path: loading an uploaded trace and converting it to flame graph data.
+
+Run with `python benchmarks/bench_viewer.py`. Does not require reflex.
+"""
+import io
+import json
+import time
+
+from synthetic_traces import make_trace_builder
+
+from llmtracer import Trace
+from llmtracer.tools.trace_viewer.app.flame_graph_data import convert_trace_to_flame_graph_data
+from llmtracer.trace_loader import load_trace_stream
+from llmtracer.trace_serializer import dumps_trace_builder
+
+NUM_NODES = [1_000, 10_000, 100_000]
+
+
+def timed(function) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+
+def bench(num_nodes: int) -> dict[str, float]:
+    upload = dumps_trace_builder(make_trace_builder(num_nodes))
+
+    load_model_s, _ = timed(lambda: Trace.load_stream(io.BytesIO(upload)))
+    load_stream_s, trace = timed(lambda: load_trace_stream(io.BytesIO(upload)))
+    convert_s, flame_graph_data = timed(lambda: convert_trace_to_flame_graph_data(trace))
+    serialize_s, _ = timed(lambda: json.dumps(flame_graph_data))
+    return {
+        "upload_bytes": len(upload),
+        "load_model_s": load_model_s,
+        "load_stream_s": load_stream_s,
+        "flame_graph_s": convert_s,
+        "flame_graph_json_s": serialize_s,
+    }
+
+
+def run() -> dict[str, dict[str, float]]:
+    return {f"{num_nodes}_nodes": bench(num_nodes) for num_nodes in NUM_NODES}
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
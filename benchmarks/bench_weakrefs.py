@@ -0,0 +1,141 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Benchmark `WeakKeyIdMap` against the previous `weakref.finalize`-per-key implementation.
+
+Run with `python benchmarks/bench_weakrefs.py`.
+"""
+import gc
+import json
+import time
+import tracemalloc
+
+from llmtracer.utils.weakrefs import IdMapFinalizer, WeakKeyIdMap
+
+NUM_ENTRIES = 100_000
+REPEATS = 5
+
+
+class FinalizerWeakKeyIdMap:
+    """The previous implementation of `WeakKeyIdMap` (one `weakref.finalize` per key)."""
+
+    def __init__(self):
+        self.id_map_to_value = {}
+        self.id_map_finalizer = IdMapFinalizer()
+
+    def _release(self, id_value):
+        del self.id_map_to_value[id_value]
+
+    def __setitem__(self, k, v):
+        id_k = id(k)
+        if id_k not in self.id_map_to_value:
+            self.id_map_finalizer.register(k, self._release)
+        self.id_map_to_value[id_k] = v
+
+    def __contains__(self, k):
+        return id(k) in self.id_map_to_value
+
+    def __getitem__(self, k):
+        return self.id_map_to_value[id(k)]
+
+    def __len__(self):
+        return len(self.id_map_to_value)
+
+
+class Key:
+    pass
+
+
+def measure_bytes_per_entry(map_factory) -> float:
+    keys = [Key() for _ in range(NUM_ENTRIES)]
+    gc.collect()
+
+    tracemalloc.start()
+    id_map = map_factory()
+    for key in keys:
+        id_map[key] = "name"
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory_bytes / NUM_ENTRIES
+
+
+def bench_map(map_factory) -> dict[str, float]:
+    keys = [Key() for _ in range(NUM_ENTRIES)]
+    misses = [Key() for _ in range(NUM_ENTRIES)]
+    gc.collect()
+
+    start = time.perf_counter()
+    id_map = map_factory()
+    for key in keys:
+        id_map[key] = "name"
+    insert_s = time.perf_counter() - start
+
+    # The previous lookup pattern in TraceBuilder.convert_object: `in` followed by `[]`.
+    start = time.perf_counter()
+    for key in keys:
+        if key in id_map:
+            id_map[key]
+    lookup_hit_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for key in misses:
+        if key in id_map:
+            id_map[key]
+    lookup_miss_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    keys = None
+    gc.collect()
+    collect_s = time.perf_counter() - start
+    assert len(id_map) == 0
+
+    return {
+        "bytes_per_entry": measure_bytes_per_entry(map_factory),
+        "insert_ns_per_entry": insert_s / NUM_ENTRIES * 1e9,
+        "lookup_hit_ns": lookup_hit_s / NUM_ENTRIES * 1e9,
+        "lookup_miss_ns": lookup_miss_s / NUM_ENTRIES * 1e9,
+        "collect_ns_per_entry": collect_s / NUM_ENTRIES * 1e9,
+    }
+
+
+def bench_get(map_factory) -> dict[str, float]:
+    """The lookup pattern used by TraceBuilder.convert_object now: a single `get`."""
+    keys = [Key() for _ in range(NUM_ENTRIES)]
+    id_map = map_factory()
+    for key in keys:
+        id_map[key] = "name"
+
+    start = time.perf_counter()
+    for key in keys:
+        id_map.get(key)
+    return {"get_hit_ns": (time.perf_counter() - start) / NUM_ENTRIES * 1e9}
+
+
+def best_of(bench, map_factory) -> dict[str, float]:
+    """Run a benchmark several times and keep the best result for each metric."""
+    results = [bench(map_factory) for _ in range(REPEATS)]
+    return {metric: min(result[metric] for result in results) for metric in results[0]}
+
+
+def run() -> dict[str, dict[str, float]]:
+    return {
+        "finalizer_weak_key_id_map": best_of(bench_map, FinalizerWeakKeyIdMap),
+        "weak_key_id_map": best_of(bench_map, WeakKeyIdMap) | best_of(bench_get, WeakKeyIdMap),
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(), indent=1))
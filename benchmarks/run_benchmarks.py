@@ -0,0 +1,106 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Run the benchmark suite and write the results as JSON, so that they can be tracked over time.
+
+Every `bench_*.py` module in this directory exposes a `run()` function that returns a JSON-serializable dict.
+
+Run with `python benchmarks/run_benchmarks.py [--output results.json] [benchmark ...]`.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def list_benchmarks() -> list[str]:
+    return sorted(
+        filename[len("bench_") : -len(".py")]
+        for filename in os.listdir(BENCHMARK_DIRECTORY)
+        if filename.startswith("bench_") and filename.endswith(".py")
+    )
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIRECTORY, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_metadata() -> dict[str, object]:
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmark(name: str) -> dict[str, object]:
+    """Run a single benchmark module. Failures are recorded instead of aborting the suite."""
+    start = time.perf_counter()
+    try:
+        results = importlib.import_module(f"bench_{name}").run()
+    except Exception:
+        results = {"error": traceback.format_exc()}
+    return {"duration_s": time.perf_counter() - start, "results": results}
+
+
+def main(argv: list[str] | None = None):
+    available = list_benchmarks()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default: all of {', '.join(available)}).")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file instead of stdout.")
+    parser.add_argument("--list", action="store_true", help="List the available benchmarks and exit.")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(available))
+        return
+    unknown = sorted(set(args.benchmarks) - set(available))
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    # Make the benchmark modules (and their shared helpers) importable when run from anywhere.
+    sys.path.insert(0, BENCHMARK_DIRECTORY)
+    report: dict[str, object] = {"metadata": get_metadata(), "benchmarks": {}}
+    for name in args.benchmarks or available:
+        print(f"Running {name}...", file=sys.stderr)
+        report["benchmarks"][name] = run_benchmark(name)  # type: ignore
+
+    output = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Synthetic trace builders for benchmarks.
+
+The trees are built directly (without running the tracer), so the benchmarks of the writers and loaders do not depend
+on the cost of capturing stack frames.
+"""
+import random
+
+from llmtracer.frame_info import FrameInfo
+from llmtracer.trace_builder import TraceBuilder, TraceNodeBuilder
+from llmtracer.trace_schema import TraceNodeKind
+
+_WORDS = "the quick brown fox jumps over the lazy dog while an agent calls a tool and an llm answers".split()
+
+_KINDS = [TraceNodeKind.CALL, TraceNodeKind.LLM, TraceNodeKind.TOOL, TraceNodeKind.CHAIN]
+
+
+def make_prompt(rng: random.Random, num_words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(num_words))
+
+
+def make_trace_builder(num_nodes: int, fanout: int = 10, prompt_words: int = 50, seed: int = 0) -> TraceBuilder:
+    """
+    Create a finished trace builder with `num_nodes` nodes below the root scope.
+
+    Nodes have up to `fanout` children each, a captured prompt of `prompt_words` words as argument and a result.
+    """
+    rng = random.Random(seed)
+    builder = TraceBuilder(module_filters=None, stack_frame_context=0)  # type: ignore
+    builder.event_root.name = "synthetic"
+
+    scope = TraceNodeBuilder(
+        kind=TraceNodeKind.SCOPE,
+        name="main",
+        event_id=builder.next_id(),
+        start_time_ms=0,
+        delta_frame_infos=[],
+        stack_height=0,
+        end_time_ms=num_nodes,
+    )
+    builder.event_root.children.append(scope)
+
+    # Breadth-first, so the tree has `fanout` children per inner node.
+    queue = [scope]
+    created = 0
+    while created < num_nodes:
+        parent = queue.pop(0)
+        for _ in range(fanout):
+            if created >= num_nodes:
+                break
+            kind = rng.choice(_KINDS)
+            name = f"{kind.value.lower()}_{rng.randrange(20)}"
+            start_time_ms = parent.start_time_ms + rng.randrange(max(parent.end_time_ms - parent.start_time_ms, 1))
+            node = TraceNodeBuilder(
+                kind=kind,
+                name=name,
+                event_id=builder.next_id(),
+                start_time_ms=start_time_ms,
+                end_time_ms=start_time_ms + rng.randrange(max(parent.end_time_ms - start_time_ms, 1)),
+                delta_frame_infos=[
+                    FrameInfo(
+                        module="benchmarks.synthetic",
+                        lineno=rng.randrange(1000),
+                        function=name,
+                        code_context=None,
+                        index=None,
+                    )
+                ],
+                stack_height=0,
+            )
+            node.properties = {
+                "arguments": {"prompt": make_prompt(rng, prompt_words)},
+                "result": make_prompt(rng, prompt_words // 5),
+            }
+            parent.children.append(node)
+            queue.append(node)
+            created += 1
+
+    return builder
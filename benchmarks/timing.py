@@ -0,0 +1,51 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Timing helpers shared by the benchmarks.
+"""
+import gc
+import time
+import typing
+
+REPEATS = 5
+
+
+def best_time_s(function: typing.Callable[[], typing.Any], repeats: int = REPEATS) -> float:
+    """The best wall-clock time (in seconds) of calling `function` (after a garbage collection each time)."""
+    best = float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def best_time_per_call_ns(
+    function: typing.Callable[[], typing.Any], number: int, repeats: int = REPEATS, setup=None
+) -> float:
+    """The best time per call (in nanoseconds) of calling `function` `number` times in a loop."""
+
+    def loop():
+        for _ in range(number):
+            function()
+
+    best = float("inf")
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        best = min(best, best_time_s(loop, repeats=1))
+    return best / number * 1e9
@@ -14,9 +14,19 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from .convenience import add_event, build_trace, event_scope, register_object, update_event_properties, update_name
+import importlib
+import typing
+
+from .convenience import (
+    add_event,
+    build_trace,
+    event_scope,
+    mark,
+    register_object,
+    update_event_properties,
+    update_name,
+)
 from .handlers.json_writer import JsonFileWriter
-from .handlers.trace_viewer import TraceViewerIntegration
 from .module_filtering import module_filter, module_filters
 from .trace_builder import (
     TraceBuilder,
@@ -26,6 +36,30 @@ from .trace_builder import (
     trace_object_converter,
 )
 from .trace_schema import Trace, TraceNode, TraceNodeKind
-from .wandb_integration import wandb_build_trace_trees, wandb_tracer
+
+if typing.TYPE_CHECKING:
+    from .handlers.trace_viewer import TraceViewerIntegration
+    from .wandb_integration import wandb_build_trace_trees, wandb_tracer
 
 __version__ = '1.2.1'
+
+# Integrations with heavy dependencies (wandb, reflex) are only imported on first use.
+_lazy_attributes = {
+    "TraceViewerIntegration": ".handlers.trace_viewer",
+    "wandb_build_trace_trees": ".wandb_integration",
+    "wandb_tracer": ".wandb_integration",
+}
+
+
+def __getattr__(name: str):
+    module_name = _lazy_attributes.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
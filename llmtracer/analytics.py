@@ -0,0 +1,307 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Vectorized latency analytics over traces.
+
+`flatten_traces` turns one or many traces into NumPy columns (in pre-order), and `latency_stats` computes per-name or
+per-kind call counts, total and self time, mean, p50/p95/p99, max and exception rates from them without any Python
+loops over the nodes.
+
+Example:
+```
+flat_trace = flatten_traces([Trace.load_file(filename) for filename in filenames])
+for row in latency_stats(flat_trace, group_by="name").to_rows():
+    print(row)
+```
+
+This module requires NumPy.
+"""
+import dataclasses
+import operator
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.utils.tree_traversal import visit_top_down
+
+KINDS = list(TraceNodeKind)
+
+
+@dataclass
+class FlatTrace:
+    """
+    The nodes of one or more traces as rows of columns (in pre-order, trace after trace).
+
+    `parent` holds the (global) index of the parent row or -1 for roots, `trace_index` the index of the trace a row
+    belongs to, and `name_id` an index into `names`.
+
+    A row can stand for several calls: `call_count` is their number and `call_time_ms` their total duration.
+    - Regular nodes are one call.
+    - Aggregate nodes (see `TraceBuilder.aggregate_siblings`) stand for the aggregated calls apart from their exemplar
+      children. The exemplars are flattened as siblings of the aggregate node (like the calls were before they were
+      aggregated).
+    - Unsampled calls (the `unsampled` property of a node) get a CALL row per name below the node. They have no
+      time span (their start and end time are the start time of the node).
+    """
+
+    names: list[str | None]
+    trace_names: list[str | None]
+    name_id: np.ndarray
+    kind: np.ndarray
+    parent: np.ndarray
+    trace_index: np.ndarray
+    start_time_ms: np.ndarray
+    end_time_ms: np.ndarray
+    has_exception: np.ndarray
+    call_count: np.ndarray
+    call_time_ms: np.ndarray
+
+    def __len__(self):
+        return len(self.name_id)
+
+    @property
+    def duration_ms(self) -> np.ndarray:
+        return self.end_time_ms - self.start_time_ms
+
+    @property
+    def self_time_ms(self) -> np.ndarray:
+        """
+        The call time of each row minus the call time of its children.
+
+        Concurrent children can take longer than their parent in total, so this is clamped at zero.
+        """
+        call_time_ms = self.call_time_ms
+        has_parent = self.parent >= 0
+        children_ms = np.bincount(self.parent[has_parent], weights=call_time_ms[has_parent], minlength=len(self))
+        return np.maximum(call_time_ms - children_ms, 0)
+
+
+def flatten_traces(traces: typing.Iterable[Trace]) -> FlatTrace:
+    """
+    Flatten traces into NumPy columns.
+    """
+    name_ids: dict[str | None, int] = {}
+    kind_ids = {kind: i for i, kind in enumerate(KINDS)}
+    trace_names = []
+    name_id_column: list[int] = []
+    kind_column: list[int] = []
+    parent_column: list[int] = []
+    trace_index_column: list[int] = []
+    start_column: list[int] = []
+    end_column: list[int] = []
+    exception_column: list[bool] = []
+    call_count_column: list[int] = []
+    call_time_column: list[float] = []
+
+    def append_row(
+        name: str | None,
+        kind: TraceNodeKind,
+        parent: int,
+        start_time_ms: int,
+        end_time_ms: int,
+        has_exception: bool,
+        call_count: int,
+        call_time_ms: float,
+    ) -> int:
+        index = len(name_id_column)
+        name_id = name_ids.get(name)
+        if name_id is None:
+            name_id = name_ids[name] = len(name_ids)
+        name_id_column.append(name_id)
+        kind_column.append(kind_ids[kind])
+        parent_column.append(parent)
+        start_column.append(start_time_ms)
+        end_column.append(end_time_ms)
+        exception_column.append(has_exception)
+        call_count_column.append(call_count)
+        call_time_column.append(call_time_ms)
+        return index
+
+    def visit(node: TraceNode, parent: int) -> int:
+        """Append the rows of a node and return the parent index for its children."""
+        properties = node.properties
+        duration_ms = node.end_time_ms - node.start_time_ms
+        aggregate = properties.get("aggregate")
+        if isinstance(aggregate, dict):
+            # The exemplars are rows of their own.
+            exemplars_ms = sum(child.end_time_ms - child.start_time_ms for child in node.children)
+            call_count = aggregate["count"] - len(node.children)
+            call_time_ms = aggregate["total_duration_ms"] - exemplars_ms
+        else:
+            aggregate = None
+            call_count, call_time_ms = 1, duration_ms
+        index = append_row(
+            node.name,
+            node.kind,
+            parent,
+            node.start_time_ms,
+            node.end_time_ms,
+            "exception" in properties,
+            call_count,
+            call_time_ms,
+        )
+
+        unsampled = properties.get("unsampled")
+        if isinstance(unsampled, dict):
+            for name, stats in unsampled.items():
+                append_row(
+                    name,
+                    TraceNodeKind.CALL,
+                    index,
+                    node.start_time_ms,
+                    node.start_time_ms,
+                    False,
+                    stats["count"],
+                    stats["duration_ms"],
+                )
+        return parent if aggregate is not None else index
+
+    for trace_index, trace in enumerate(traces):
+        trace_names.append(trace.name)
+        num_rows_before = len(name_id_column)
+        visit_top_down(trace.traces, operator.attrgetter("children"), visit, -1)
+        trace_index_column.extend([trace_index] * (len(name_id_column) - num_rows_before))
+
+    return FlatTrace(
+        names=list(name_ids),
+        trace_names=trace_names,
+        name_id=np.asarray(name_id_column, dtype=np.int32),
+        kind=np.asarray(kind_column, dtype=np.uint8),
+        parent=np.asarray(parent_column, dtype=np.int64),
+        trace_index=np.asarray(trace_index_column, dtype=np.int32),
+        start_time_ms=np.asarray(start_column, dtype=np.int64),
+        end_time_ms=np.asarray(end_column, dtype=np.int64),
+        has_exception=np.asarray(exception_column, dtype=bool),
+        call_count=np.asarray(call_count_column, dtype=np.int64),
+        call_time_ms=np.asarray(call_time_column, dtype=np.float64),
+    )
+
+
+def flatten_trace(trace: Trace) -> FlatTrace:
+    return flatten_traces([trace])
+
+
+@dataclass
+class LatencyStats:
+    """
+    Latency statistics per group (one entry per key in each array). Times are in ms.
+    """
+
+    keys: list
+    count: np.ndarray
+    total_ms: np.ndarray
+    self_ms: np.ndarray
+    mean_ms: np.ndarray
+    p50_ms: np.ndarray
+    p95_ms: np.ndarray
+    p99_ms: np.ndarray
+    max_ms: np.ndarray
+    exception_count: np.ndarray
+
+    @property
+    def exception_rate(self) -> np.ndarray:
+        return self.exception_count / self.count
+
+    def sorted_by(self, column: str, descending: bool = True) -> 'LatencyStats':
+        values = getattr(self, column)
+        order = np.argsort(-values if descending else values, kind="stable")
+        return LatencyStats(
+            keys=[self.keys[i] for i in order], **{name: getattr(self, name)[order] for name in _STATS_COLUMNS}
+        )
+
+    def to_rows(self) -> list[dict[str, typing.Any]]:
+        columns = {name: getattr(self, name).tolist() for name in (*_STATS_COLUMNS, "exception_rate")}
+        return [{"key": key} | {name: column[i] for name, column in columns.items()} for i, key in enumerate(self.keys)]
+
+
+_STATS_COLUMNS = [field.name for field in dataclasses.fields(LatencyStats) if field.name != "keys"]
+
+
+def _grouped_percentiles(
+    sorted_values: np.ndarray, group_starts: np.ndarray, counts: np.ndarray, q: float
+) -> np.ndarray:
+    """Percentiles (with linear interpolation, like `np.percentile`) of values sorted within contiguous groups."""
+    position = (counts - 1) * (q / 100)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    lower_values = sorted_values[group_starts + lower]
+    upper_values = sorted_values[group_starts + upper]
+    return lower_values + (upper_values - lower_values) * (position - lower)
+
+
+def latency_stats(flat_trace: FlatTrace, group_by: str = "name") -> LatencyStats:
+    """
+    Compute latency statistics per node name or kind.
+
+    Args:
+        flat_trace: The flattened traces.
+        group_by: "name", "kind" or "trace_name" (or "kind_and_name" for (kind, name) pairs).
+    """
+    keys: typing.Sequence[typing.Any]
+    if group_by == "name":
+        group, keys = flat_trace.name_id, flat_trace.names
+    elif group_by == "kind":
+        group, keys = flat_trace.kind.astype(np.int64), KINDS
+    elif group_by == "trace_name":
+        group, keys = flat_trace.trace_index, flat_trace.trace_names
+    elif group_by == "kind_and_name":
+        combined = flat_trace.kind.astype(np.int64) * len(flat_trace.names) + flat_trace.name_id
+        unique_combined, group = np.unique(combined, return_inverse=True)
+        keys = [
+            (KINDS[kind], flat_trace.names[name_id])
+            for kind, name_id in zip(*np.divmod(unique_combined, len(flat_trace.names)))
+        ]
+    else:
+        raise ValueError(f"Unknown group_by {group_by!r}!")
+
+    num_groups = len(keys)
+    call_count = flat_trace.call_count
+    call_time_ms = flat_trace.call_time_ms
+    count = np.bincount(group, weights=call_count, minlength=num_groups).astype(np.int64)
+    total_ms = np.bincount(group, weights=call_time_ms, minlength=num_groups)
+    self_ms = np.bincount(group, weights=flat_trace.self_time_ms, minlength=num_groups)
+    exception_count = np.bincount(group, weights=flat_trace.has_exception, minlength=num_groups).astype(np.int64)
+
+    # Only keep groups that occur (e.g. unused kinds).
+    present = count > 0
+    present_groups = np.flatnonzero(present)
+    count = count[present]
+
+    # The percentiles are over the rows: the calls of a row that stands for several calls count as one value (their
+    # mean duration).
+    is_sample = call_count > 0
+    sample_group = group[is_sample]
+    sample_ms = call_time_ms[is_sample] / call_count[is_sample]
+    num_samples = np.bincount(sample_group, minlength=num_groups)[present]
+    # Sort the values by group and then by value, so every group is a contiguous, sorted run.
+    order = np.lexsort((sample_ms, sample_group))
+    sorted_samples = sample_ms[order]
+    group_starts = np.concatenate([[0], np.cumsum(num_samples)[:-1]]).astype(np.int64)
+
+    return LatencyStats(
+        keys=[keys[i] for i in present_groups],
+        count=count,
+        total_ms=total_ms[present],
+        self_ms=self_ms[present],
+        mean_ms=total_ms[present] / count,
+        p50_ms=_grouped_percentiles(sorted_samples, group_starts, num_samples, 50),
+        p95_ms=_grouped_percentiles(sorted_samples, group_starts, num_samples, 95),
+        p99_ms=_grouped_percentiles(sorted_samples, group_starts, num_samples, 99),
+        max_ms=sorted_samples[group_starts + num_samples - 1],
+        exception_count=exception_count[present],
+    )
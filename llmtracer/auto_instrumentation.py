@@ -0,0 +1,164 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Decorator-free tracing of function calls with `sys.monitoring` (PEP 669, Python 3.12+).
+
+Within `auto_trace_calls`, every call of a Python function from the selected modules becomes a node in the current
+trace builder, as if the function was decorated with `trace_calls`:
+
+    builder = build_trace(module_filters="my_package*")
+    with auto_trace_calls("my_package*"), builder.scope():
+        ...
+
+Functions from other modules are only seen once: their events are disabled per code object, so third-party code
+runs at (nearly) full speed. Generators and coroutines are not traced (their frames are suspended and resumed).
+Functions decorated with `trace_calls` keep the single node of their decorator.
+"""
+import inspect
+import sys
+import types
+import typing
+from contextlib import contextmanager
+
+from llmtracer import module_filtering
+from llmtracer.trace_builder import TraceBuilder, TraceNodeBuilder, call_tracer_code_objects
+from llmtracer.trace_schema import TraceNodeKind
+
+# mypy is configured for an older Python, so `sys.monitoring` and `co_qualname` need `type: ignore`s below.
+AUTO_INSTRUMENTATION_SUPPORTED = hasattr(sys, "monitoring")
+
+_TOOL_NAME = "llmtracer"
+_SUSPENDABLE_CODE_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+
+
+class AutoInstrumentation:
+    """
+    The `sys.monitoring` callbacks that open and close call nodes in the current trace builder.
+    """
+
+    module_filters: module_filtering.ModuleFilters
+    kind: TraceNodeKind
+
+    def __init__(self, module_filters: module_filtering.ModuleFilters, kind: TraceNodeKind = TraceNodeKind.CALL):
+        self.module_filters = module_filters
+        self.kind = kind
+        # Whether to trace the calls of a code object (decided on its first event).
+        self._traced_code: dict[types.CodeType, bool] = {}
+        # The open nodes we created with their code objects (by node id), so we only close our own nodes. Entries are
+        # removed when we close the node or when the instrumentation ends.
+        self._open_nodes: dict[int, tuple[TraceNodeBuilder, types.CodeType]] = {}
+
+    def is_traced(self, code: types.CodeType, frame: types.FrameType) -> bool:
+        traced = self._traced_code.get(code)
+        if traced is None:
+            module_name = frame.f_globals.get("__name__", "")
+            traced = (
+                not code.co_flags & _SUSPENDABLE_CODE_FLAGS
+                and code not in call_tracer_code_objects
+                and self.module_filters(module_name)
+            )
+            self._traced_code[code] = traced
+        return traced
+
+    def on_start(self, code: types.CodeType, instruction_offset: int):
+        if not self.is_traced(code, sys._getframe(1)):
+            return sys.monitoring.DISABLE  # type: ignore
+        builder = TraceBuilder.get_current()
+        if builder is None or builder.current_event_node is None:
+            return None
+        # Skip this callback and the started function, so the frame infos start at the call site (like
+        # `trace_calls`).
+        event_node = builder.enter_event(code.co_qualname, kind=self.kind, skip_frames=2)  # type: ignore
+        self._open_nodes[id(event_node)] = (event_node, code)
+        return None
+
+    def on_return(self, code: types.CodeType, instruction_offset: int, retval: object):
+        if not self.is_traced(code, sys._getframe(1)):
+            return sys.monitoring.DISABLE  # type: ignore
+        self._exit(code, None)
+        return None
+
+    def on_unwind(self, code: types.CodeType, instruction_offset: int, exception: BaseException):
+        # PY_UNWIND cannot be disabled, so this has to stay cheap for untraced code.
+        if self._traced_code.get(code):
+            self._exit(code, exception)
+
+    def _exit(self, code: types.CodeType, exception: BaseException | None):
+        builder = TraceBuilder.get_current()
+        if builder is None:
+            return
+        event_node: TraceNodeBuilder | None = builder.current_event_node
+        if event_node is None:
+            return
+        # Calls that started before the instrumentation (or outside of the builder's scope) have no node.
+        entry = self._open_nodes.get(id(event_node))
+        if entry is None or entry[0] is not event_node or entry[1] is not code:
+            return
+        del self._open_nodes[id(event_node)]
+        builder.exit_event(event_node, exception)
+
+    def close(self):
+        """Forget the nodes that are still open (we cannot close them anymore once the instrumentation ends)."""
+        self._open_nodes.clear()
+
+
+def _get_free_tool_id() -> int:
+    for tool_id in [sys.monitoring.PROFILER_ID, *range(sys.monitoring.OPTIMIZER_ID)]:  # type: ignore
+        if sys.monitoring.get_tool(tool_id) is None:  # type: ignore
+            return tool_id
+    raise RuntimeError("All sys.monitoring tool ids are in use!")
+
+
+@contextmanager
+def auto_trace_calls(
+    module_filters: module_filtering.ModuleFiltersSpecifier, kind: TraceNodeKind = TraceNodeKind.CALL
+) -> typing.Iterator[AutoInstrumentation]:
+    """
+    Trace all calls of functions from the given modules (in the current trace builder) without decorators.
+
+    Requires Python 3.12+ (`sys.monitoring`). The module filters are required, as tracing every module (including
+    the standard library) is rarely useful and very slow.
+
+    Note that entering this calls `sys.monitoring.restart_events()`, which is process-global: code locations that
+    any `sys.monitoring` tool disabled (by returning `DISABLE`) fire events for all tools again. We need this, as an
+    earlier instrumentation with other module filters may have disabled events of code we want to trace now.
+
+    Args:
+        module_filters: The modules whose functions are traced, e.g. `"my_package*"`.
+        kind: The kind of the call nodes.
+    """
+    if not AUTO_INSTRUMENTATION_SUPPORTED:
+        raise RuntimeError("Auto-instrumentation requires sys.monitoring (Python 3.12+)!")
+
+    instrumentation = AutoInstrumentation(module_filtering.module_filters(module_filters), kind)
+    monitoring = sys.monitoring  # type: ignore
+    events = monitoring.events
+    tool_id = _get_free_tool_id()
+    monitoring.use_tool_id(tool_id, _TOOL_NAME)
+    try:
+        monitoring.register_callback(tool_id, events.PY_START, instrumentation.on_start)
+        monitoring.register_callback(tool_id, events.PY_RETURN, instrumentation.on_return)
+        monitoring.register_callback(tool_id, events.PY_UNWIND, instrumentation.on_unwind)
+        # Events that an earlier instrumentation disabled (with other module filters) have to fire again.
+        monitoring.restart_events()
+        monitoring.set_events(tool_id, events.PY_START | events.PY_RETURN | events.PY_UNWIND)
+        yield instrumentation
+    finally:
+        monitoring.set_events(tool_id, 0)
+        for event in (events.PY_START, events.PY_RETURN, events.PY_UNWIND):
+            monitoring.register_callback(tool_id, event, None)
+        monitoring.free_tool_id(tool_id)
+        instrumentation.close()
@@ -0,0 +1,379 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Columnar binary trace format with a memory-mapped reader.
+
+Nodes are stored in pre-order as fixed-width little-endian columns (event id, parent index, kind, start and end
+times, ...), so that a reader can `mmap` the file and expose the columns as NumPy arrays without parsing anything.
+Names are stored in a string table, and properties and frame infos as per-node JSON blobs with offset arrays.
+
+Layout:
+    8 bytes magic, 8 bytes header length (uint64), JSON header, padding to 8 bytes, and then the column data at the
+    offsets given in the header.
+
+This module requires NumPy.
+"""
+import mmap
+import operator
+import os
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+
+from llmtracer.frame_info import FrameInfo
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.trace_serializer import json_dumps, json_loads
+from llmtracer.utils.gc_pause import paused_gc
+from llmtracer.utils.tree_traversal import visit_top_down
+
+MAGIC = b"LLMTCOL1"
+FORMAT_VERSION = 1
+
+_ALIGNMENT = 8
+
+# name -> dtype of the fixed-width node columns
+NODE_COLUMNS: dict[str, str] = {
+    "event_id": "<i8",
+    "parent": "<i4",
+    "depth": "<i4",
+    "subtree_end": "<i4",
+    "kind": "u1",
+    "running": "u1",
+    "name": "<i4",
+    "start_time_ms": "<i8",
+    "end_time_ms": "<i8",
+    "tracer_overhead_ms": "<f8",
+}
+
+# blob name -> dtype of its offsets column (with num_entries + 1 entries)
+_BLOBS = ["names", "properties", "frame_infos"]
+_BLOB_OFFSETS_DTYPE = "<u8"
+
+_KINDS = list(TraceNodeKind)
+
+
+@dataclass
+class _FlattenedTrace:
+    columns: dict[str, list]
+    names: list[bytes]
+    properties: list[bytes]
+    frame_infos: list[bytes]
+
+
+def _flatten_trace(trace: Trace) -> _FlattenedTrace:
+    columns: dict[str, list] = {name: [] for name in NODE_COLUMNS}
+    name_ids: dict[str | None, int] = {None: -1}
+    names: list[bytes] = []
+    properties: list[bytes] = []
+    frame_infos: list[bytes] = []
+    kind_ids = {kind: i for i, kind in enumerate(_KINDS)}
+
+    def visit(node: TraceNode, parent_context: tuple[int, int]) -> tuple[int, int]:
+        parent_index, parent_depth = parent_context
+        index = len(columns["event_id"])
+
+        name_id = name_ids.get(node.name)
+        if name_id is None:
+            name_id = name_ids[node.name] = len(names)
+            names.append(node.name.encode("utf-8"))  # type: ignore
+
+        columns["event_id"].append(node.event_id)
+        columns["parent"].append(parent_index)
+        columns["depth"].append(parent_depth + 1)
+        columns["subtree_end"].append(index + 1)
+        columns["kind"].append(kind_ids[node.kind])
+        columns["running"].append(node.running)
+        columns["name"].append(name_id)
+        columns["start_time_ms"].append(node.start_time_ms)
+        columns["end_time_ms"].append(node.end_time_ms)
+        columns["tracer_overhead_ms"].append(node.tracer_overhead_ms)
+        properties.append(json_dumps(node.properties))
+        frame_infos.append(json_dumps([frame_info.model_dump() for frame_info in node.delta_frame_infos]))
+        return index, parent_depth + 1
+
+    visit_top_down(trace.traces, operator.attrgetter("children"), visit, (-1, -1))
+
+    # In pre-order, a subtree ends where the subtree of the last node in it ends.
+    subtree_end = columns["subtree_end"]
+    parents = columns["parent"]
+    for index in range(len(parents) - 1, -1, -1):
+        parent = parents[index]
+        if parent >= 0 and subtree_end[index] > subtree_end[parent]:
+            subtree_end[parent] = subtree_end[index]
+
+    return _FlattenedTrace(columns=columns, names=names, properties=properties, frame_infos=frame_infos)
+
+
+def _pad(f: typing.BinaryIO):
+    padding = -f.tell() % _ALIGNMENT
+    if padding:
+        f.write(b"\0" * padding)
+
+
+def write_columnar_trace(trace: Trace, filename: str | os.PathLike):
+    """
+    Write a trace in the columnar format.
+    """
+    flattened = _flatten_trace(trace)
+
+    arrays: dict[str, np.ndarray] = {
+        name: np.asarray(values, dtype=NODE_COLUMNS[name]) for name, values in flattened.columns.items()
+    }
+    blobs: dict[str, bytes] = {}
+    for blob_name, entries in zip(_BLOBS, [flattened.names, flattened.properties, flattened.frame_infos]):
+        offsets = np.zeros(len(entries) + 1, dtype=_BLOB_OFFSETS_DTYPE)
+        np.cumsum([len(entry) for entry in entries], out=offsets[1:])
+        arrays[f"{blob_name}_offsets"] = offsets
+        blobs[blob_name] = b"".join(entries)
+
+    # Compute the layout first, so the header can contain all offsets.
+    header: dict[str, typing.Any] = {
+        "version": FORMAT_VERSION,
+        "num_nodes": len(flattened.columns["event_id"]),
+        "kinds": [kind.value for kind in _KINDS],
+        "name": trace.name,
+        "properties": trace.properties,
+        "unique_objects": trace.unique_objects,
+        "arrays": {},
+        "blobs": {},
+    }
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.str, "length": len(array), "offset": offset}
+        offset += array.nbytes + (-array.nbytes % _ALIGNMENT)
+    for name, blob in blobs.items():
+        header["blobs"][name] = {"length": len(blob), "offset": offset}
+        offset += len(blob) + (-len(blob) % _ALIGNMENT)
+
+    # The offsets in the header depend on the header length, so shift them until the layout is stable.
+    data_start = 0
+    while True:
+        header_bytes = json_dumps(header)
+        new_data_start = len(MAGIC) + 8 + len(header_bytes)
+        new_data_start += -new_data_start % _ALIGNMENT
+        if new_data_start <= data_start:
+            break
+        for layout in [*header["arrays"].values(), *header["blobs"].values()]:
+            layout["offset"] += new_data_start - data_start
+        data_start = new_data_start
+
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_start - f.tell()))
+        for name, array in arrays.items():
+            assert f.tell() == header["arrays"][name]["offset"]
+            f.write(array.tobytes())
+            _pad(f)
+        for name, blob in blobs.items():
+            assert f.tell() == header["blobs"][name]["offset"]
+            f.write(blob)
+            _pad(f)
+
+
+class ColumnarTrace:
+    """
+    A memory-mapped columnar trace.
+
+    The node columns are exposed as read-only NumPy arrays (in pre-order), e.g. `trace.start_time_ms` or
+    `trace.parent`. Opening a file only parses the (small) header.
+    """
+
+    name: str | None
+    properties: dict[str, object]
+    unique_objects: dict[str, object]
+    kinds: list[TraceNodeKind]
+    num_nodes: int
+
+    event_id: np.ndarray
+    parent: np.ndarray
+    depth: np.ndarray
+    subtree_end: np.ndarray
+    kind: np.ndarray
+    running: np.ndarray
+    name_id: np.ndarray
+    start_time_ms: np.ndarray
+    end_time_ms: np.ndarray
+    tracer_overhead_ms: np.ndarray
+
+    def __init__(self, filename: str | os.PathLike):
+        self._file = open(filename, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{filename} is not a columnar trace file!")
+        header_length = int.from_bytes(self._mmap[len(MAGIC) : len(MAGIC) + 8], "little")
+        header = json_loads(self._mmap[len(MAGIC) + 8 : len(MAGIC) + 8 + header_length])
+        if header["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported columnar trace version {header['version']}!")
+
+        self.name = header["name"]
+        self.properties = header["properties"]
+        self.unique_objects = header["unique_objects"]
+        self.kinds = [TraceNodeKind(kind) for kind in header["kinds"]]
+        self.num_nodes = header["num_nodes"]
+
+        self._arrays = {
+            name: np.frombuffer(self._mmap, dtype=layout["dtype"], count=layout["length"], offset=layout["offset"])
+            for name, layout in header["arrays"].items()
+        }
+        self._blobs = {name: (layout["offset"], layout["length"]) for name, layout in header["blobs"].items()}
+        self._names: list[str] | None = None
+
+        for name, dtype in NODE_COLUMNS.items():
+            # Columns that were added later are missing in older files.
+            array = self._arrays.get(name)
+            if array is None:
+                array = np.zeros(self.num_nodes, dtype=dtype)
+            setattr(self, name if name != "name" else "name_id", array)
+
+    def close(self):
+        """
+        Drop the column arrays and unmap the file. The trace cannot be used afterwards.
+
+        The column arrays are views into the memory map. If other references to them are still alive, the map cannot
+        be closed yet: it stays valid until the last of these arrays is gone.
+        """
+        self._arrays = {}
+        for name in NODE_COLUMNS:
+            self.__dict__.pop(name if name != "name" else "name_id", None)
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def duration_ms(self) -> np.ndarray:
+        return self.end_time_ms - self.start_time_ms
+
+    def _get_blob_entry(self, blob_name: str, index: int) -> bytes:
+        blob_offset, _ = self._blobs[blob_name]
+        offsets = self._arrays[f"{blob_name}_offsets"]
+        return self._mmap[blob_offset + int(offsets[index]) : blob_offset + int(offsets[index + 1])]
+
+    def _iter_blob_entries(self, blob_name: str) -> typing.Iterator[bytes]:
+        blob_offset, _ = self._blobs[blob_name]
+        offsets = self._arrays[f"{blob_name}_offsets"].tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield self._mmap[blob_offset + start : blob_offset + end]
+
+    @property
+    def names(self) -> list[str]:
+        """The string table of node names, decoded on first access."""
+        if self._names is None:
+            self._names = [entry.decode("utf-8") for entry in self._iter_blob_entries("names")]
+        return self._names
+
+    def get_name(self, index: int) -> str | None:
+        name_id = int(self.name_id[index])
+        return self.names[name_id] if name_id >= 0 else None
+
+    def get_properties(self, index: int) -> dict[str, object]:
+        return json_loads(self._get_blob_entry("properties", index))
+
+    def get_frame_infos(self, index: int) -> list[FrameInfo]:
+        return [FrameInfo(**frame_info) for frame_info in json_loads(self._get_blob_entry("frame_infos", index))]
+
+    def get_children(self, index: int) -> np.ndarray:
+        """The indices of the children of a node (in order)."""
+        subtree = slice(index + 1, int(self.subtree_end[index]))
+        return np.flatnonzero(self.parent[subtree] == index) + index + 1
+
+    def total_time_by_kind(self) -> dict[TraceNodeKind, int]:
+        """Total (inclusive) time in ms per node kind."""
+        totals = np.bincount(self.kind, weights=self.duration_ms, minlength=len(self.kinds))
+        return {kind: int(total) for kind, total in zip(self.kinds, totals) if total}
+
+    def total_time_by_name(self) -> dict[str | None, int]:
+        """Total (inclusive) time in ms per node name."""
+        # Shift by one, so unnamed nodes (-1) end up in bin 0.
+        totals = np.bincount(self.name_id + 1, weights=self.duration_ms, minlength=len(self.names) + 1)
+        return {(self.names[i - 1] if i else None): int(total) for i, total in enumerate(totals) if total}
+
+    def to_trace(self) -> Trace:
+        """
+        Convert back to a `Trace`.
+        """
+        with paused_gc():
+            return self._build_trace()
+
+    def _build_trace(self) -> Trace:
+        children: list[list[TraceNode]] = [[] for _ in range(self.num_nodes)]
+        roots: list[TraceNode] = []
+
+        # Per-element access to NumPy arrays is slow, so convert everything to lists first.
+        kinds = [self.kinds[kind] for kind in self.kind.tolist()]
+        names: list[str | None] = [self.names[name_id] if name_id >= 0 else None for name_id in self.name_id.tolist()]
+        columns = zip(
+            kinds,
+            names,
+            self.event_id.tolist(),
+            self.start_time_ms.tolist(),
+            self.end_time_ms.tolist(),
+            self.running.tolist(),
+            self.tracer_overhead_ms.tolist(),
+            self._iter_blob_entries("frame_infos"),
+            self._iter_blob_entries("properties"),
+            self.parent.tolist(),
+        )
+        nodes: list[TraceNode] = []
+        for (
+            kind,
+            name,
+            event_id,
+            start_time_ms,
+            end_time_ms,
+            running,
+            tracer_overhead_ms,
+            frame_infos,
+            properties,
+            parent,
+        ) in columns:
+            node = TraceNode.model_construct(
+                kind=kind,
+                name=name,
+                event_id=event_id,
+                start_time_ms=start_time_ms,
+                end_time_ms=end_time_ms,
+                running=bool(running),
+                tracer_overhead_ms=tracer_overhead_ms,
+                delta_frame_infos=[FrameInfo.model_construct(**frame_info) for frame_info in json_loads(frame_infos)],
+                properties=json_loads(properties),
+                children=children[len(nodes)],
+            )
+            nodes.append(node)
+            if parent >= 0:
+                children[parent].append(node)
+            else:
+                roots.append(node)
+
+        return Trace(name=self.name, traces=roots, properties=self.properties, unique_objects=self.unique_objects)
+
+
+def load_columnar_trace(filename: str | os.PathLike) -> ColumnarTrace:
+    """
+    Memory-map a columnar trace file.
+    """
+    return ColumnarTrace(filename)
@@ -14,24 +14,48 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import typing
 from contextlib import contextmanager
 
 from llmtracer import module_filtering, trace_builder, trace_schema
 
+if typing.TYPE_CHECKING:
+    from llmtracer.sampling import CallSampler, SamplingPolicy
+
 
 def build_trace(
     module_filters: module_filtering.ModuleFiltersSpecifier | None = None,
     stack_frame_context: int = 3,
     name: str | None = None,
+    subtract_tracer_overhead: bool = False,
+    sampling_policy: 'SamplingPolicy | None' = None,
+    aggregate_siblings: int | None = None,
+    max_resident_nodes: int | None = None,
+    spill_directory: str | None = None,
 ):
     """
     Context manager that allows to trace our program execution.
+
+    With `subtract_tracer_overhead`, the tracer's own (measured) overhead is subtracted from the recorded times.
+    With a `sampling_policy` (see `llmtracer.sampling`), only the scopes that the policy keeps are passed to the
+    handlers and kept in the trace.
+    With `aggregate_siblings`, repeated consecutive calls (same name, kind and call site) are merged into one node
+    with an `aggregate` property (count, total/min/max duration and a log2 duration histogram) that keeps the first
+    and the slowest `aggregate_siblings` calls as children.
+    With `max_resident_nodes`, finished top-level subtrees are spilled to a temporary file (in `spill_directory`)
+    whenever more nodes are in memory, and streamed back in by `build()` and the writers.
     """
     if not module_filters:
         module_filters = trace_builder.trace_module_filters
 
     builder = trace_builder.TraceBuilder(
-        module_filters=module_filtering.module_filters(module_filters), stack_frame_context=stack_frame_context
+        module_filters=module_filtering.module_filters(module_filters),
+        stack_frame_context=stack_frame_context,
+        subtract_tracer_overhead=subtract_tracer_overhead,
+        sampling_policy=sampling_policy,
+        aggregate_siblings=aggregate_siblings,
+        max_resident_nodes=max_resident_nodes,
+        spill_directory=spill_directory,
     )
     builder.event_root.name = name
     return builder
@@ -50,13 +74,22 @@ def add_event(
         current.add_event(name, properties, kind)
 
 
-def register_object(obj: object, name: str, properties: dict[str, object]):
+def mark(name: str, payload: object = None):
+    """
+    Record an instant event in the current node's timeline (without creating a node, see `TraceBuilder.mark`).
+    """
+    current = trace_builder.TraceBuilder.get_current()
+    if current is not None and current.current_event_node is not None:
+        current.mark(name, payload)
+
+
+def register_object(obj: object, name: str, properties: dict[str, object], *, keep_alive: bool | None = None):
     """
     Register an object as unique, so that it will be serialized only once.
     """
     current = trace_builder.TraceBuilder.get_current()
     if current is not None:
-        current.register_object(obj, name, properties)
+        current.register_object(obj, name, properties, keep_alive=keep_alive)
 
 
 def update_event_properties(properties: dict[str, object] | None = None, /, **kwargs):
@@ -82,13 +115,16 @@ def event_scope(
     name: str,
     properties: dict[str, object] | None = None,
     kind: trace_schema.TraceNodeKind = trace_schema.TraceNodeKind.SCOPE,
+    sampler: 'CallSampler | None' = None,
 ):
     """
     Context manager that allows to trace our program execution.
+
+    With a `sampler`, unsampled scopes are only counted in the current node (see `TraceBuilder.event_scope`).
     """
     current = trace_builder.TraceBuilder.get_current()
     if current is None:
         yield
     else:
-        with current.event_scope(name, properties=properties, kind=kind, skip_frames=2):
+        with current.event_scope(name, properties=properties, kind=kind, skip_frames=2, sampler=sampler):
             yield
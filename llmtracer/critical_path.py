@@ -0,0 +1,134 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Critical-path analysis over the start and end times of trace nodes.
+
+When children run concurrently (e.g. parallel LLM and tool calls), the end of a node is determined by a chain of
+children: the child that ends last, the child that ends last before that one started, and so on. We assume that each
+child in such a chain waited for its predecessor (and the parent for the last one).
+
+The slack of a node is how much later it could end without delaying the end of the trace. Children on their parent's
+critical chain have the slack of their parent. Children off the chain are assumed to be needed by the next chain
+child that starts after they end (or by the end of the parent), so their slack is the time until then plus the slack
+of their parent. Nodes on the critical path of the trace have no slack.
+"""
+import bisect
+import operator
+import typing
+from dataclasses import dataclass, field
+
+from llmtracer.trace_schema import TraceNode
+from llmtracer.utils.tree_traversal import iter_preorder, visit_top_down
+
+
+def find_critical_chain(nodes: typing.Sequence[TraceNode]) -> list[TraceNode]:
+    """
+    Find the chain of (sibling) nodes that determines when the last of them ends.
+
+    Returns the chain in chronological order.
+    """
+    if not nodes:
+        return []
+
+    # Nodes with the same end time are sorted by start time, so the first of them started first.
+    by_end = sorted(nodes, key=operator.attrgetter("end_time_ms", "start_time_ms"))
+    end_times = [node.end_time_ms for node in by_end]
+
+    def get_earliest_start(last: int) -> int:
+        """Among the nodes up to `last` with its end time, return the index of the one that started first."""
+        return bisect.bisect_left(end_times, end_times[last], hi=last)
+
+    # Start with the node that ends last (and started first among those).
+    current = get_earliest_start(len(by_end) - 1)
+    chain = [by_end[current]]
+    while True:
+        # The predecessor is the node that ended last before the current one started. Only look at nodes before the
+        # current one in the order, so zero-length nodes cannot form cycles.
+        predecessor = min(bisect.bisect_right(end_times, by_end[current].start_time_ms), current) - 1
+        if predecessor < 0:
+            break
+        current = get_earliest_start(predecessor)
+        chain.append(by_end[current])
+    chain.reverse()
+    return chain
+
+
+def _get_slacks(
+    nodes: typing.Sequence[TraceNode], chain: list[TraceNode], end_time_ms: int, parent_slack_ms: int
+) -> dict[int, int]:
+    """The slack of sibling nodes by event id given their critical chain, their parent's end and slack."""
+    chain_starts = [node.start_time_ms for node in chain]
+    chain_event_ids = {node.event_id for node in chain}
+    slacks = {}
+    for node in nodes:
+        if node.event_id in chain_event_ids:
+            slacks[node.event_id] = parent_slack_ms
+            continue
+        next_chain_index = bisect.bisect_left(chain_starts, node.end_time_ms)
+        needed_by_ms = chain_starts[next_chain_index] if next_chain_index < len(chain) else end_time_ms
+        slacks[node.event_id] = parent_slack_ms + max(needed_by_ms - node.end_time_ms, 0)
+    return slacks
+
+
+@dataclass
+class CriticalPathAnalysis:
+    """
+    The result of `analyze_critical_path`.
+
+    Args:
+        slack_ms: The slack of each node by event id (0 for nodes on the critical path).
+        critical_children: The critical chain of children of each node (by event id), in chronological order.
+        roots: The critical chain of the roots.
+    """
+
+    slack_ms: dict[int, int] = field(default_factory=dict)
+    critical_children: dict[int, list[TraceNode]] = field(default_factory=dict)
+    roots: list[TraceNode] = field(default_factory=list)
+
+    def is_critical(self, node: TraceNode) -> bool:
+        """Whether a node is on the critical path of the whole trace."""
+        return self.slack_ms[node.event_id] == 0
+
+    def get_critical_path(self, node: TraceNode | None = None) -> list[TraceNode]:
+        """
+        Return the critical path below a scope (or of the whole trace for None) in pre-order.
+
+        These are the nodes that determine when the scope ends.
+        """
+        roots = self.roots if node is None else self.critical_children[node.event_id]
+        return list(iter_preorder(roots, lambda child: self.critical_children[child.event_id]))
+
+
+def analyze_critical_path(roots: typing.Sequence[TraceNode]) -> CriticalPathAnalysis:
+    """
+    Find the critical chain of children of every node and the slack of every node.
+
+    Args:
+        roots: The root nodes (e.g. `trace.traces`).
+    """
+    analysis = CriticalPathAnalysis()
+    analysis.roots = find_critical_chain(roots)
+    end_time_ms = max((node.end_time_ms for node in roots), default=0)
+
+    analysis.slack_ms.update(_get_slacks(roots, analysis.roots, end_time_ms, 0))
+
+    def visit(node: TraceNode, _context: None):
+        chain = find_critical_chain(node.children)
+        analysis.critical_children[node.event_id] = chain
+        analysis.slack_ms.update(_get_slacks(node.children, chain, node.end_time_ms, analysis.slack_ms[node.event_id]))
+
+    visit_top_down(roots, operator.attrgetter("children"), visit, None)
+    return analysis
@@ -15,6 +15,7 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import inspect
+import typing
 
 from pydantic import BaseModel
 
@@ -34,12 +35,96 @@ class FrameInfo(BaseModel):
     # positions: dis.Positions | None = None
 
 
+def frame_info_to_jsonable(frame_info: FrameInfo) -> dict[str, typing.Any]:
+    """Return the fields of a frame info as a jsonable dict (without the overhead of `model_dump`)."""
+    return {
+        "module": frame_info.module,
+        "lineno": frame_info.lineno,
+        "function": frame_info.function,
+        "code_context": frame_info.code_context,
+        "index": frame_info.index,
+    }
+
+
+_FrameInfoKey = tuple[str, int, str, tuple[str, ...] | None, int | None]
+
+
+class FrameInfoTable:
+    """
+    Interned frame infos.
+
+    Each distinct frame info exists (and is validated) only once and can be referenced by its index in `frame_infos`.
+
+    Trace builders share the frame infos of the same call site between nodes, and JSON traces store the table once
+    (as `frame_infos`) with nodes referring to it by `delta_frame_ids`.
+    """
+
+    frame_infos: list[FrameInfo]
+
+    def __init__(self, frame_infos: typing.Iterable[FrameInfo] = ()):
+        self.frame_infos = []
+        self._ids: dict[_FrameInfoKey, int] = {}
+        # The ids of the table's own frame infos by object id (they are kept alive by the table).
+        self._ids_by_object_id: dict[int, int] = {}
+        for frame_info in frame_infos:
+            self.get_id(frame_info)
+
+    def __len__(self):
+        return len(self.frame_infos)
+
+    def intern(
+        self, module: str, lineno: int, function: str, code_context: list[str] | None, index: int | None
+    ) -> FrameInfo:
+        """Return the shared frame info with the given fields (creating it if needed)."""
+        key = (module, lineno, function, tuple(code_context) if code_context is not None else None, index)
+        frame_id = self._ids.get(key)
+        if frame_id is not None:
+            return self.frame_infos[frame_id]
+        frame_info = FrameInfo(module=module, lineno=lineno, function=function, code_context=code_context, index=index)
+        self._add(key, frame_info)
+        return frame_info
+
+    def get_id(self, frame_info: FrameInfo) -> int:
+        """Return the index of the frame info in the table (adding it if needed)."""
+        frame_id = self._ids_by_object_id.get(id(frame_info))
+        if frame_id is not None:
+            return frame_id
+        code_context = frame_info.code_context
+        key = (
+            frame_info.module,
+            frame_info.lineno,
+            frame_info.function,
+            tuple(code_context) if code_context is not None else None,
+            frame_info.index,
+        )
+        frame_id = self._ids.get(key)
+        if frame_id is None:
+            frame_id = self._add(key, frame_info)
+        return frame_id
+
+    def _add(self, key: _FrameInfoKey, frame_info: FrameInfo) -> int:
+        frame_id = len(self.frame_infos)
+        self.frame_infos.append(frame_info)
+        self._ids[key] = frame_id
+        self._ids_by_object_id[id(frame_info)] = frame_id
+        return frame_id
+
+    def to_jsonable(self) -> list[dict[str, typing.Any]]:
+        return [frame_info_to_jsonable(frame_info) for frame_info in self.frame_infos]
+
+
 def get_frame_infos(
     num_top_frames_to_skip: int = 0,
     num_bottom_frames_to_skip: int = 0,
     module_filters: module_filtering.ModuleFilters | None = None,
     context: int = 3,
+    frame_info_table: FrameInfoTable | None = None,
 ) -> tuple[list[FrameInfo], int]:
+    """
+    Get the frame infos of the caller's stack (without the bottom frames) and the full stack height.
+
+    With a `frame_info_table`, the frame infos are interned in it.
+    """
     # Get the current stack frame infos
     frame_infos: list[inspect.FrameInfo] = inspect.stack(context=context)
 
@@ -53,21 +138,34 @@ def get_frame_infos(
         : stack_height - num_bottom_frames_to_skip
     ]
 
-    relevant_frame_infos: list[FrameInfo] = [
-        FrameInfo(
-            module=module.__name__ if (module := inspect.getmodule(f.frame)) else "<unknown>",
-            lineno=f.lineno,
-            function=f.function,
-            code_context=f.code_context,
-            index=f.index,
-            # positions=f.positions,
-        )
-        for f in relevant_inspect_frame_infos
+    module_names = [
+        module.__name__ if (module := inspect.getmodule(f.frame)) else "<unknown>" for f in relevant_inspect_frame_infos
     ]
 
     # Filter the stack frame infos
-    if module_filters is not None:
-        relevant_frame_infos = [f for f in relevant_frame_infos if module_filters(f.module)]
+    relevant_frames = [
+        (module_name, f)
+        for module_name, f in zip(module_names, relevant_inspect_frame_infos)
+        if module_filters is None or module_filters(module_name)
+    ]
+
+    if frame_info_table is not None:
+        relevant_frame_infos = [
+            frame_info_table.intern(module_name, f.lineno, f.function, f.code_context, f.index)
+            for module_name, f in relevant_frames
+        ]
+    else:
+        relevant_frame_infos = [
+            FrameInfo(
+                module=module_name,
+                lineno=f.lineno,
+                function=f.function,
+                code_context=f.code_context,
+                index=f.index,
+                # positions=f.positions,
+            )
+            for module_name, f in relevant_frames
+        ]
 
     return relevant_frame_infos, stack_height
 
@@ -14,24 +14,64 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
 import os
+import typing
 from dataclasses import dataclass
 
 from llmtracer.trace_builder import TraceBuilder, TraceBuilderEventHandler
+from llmtracer.trace_files import Compression, get_compression, open_trace_file_for_writing
+from llmtracer.trace_index import TraceIndex, get_index_filename
+from llmtracer.trace_serializer import write_trace_builder
+
+
+def save_json_trace_file(
+    filename: str,
+    write_json: typing.Callable[[typing.BinaryIO, TraceIndex | None], None],
+    write_index: bool = True,
+):
+    """
+    Atomically (re)write a (compressed) JSON trace file and, for uncompressed files, its index sidecar.
+
+    The sidecar is replaced before the trace and records the size and modification time of the new trace file, so if
+    we are interrupted in between, `TraceFileReader` detects that it does not match the old trace.
+
+    Args:
+        filename: The trace file. The compression is chosen by extension.
+        write_json: Writes the JSON to the given stream (and records the node extents in the index if one is given).
+        write_index: Whether to write an index sidecar for uncompressed files.
+    """
+    tempfile = filename + ".new_tmp"
+    compression = get_compression(filename)
+    index = TraceIndex() if write_index and compression == Compression.NONE else None
+
+    with open_trace_file_for_writing(tempfile, compression) as f:
+        write_json(f, index)
+
+    if index is not None:
+        # Renaming keeps the modification time of the new trace file.
+        index.file_mtime_ns = os.stat(tempfile).st_mtime_ns
+        index_filename = get_index_filename(filename)
+        index.save(index_filename + ".new_tmp")
+        os.replace(index_filename + ".new_tmp", index_filename)
+
+    os.replace(tempfile, filename)
 
 
 @dataclass
 class JsonFileWriter(TraceBuilderEventHandler):
-    filename: str
+    """
+    Writes the trace to a JSON file whenever an event scope ends.
 
-    def on_event_scope_final(self, builder: 'TraceBuilder'):
-        trace = builder.build()
-        json_trace = trace.dict()
+    The output is gzip- or zstd-compressed if the filename ends with `.gz` or `.zst`.
 
-        tempfile = self.filename + ".new_tmp"
+    For uncompressed files, an index sidecar (`filename + ".idx"`) is written as well, which allows loading single
+    nodes with `TraceFileReader`.
+    """
 
-        with open(tempfile, "w") as f:
-            json.dump(json_trace, f, indent=1)
+    filename: str
+    write_index: bool = True
 
-        os.replace(tempfile, self.filename)
+    def on_event_scope_final(self, builder: 'TraceBuilder'):
+        save_json_trace_file(
+            self.filename, lambda f, index: write_trace_builder(builder, f, index), write_index=self.write_index
+        )
@@ -14,7 +14,8 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import copy
+import io
+import operator
 import os
 from dataclasses import dataclass
 from enum import Enum
@@ -25,8 +26,12 @@ from svgwrite.elementfactory import factoryelements
 from svgwrite.etree import etree
 from svgwrite.mixins import Clipping, Presentation, Transform
 
+from llmtracer.critical_path import analyze_critical_path
 from llmtracer.trace_builder import TraceBuilder, TraceBuilderEventHandler
+from llmtracer.trace_files import get_compression, open_trace_file_for_writing
 from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.trace_serializer import dumps_node_without_children
+from llmtracer.utils.tree_traversal import visit_top_down
 
 
 # solarized colors as HTML hex
@@ -472,7 +477,20 @@ class ForeignObject(BaseElement, Transform, Presentation, Clipping):
 factoryelements['foreignObject'] = ForeignObject
 
 
-def create_svg_from_trace(trace: Trace):
+# Only draw the first marks of nodes with many (e.g. one per streamed token), so the SVG stays small.
+MAX_MARKS_PER_NODE = 200
+
+
+def create_svg_from_trace(trace: Trace, highlight_critical_path: bool = True):
+    """
+    Create an interactive icicle plot of the trace.
+
+    Args:
+        trace: The trace.
+        highlight_critical_path: Whether to outline the nodes on the critical path and show the slack of the others.
+    """
+    critical_path_analysis = analyze_critical_path(trace.traces) if highlight_critical_path else None
+
     total_width = 1280
     total_height = 760
     dwg = svgwrite.Drawing(
@@ -529,21 +547,19 @@ def create_svg_from_trace(trace: Trace):
     start_time = trace.traces[0].start_time_ms
     end_time = trace.traces[-1].end_time_ms
 
-    def traverse_node(node: TraceNode, parent, level: int, parent_start_time_ms: float, parent_duration_ms: float):
+    def visit_node(node: TraceNode, context: tuple):
+        parent, level, parent_start_time_ms, parent_duration_ms = context
+        # Children of zero-length nodes (e.g. with a coarse timer) are collapsed instead of dividing by zero.
+        scale = 99.5 / parent_duration_ms if parent_duration_ms > 0 else 0.0
+
         # create a group for node
         node_group = dwg.svg(
             id=str(node.event_id),
-            x=(node.start_time_ms - parent_start_time_ms) / parent_duration_ms * 99.5 * svgwrite.percent,
+            x=(node.start_time_ms - parent_start_time_ms) * scale * svgwrite.percent,
             y="0" if level == 0 else "1.8em",
-            width=(node.end_time_ms - node.start_time_ms)
-            * 0.99**level
-            / parent_duration_ms
-            * 99.5
-            * svgwrite.percent,
+            width=(node.end_time_ms - node.start_time_ms) * 0.99**level * scale * svgwrite.percent,
         )
-        node_copy = copy.deepcopy(node)
-        node_copy.children = []
-        node_group["data-raw"] = node_copy.json()
+        node_group["data-raw"] = dumps_node_without_children(node).decode('utf-8')
         parent.add(node_group)
 
         rect = dwg.rect(
@@ -556,6 +572,12 @@ def create_svg_from_trace(trace: Trace):
             ry=2,
         )
         rect["data-id"] = str(node.event_id)
+        if critical_path_analysis is not None:
+            slack_ms = critical_path_analysis.slack_ms[node.event_id]
+            node_group["data-slack-ms"] = str(slack_ms)
+            if slack_ms == 0:
+                rect["stroke"] = SolarizedColors.violet.value
+                rect["stroke-width"] = 2
         node_group.add(rect)
 
         clip_path = dwg.clipPath(id=f"{str(node.event_id)}_clip")
@@ -583,15 +605,29 @@ def create_svg_from_trace(trace: Trace):
         )
         node_group.add(text)
 
-        # traverse children
-        for child in node.children:
-            traverse_node(child, node_group, level + 1, node.start_time_ms, node.end_time_ms - node.start_time_ms)
+        # instant events (`TraceBuilder.mark`) as ticks at the bottom of the node
+        duration_ms = node.end_time_ms - node.start_time_ms
+        for time_ms, name, _ in node.get_marks()[:MAX_MARKS_PER_NODE]:
+            x = (time_ms - node.start_time_ms) / duration_ms * 99.5 if duration_ms > 0 else 0.0
+            tick = dwg.line(
+                start=(f"{x:.3f}%", "1.2em"),
+                end=(f"{x:.3f}%", "1.7em"),
+                stroke=SolarizedColors.base02.value,
+                stroke_width=1,
+                pointer_events="none",
+            )
+            tick.set_desc(title=name)
+            node_group.add(tick)
+
+        # context for the children
+        return node_group, level + 1, node.start_time_ms, node.end_time_ms - node.start_time_ms
 
     symbol = dwg.symbol(id="full_view")
     dwg.defs.add(symbol)
 
-    for node in trace.traces:
-        traverse_node(node, symbol, level=0, parent_start_time_ms=start_time, parent_duration_ms=end_time - start_time)
+    visit_top_down(
+        trace.traces, operator.attrgetter("children"), visit_node, (symbol, 0, start_time, end_time - start_time)
+    )
 
     zoom_use = dwg.use(id='zoom_view', x=0, y=0, width="100%", height=total_height - 560, href=symbol.get_iri())
     dwg.add(zoom_use)
@@ -726,6 +762,12 @@ def create_svg_from_trace(trace: Trace):
 
             // set duration
             details_duration.innerText = ((trace_info.end_time_ms - trace_info.start_time_ms) / 1000).toFixed(2) + " s";
+            // add the slack from the critical path analysis (if available)
+            if (target.dataset.slackMs !== undefined) {
+                let slack_ms = parseInt(target.dataset.slackMs);
+                details_duration.innerText += slack_ms == 0 ? " (critical path)"
+                    : " (slack: " + (slack_ms / 1000).toFixed(2) + " s)";
+            }
 
             function renderjson_to(node, json) {
                 node.innerHTML = "";
@@ -790,23 +832,28 @@ def create_svg_from_trace(trace: Trace):
     return dwg
 
 
-def save_trace_as_svg(filename: str, trace: Trace):
+def save_trace_as_svg(filename: str, trace: Trace, highlight_critical_path: bool = True):
+    """
+    Save the trace as interactive SVG. The output is gzip-compressed for `.svgz` files.
+    """
     tempfile = filename + ".new_tmp"
-    svg = create_svg_from_trace(trace)
-    svg.saveas(tempfile)
+    svg = create_svg_from_trace(trace, highlight_critical_path)
+    with io.TextIOWrapper(open_trace_file_for_writing(tempfile, get_compression(filename)), encoding="utf-8") as f:
+        svg.write(f)
     os.replace(tempfile, filename)
 
 
 @dataclass
 class SvgFileWriter(TraceBuilderEventHandler):
     filename: str
+    highlight_critical_path: bool = True
 
     def on_scope_final(self, builder: 'TraceBuilder'):
-        save_trace_as_svg(self.filename, builder.build())
+        save_trace_as_svg(self.filename, builder.build(), self.highlight_critical_path)
 
 
 # main
 if __name__ == "__main__":
     # load example trace data
-    trace = Trace.parse_file("spikes/optimization_unit_trace_ada_2023-05-19_11-07-07.json")
+    trace = Trace.load_file("spikes/optimization_unit_trace_ada_2023-05-19_11-07-07.json")
     save_trace_as_svg("trace.svg", trace)
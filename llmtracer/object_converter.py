@@ -15,27 +15,102 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import dataclasses
+import importlib
 import inspect
+import sys
 import typing
 from dataclasses import dataclass, field
 from functools import partial
 
 import pydantic
 
+from llmtracer.utils.weakrefs import WeakKeyIdMap
+
 T = typing.TypeVar("T")
 
 ObjectConverter: typing.TypeAlias = typing.Callable[[typing.Any, typing.Optional['ObjectConverter']], typing.Any]
 
+_PRIMITIVE_TYPES = frozenset({str, int, float, bool, type(None)})
+
+
+@dataclass(frozen=True)
+class ConversionPlan:
+    """
+    Cached introspection results for converting instances of a dataclass or pydantic model.
+
+    The plan is computed once per class, so repeated conversions only need a `getattr` per field.
+    """
+
+    field_names: tuple[str, ...]
+    include_extra: bool = False
+    use_model_dump: bool = False
+
+    @classmethod
+    def for_dataclass(cls, type_: type) -> 'ConversionPlan':
+        return cls(field_names=tuple(f.name for f in dataclasses.fields(type_)))
+
+    @classmethod
+    def for_pydantic_model(cls, type_: type[pydantic.BaseModel]) -> 'ConversionPlan':
+        # Custom serializers can change the dumped values, so we have to go through `model_dump` for these.
+        decorators = type_.__pydantic_decorators__
+        if decorators.field_serializers or decorators.model_serializers:
+            return cls(field_names=(), use_model_dump=True)
+
+        field_names = tuple(name for name, field_info in type_.model_fields.items() if not field_info.exclude)
+        return cls(
+            field_names=field_names + tuple(type_.model_computed_fields),
+            include_extra=type_.model_config.get('extra') == 'allow',
+        )
+
+    def convert(self, obj: typing.Any, converter: ObjectConverter) -> dict:
+        if self.use_model_dump:
+            return {key: converter(value, converter) for key, value in obj.model_dump(mode='python').items()}
+
+        result = {name: converter(getattr(obj, name), converter) for name in self.field_names}
+        if self.include_extra and obj.__pydantic_extra__:
+            for key, value in obj.__pydantic_extra__.items():
+                result[key] = converter(value, converter)
+        return result
+
+
+# Also caches None for types that are neither dataclasses nor pydantic models. Weak, so that dynamically created
+# classes can still be garbage collected.
+_conversion_plans: WeakKeyIdMap[type, ConversionPlan | None] = WeakKeyIdMap()
+
+_MISSING = object()
+
+
+def get_conversion_plan(type_: type) -> ConversionPlan | None:
+    """
+    Returns the (cached) conversion plan for a dataclass or pydantic model type, or None for other types.
+    """
+    cached_plan = _conversion_plans.get(type_, _MISSING)
+    if cached_plan is not _MISSING:
+        return cached_plan
+
+    plan: ConversionPlan | None
+    if issubclass(type_, pydantic.BaseModel):
+        plan = ConversionPlan.for_pydantic_model(type_)
+    elif dataclasses.is_dataclass(type_):
+        plan = ConversionPlan.for_dataclass(type_)
+    else:
+        plan = None
+    _conversion_plans[type_] = plan
+    return plan
+
 
 @typing.no_type_check
 def simple_object_converter(obj: typing.Any, preferred_converter: ObjectConverter | None = None) -> typing.Any:
     if preferred_converter is None:
         preferred_converter = simple_object_converter
 
-    if isinstance(obj, pydantic.BaseModel):
-        return convert_pydantic_model(obj, preferred_converter)
-    elif not isinstance(obj, type) and dataclasses.is_dataclass(obj):
-        return {preferred_converter(f.name): preferred_converter(getattr(obj, f.name)) for f in dataclasses.fields(obj)}
+    obj_type = type(obj)
+    if obj_type in _PRIMITIVE_TYPES:
+        return obj
+
+    plan = get_conversion_plan(obj_type)
+    if plan is not None:
+        return plan.convert(obj, preferred_converter)
     elif isinstance(obj, (str, int, float, bool, type(None))):
         return obj
     elif isinstance(obj, tuple):
@@ -50,6 +125,71 @@ def simple_object_converter(obj: typing.Any, preferred_converter: ObjectConverte
     return repr(obj)
 
 
+_NO_CONVERTER = object()
+
+
+@dataclass(frozen=True)
+class _LazyType:
+    """
+    Reserves the position of a lazy converter in `converters` until the module of its type has been imported.
+
+    Converters registered later take precedence over it (like for eagerly registered converters). Nothing is an
+    instance of it.
+    """
+
+    module_name: str
+    type_name: str
+
+    def __instancecheck__(self, instance) -> bool:
+        return False
+
+
+class _ConverterDict(dict):
+    """
+    The `converters` of a `DynamicObjectConverter`: calls `on_change` whenever it is modified.
+    """
+
+    def __init__(self, converters: dict, on_change: typing.Callable[[], typing.Any]):
+        super().__init__(converters)
+        self.on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.on_change()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.on_change()
+
+    def __ior__(self, other):  # type: ignore
+        result = super().__ior__(other)
+        self.on_change()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.on_change()
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self.on_change()
+        return result
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self.on_change()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self.on_change()
+        return result
+
+    def clear(self):
+        super().clear()
+        self.on_change()
+
+
 @dataclass
 class DynamicObjectConverter:
     """A class that converts objects to JSON dicts or strings.
@@ -64,22 +204,47 @@ class DynamicObjectConverter:
     converters: dict[type, typing.Callable[[typing.Any, ObjectConverter], typing.Any] | None] = field(
         default_factory=dict
     )
+    # (module name, type name) -> converter for types whose module has not been imported yet. Their position in
+    # `converters` is reserved by a placeholder key until then.
+    lazy_converters: dict[tuple[str, str], typing.Callable[[typing.Any, ObjectConverter], typing.Any] | None] = field(
+        default_factory=dict
+    )
+    # Maps the type of converted objects to the resolved entry in `converters` (or `_NO_CONVERTER`). Invalidated
+    # whenever `converters` changes (also when it is modified directly). Does not keep the types alive.
+    _dispatch_cache: WeakKeyIdMap[type, typing.Any] = field(
+        default_factory=WeakKeyIdMap, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.converters = _ConverterDict(self.converters, self._dispatch_cache.clear)
+        for (module_name, type_name), func in self.lazy_converters.items():
+            self.converters.setdefault(_LazyType(module_name, type_name), func)  # type: ignore
 
     def __call__(self, obj: object, preferred_converter: ObjectConverter | None = None):
         if preferred_converter is None:
             preferred_converter = self
 
-        for t in reversed(self.converters):
-            if not isinstance(obj, t):
-                continue
+        obj_type = type(obj)
+        converter = self._dispatch_cache.get(obj_type, _MISSING)
+        if converter is _MISSING:
+            converter = self._resolve_converter(obj)
+            self._dispatch_cache[obj_type] = converter
+
+        if converter is _NO_CONVERTER:
+            return self.default_converter(obj, preferred_converter)  # type: ignore
+        elif converter is not None:
+            return converter(obj, preferred_converter)
+        else:
+            return f'{obj.__class__.__module__}:{obj.__class__.__qualname__} @ {hex(id(obj))}'
 
-            converter = self.converters[t]
-            if converter is not None:
-                return converter(obj, preferred_converter)
-            else:
-                return f'{obj.__class__.__module__}:{obj.__class__.__qualname__} @ {hex(id(obj))}'
+    def _resolve_converter(self, obj: object):
+        if self.lazy_converters:
+            self._register_imported_lazy_converters()
 
-        return self.default_converter(obj, preferred_converter)  # type: ignore
+        for t in reversed(self.converters):
+            if isinstance(obj, t):
+                return self.converters[t]
+        return _NO_CONVERTER
 
     def register_converter(
         self, func: typing.Callable[[T, ObjectConverter], dict] | None = None, type_: type[T] | None = None
@@ -117,6 +282,34 @@ class DynamicObjectConverter:
 
         return func
 
+    def register_lazy_converter(
+        self, func: typing.Callable[[typing.Any, ObjectConverter], dict] | None, module_name: str, type_name: str
+    ):
+        """
+        Registers a converter for a type that is only looked up once its module has been imported (by someone else).
+
+        This avoids importing heavy optional dependencies just to register converters for them: if the module has
+        not been imported, there cannot be any instances of the type to convert either.
+        """
+        self.lazy_converters[(module_name, type_name)] = func
+        self.converters[_LazyType(module_name, type_name)] = func  # type: ignore
+
+    def _register_imported_lazy_converters(self):
+        resolved_types = {}
+        for module_name, type_name in list(self.lazy_converters):
+            if module_name in sys.modules:
+                del self.lazy_converters[(module_name, type_name)]
+                resolved_types[_LazyType(module_name, type_name)] = getattr(
+                    importlib.import_module(module_name), type_name
+                )
+        if not resolved_types:
+            return
+
+        # Replace the placeholders in place, so the converters keep their registration order.
+        converters = [(resolved_types.get(type_, type_), func) for type_, func in self.converters.items()]
+        self.converters.clear()
+        self.converters.update(converters)
+
     def add_converter(self, func: typing.Callable[[T, ObjectConverter], dict] | None = None):
         """
         Decorator that adds a converter to the ObjectConverter class that is wrapped.
@@ -144,6 +337,8 @@ def convert_pydantic_model(obj: pydantic.BaseModel, converter: ObjectConverter |
     Converts a pydantic model to a dict.
     """
     if converter is None:
-        converter = convert_pydantic_model
+        converter = simple_object_converter
 
-    return {key: converter(value, converter) for key, value in obj.model_dump(mode='python').items()}
+    plan = get_conversion_plan(type(obj))
+    assert plan is not None
+    return plan.convert(obj, converter)
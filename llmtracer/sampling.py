@@ -0,0 +1,201 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Sampling of traces and calls.
+
+Tail-based sampling decides at the end of a `TraceBuilder.scope` whether to keep the trace. While a sampling policy is
+set, the builder only buffers the scope's nodes: its handlers are not called until the scope ends. Kept scopes are
+then passed to the handlers (once), dropped scopes are removed from the builder without ever being serialized.
+
+    builder = build_trace(sampling_policy=AnyOf(KeepSlowTraces(1000), KeepFailedTraces()))
+
+Head sampling decides whether to record a call (or event scope) when it starts. Unsampled calls get no node: they
+only update the call count and total duration for their name in the parent node's `unsampled` property.
+
+    @trace_calls(sampler=SampleFirstThenEvery(first_n=10, every_k=100))
+    def embed(text): ...
+"""
+import bisect
+import collections
+import operator
+import random
+import time
+import typing
+from dataclasses import dataclass, field
+
+from llmtracer.trace_builder import TraceNodeBuilder
+from llmtracer.utils.tree_traversal import iter_preorder
+
+
+class SamplingPolicy:
+    def should_keep(self, scope_node: TraceNodeBuilder) -> bool:
+        """
+        Whether to keep the (finished) scope and pass it to the handlers.
+        """
+        return True
+
+
+def get_duration_ms(node: TraceNodeBuilder) -> int:
+    assert node.end_time_ms is not None
+    return node.end_time_ms - node.start_time_ms
+
+
+def iter_nodes(scope_node: TraceNodeBuilder) -> typing.Iterator[TraceNodeBuilder]:
+    return iter_preorder([scope_node], operator.attrgetter("children"))
+
+
+@dataclass
+class KeepSlowTraces(SamplingPolicy):
+    """
+    Keep scopes that took at least `min_duration_ms`.
+    """
+
+    min_duration_ms: int
+
+    def should_keep(self, scope_node: TraceNodeBuilder) -> bool:
+        return get_duration_ms(scope_node) >= self.min_duration_ms
+
+
+@dataclass
+class KeepFailedTraces(SamplingPolicy):
+    """
+    Keep scopes in which an exception was raised (by any node, even if it was caught later).
+    """
+
+    def should_keep(self, scope_node: TraceNodeBuilder) -> bool:
+        return any(
+            "exception" in node.get_properties() or (node.spilled is not None and node.spilled.has_exception)
+            for node in iter_nodes(scope_node)
+        )
+
+
+@dataclass
+class KeepLatencyOutliers(SamplingPolicy):
+    """
+    Keep scopes that contain a node that is slower than the `percentile` of the durations seen so far for its name.
+
+    The durations of the last `window` nodes per name are tracked (of all scopes, including dropped ones). Names
+    with fewer than `min_samples` durations do not cause a scope to be kept.
+    """
+
+    percentile: float = 99.0
+    window: int = 1000
+    min_samples: int = 20
+    _durations: dict[str | None, collections.deque[int]] = field(default_factory=dict, init=False, repr=False)
+    _sorted_durations: dict[str | None, list[int]] = field(default_factory=dict, init=False, repr=False)
+
+    def should_keep(self, scope_node: TraceNodeBuilder) -> bool:
+        keep = False
+        for node in iter_nodes(scope_node):
+            duration = get_duration_ms(node)
+            if self.is_outlier(node.name, duration):
+                keep = True
+            self.add_duration(node.name, duration)
+        return keep
+
+    def is_outlier(self, name: str | None, duration_ms: int) -> bool:
+        sorted_durations = self._sorted_durations.get(name)
+        if sorted_durations is None or len(sorted_durations) < self.min_samples:
+            return False
+        index = min(int(len(sorted_durations) * self.percentile / 100), len(sorted_durations) - 1)
+        return duration_ms > sorted_durations[index]
+
+    def add_duration(self, name: str | None, duration_ms: int):
+        durations = self._durations.get(name)
+        if durations is None:
+            durations = self._durations[name] = collections.deque()
+            self._sorted_durations[name] = []
+        sorted_durations = self._sorted_durations[name]
+        if len(durations) == self.window:
+            del sorted_durations[bisect.bisect_left(sorted_durations, durations.popleft())]
+        durations.append(duration_ms)
+        bisect.insort(sorted_durations, duration_ms)
+
+
+class AnyOf(SamplingPolicy):
+    """
+    Keep scopes that any of the policies wants to keep.
+
+    All policies are asked (so stateful policies like `KeepLatencyOutliers` see every scope).
+    """
+
+    policies: tuple[SamplingPolicy, ...]
+
+    def __init__(self, *policies: SamplingPolicy):
+        self.policies = policies
+
+    def should_keep(self, scope_node: TraceNodeBuilder) -> bool:
+        return any([policy.should_keep(scope_node) for policy in self.policies])
+
+
+class CallSampler:
+    def should_sample(self, name: str | None) -> bool:
+        """
+        Whether to record the call (or event scope) with the given name that is about to start.
+        """
+        return True
+
+
+@dataclass
+class SampleProbability(CallSampler):
+    """
+    Record each call with the given probability.
+    """
+
+    probability: float
+    rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    def should_sample(self, name: str | None) -> bool:
+        return self.rng.random() < self.probability
+
+
+@dataclass
+class RateLimit(CallSampler):
+    """
+    Record at most `calls_per_second` calls per name on average (with bursts of up to `burst` calls).
+
+    This is a token bucket per name.
+    """
+
+    calls_per_second: float
+    burst: int = 1
+    timer: typing.Callable[[], float] = field(default=time.monotonic, repr=False)
+    # name -> (tokens, time of the last refill)
+    _buckets: dict[str | None, tuple[float, float]] = field(default_factory=dict, init=False, repr=False)
+
+    def should_sample(self, name: str | None) -> bool:
+        now = self.timer()
+        tokens, last_time = self._buckets.get(name, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last_time) * self.calls_per_second)
+        sampled = tokens >= 1
+        self._buckets[name] = (tokens - 1 if sampled else tokens, now)
+        return sampled
+
+
+@dataclass
+class SampleFirstThenEvery(CallSampler):
+    """
+    Record the first `first_n` calls per name and then every `every_k`-th call.
+    """
+
+    first_n: int
+    every_k: int
+    _counts: collections.Counter[str | None] = field(default_factory=collections.Counter, init=False, repr=False)
+
+    def should_sample(self, name: str | None) -> bool:
+        count = self._counts[name]
+        self._counts[name] = count + 1
+        return count < self.first_n or (count - self.first_n + 1) % self.every_k == 0
@@ -0,0 +1,158 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import operator
+
+import pytest
+
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.utils.tree_traversal import iter_preorder
+
+np = pytest.importorskip("numpy")
+
+from llmtracer.analytics import flatten_trace, flatten_traces, latency_stats  # noqa: E402
+
+
+def make_node(name, start, end, children=(), kind=TraceNodeKind.CALL, exception=False, properties=None):
+    return TraceNode(
+        kind=kind,
+        name=name,
+        event_id=0,
+        start_time_ms=start,
+        end_time_ms=end,
+        delta_frame_infos=[],
+        properties=({"exception": "boom"} if exception else {}) | (properties or {}),
+        children=list(children),
+    )
+
+
+def make_trace(offset: int = 0) -> Trace:
+    root = make_node(
+        "main",
+        offset,
+        offset + 100,
+        [
+            make_node("llm", offset, offset + 10, kind=TraceNodeKind.LLM),
+            make_node(
+                "agent", offset + 10, offset + 90, [make_node("llm", offset + 20, offset + 50, kind=TraceNodeKind.LLM)]
+            ),
+            make_node("tool", offset + 90, offset + 95, kind=TraceNodeKind.TOOL, exception=True),
+        ],
+        kind=TraceNodeKind.SCOPE,
+    )
+    return Trace(name=f"trace_{offset}", traces=[root], properties={}, unique_objects={})
+
+
+def test_flatten_trace():
+    trace = make_trace()
+    flat_trace = flatten_trace(trace)
+
+    nodes = list(iter_preorder(trace.traces, operator.attrgetter("children")))
+    assert [flat_trace.names[i] for i in flat_trace.name_id] == [node.name for node in nodes]
+    assert flat_trace.parent.tolist() == [-1, 0, 0, 2, 0]
+    assert flat_trace.duration_ms.tolist() == [100, 10, 80, 30, 5]
+    assert flat_trace.self_time_ms.tolist() == [5, 10, 50, 30, 5]
+    assert flat_trace.has_exception.tolist() == [False, False, False, False, True]
+
+
+def test_latency_stats():
+    flat_trace = flatten_traces([make_trace(), make_trace(1000)])
+    assert flat_trace.trace_index.tolist() == [0] * 5 + [1] * 5
+    assert flat_trace.parent.tolist() == [-1, 0, 0, 2, 0, -1, 5, 5, 7, 5]
+
+    stats = {row["key"]: row for row in latency_stats(flat_trace).to_rows()}
+    assert stats["llm"] == dict(
+        key="llm",
+        count=4,
+        total_ms=80.0,
+        self_ms=80.0,
+        mean_ms=20.0,
+        p50_ms=pytest.approx(np.percentile([10, 30, 10, 30], 50)),
+        p95_ms=pytest.approx(np.percentile([10, 30, 10, 30], 95)),
+        p99_ms=pytest.approx(np.percentile([10, 30, 10, 30], 99)),
+        max_ms=30.0,
+        exception_count=0,
+        exception_rate=0.0,
+    )
+    assert stats["tool"]["exception_rate"] == 1.0
+    assert stats["main"]["self_ms"] == 10.0
+
+    kind_stats = latency_stats(flat_trace, group_by="kind")
+    assert set(kind_stats.keys) == {TraceNodeKind.SCOPE, TraceNodeKind.LLM, TraceNodeKind.TOOL, TraceNodeKind.CALL}
+    assert kind_stats.count.sum() == len(flat_trace)
+
+    trace_stats = latency_stats(flat_trace, group_by="trace_name")
+    assert trace_stats.keys == ["trace_0", "trace_1000"]
+    assert trace_stats.self_ms.tolist() == [100, 100]
+
+    pair_stats = latency_stats(flat_trace, group_by="kind_and_name")
+    assert (TraceNodeKind.LLM, "llm") in pair_stats.keys
+
+    assert latency_stats(flat_trace).sorted_by("total_ms").keys[0] == "main"
+
+
+def test_percentiles_match_numpy():
+    rng = np.random.default_rng(0)
+    names = [f"f{i}" for i in range(5)]
+    nodes = [make_node(names[rng.integers(5)], 0, int(rng.integers(1000))) for _ in range(500)]
+    flat_trace = flatten_trace(Trace(name=None, traces=nodes, properties={}, unique_objects={}))
+
+    stats = latency_stats(flat_trace)
+    durations = flat_trace.duration_ms
+    for i, key in enumerate(stats.keys):
+        group_durations = durations[np.array([flat_trace.names[n] for n in flat_trace.name_id]) == key]
+        for q, column in [(50, stats.p50_ms), (95, stats.p95_ms), (99, stats.p99_ms), (100, stats.max_ms)]:
+            assert column[i] == pytest.approx(np.percentile(group_durations, q))
+
+
+def test_self_time_of_concurrent_children():
+    root = make_node("main", 0, 10, [make_node("a", 0, 10), make_node("b", 0, 10)], kind=TraceNodeKind.SCOPE)
+    flat_trace = flatten_trace(Trace(name=None, traces=[root], properties={}, unique_objects={}))
+    assert flat_trace.self_time_ms.tolist() == [0, 10, 10]
+
+
+def test_aggregated_and_unsampled_calls():
+    aggregate = make_node(
+        "g",
+        0,
+        50,
+        [make_node("g", 0, 10), make_node("g", 40, 50)],
+        properties={"aggregate": {"count": 5, "total_duration_ms": 40}},
+    )
+    root = make_node(
+        "main",
+        0,
+        100,
+        [aggregate],
+        kind=TraceNodeKind.SCOPE,
+        properties={"unsampled": {"h": {"count": 3, "duration_ms": 6.0}}},
+    )
+    flat_trace = flatten_trace(Trace(name=None, traces=[root], properties={}, unique_objects={}))
+
+    # main, its unsampled h calls, the rest of the aggregated g calls and the two exemplars (as siblings).
+    assert [flat_trace.names[i] for i in flat_trace.name_id] == ["main", "h", "g", "g", "g"]
+    assert flat_trace.parent.tolist() == [-1, 0, 0, 0, 0]
+    assert flat_trace.call_count.tolist() == [1, 3, 3, 1, 1]
+    assert flat_trace.self_time_ms.tolist() == [54, 6, 20, 10, 10]
+
+    stats = {row["key"]: row for row in latency_stats(flat_trace).to_rows()}
+    assert stats["g"]["count"] == 5
+    assert stats["g"]["total_ms"] == 40
+    assert stats["g"]["mean_ms"] == 8
+    assert stats["g"]["max_ms"] == 10
+    assert stats["h"]["count"] == 3
+    assert stats["h"]["total_ms"] == 6
+    assert stats["main"]["self_ms"] == 54
@@ -0,0 +1,139 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+
+import pytest
+
+from llmtracer import build_trace, trace_calls
+from llmtracer.auto_instrumentation import AUTO_INSTRUMENTATION_SUPPORTED, auto_trace_calls
+from llmtracer.trace_schema import TraceNodeKind
+
+pytestmark = pytest.mark.skipif(not AUTO_INSTRUMENTATION_SUPPORTED, reason="requires sys.monitoring (Python 3.12+)")
+
+
+def g(x: int):
+    return json.dumps([x] * x)
+
+
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def fail():
+    raise ValueError("fail")
+
+
+def catch():
+    try:
+        fail()
+    except ValueError:
+        return "caught"
+
+
+def generate():
+    yield g(1)
+
+
+@trace_calls
+def decorated_g(x: int):
+    return json.dumps([x] * x)
+
+
+@trace_calls
+def decorated_f(n: int):
+    return [decorated_g(i) for i in range(n)]
+
+
+def get_call_tree(node) -> list:
+    return [(child.name, child.kind, get_call_tree(child)) for child in node.children]
+
+
+def test_auto_trace_calls():
+    builder = build_trace(module_filters=__name__)
+    with auto_trace_calls(__name__), builder.scope():
+        f(2)
+        catch()
+        list(generate())
+    (scope,) = builder.build().traces
+
+    assert get_call_tree(scope) == [
+        ("f", TraceNodeKind.CALL, [("g", TraceNodeKind.CALL, []), ("g", TraceNodeKind.CALL, [])]),
+        ("catch", TraceNodeKind.CALL, [("fail", TraceNodeKind.CALL, [])]),
+        # Generators are not traced, but the calls they make are.
+        ("g", TraceNodeKind.CALL, []),
+    ]
+    fail_node = scope.children[1].children[0]
+    assert "ValueError: fail" in fail_node.properties["exception"]
+    assert "exception" not in scope.children[1].properties
+
+
+def test_auto_trace_calls_matches_decorator():
+    builder = build_trace(module_filters=__name__)
+    with auto_trace_calls(__name__), builder.scope():
+        f(2)
+    (auto_f,) = builder.build().traces[0].children
+
+    builder = build_trace(module_filters=__name__)
+    with builder.scope():
+        decorated_f(2)
+    (decorated_f_node,) = builder.build().traces[0].children
+
+    # The frame infos start at the call site, like with `trace_calls`.
+    for auto_node, decorated_node in zip([auto_f, *auto_f.children], [decorated_f_node, *decorated_f_node.children]):
+        assert [frame_info.function for frame_info in auto_node.delta_frame_infos] == [
+            frame_info.function.removeprefix("decorated_") for frame_info in decorated_node.delta_frame_infos
+        ]
+
+
+def test_auto_trace_calls_with_decorated_functions():
+    builder = build_trace(module_filters=__name__)
+    with auto_trace_calls(__name__), builder.scope():
+        decorated_f(2)
+        f(1)
+    (scope,) = builder.build().traces
+
+    # The decorated functions get one node each (from their decorator).
+    assert get_call_tree(scope) == [
+        (
+            "decorated_f",
+            TraceNodeKind.CALL,
+            [("decorated_g", TraceNodeKind.CALL, []), ("decorated_g", TraceNodeKind.CALL, [])],
+        ),
+        ("f", TraceNodeKind.CALL, [("g", TraceNodeKind.CALL, [])]),
+    ]
+
+
+def test_auto_trace_calls_outside_of_filters():
+    builder = build_trace(module_filters=__name__)
+    with auto_trace_calls("some_other_module"), builder.scope():
+        f(2)
+    assert builder.build().traces[0].children == []
+
+
+def test_auto_trace_calls_without_builder():
+    with auto_trace_calls(__name__):
+        assert f(2) == ["[]", "[1]"]
+    # The tool id is released again.
+    with auto_trace_calls(__name__):
+        pass
+
+
+def test_auto_trace_calls_forgets_closed_nodes():
+    builder = build_trace(module_filters=__name__)
+    with auto_trace_calls(__name__) as instrumentation, builder.scope():
+        f(2)
+        catch()
+        assert instrumentation._open_nodes == {}
@@ -0,0 +1,212 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import operator
+
+import pytest
+
+from llmtracer import JsonFileWriter, Trace, build_trace, trace_calls
+from llmtracer.tools.cli import main, merge_traces, strip_trace_extension
+from llmtracer.trace_index import TraceFileReader
+from llmtracer.trace_loader import load_trace_file, skipped_property_placeholder
+from llmtracer.trace_schema import TraceNode, TraceNodeKind
+from llmtracer.trace_serializer import dumps_trace
+from llmtracer.utils.tree_traversal import iter_preorder
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def g(x: int):
+    return "g" * 100 * x
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def get_node_summary(node):
+    return node.name, node.start_time_ms, node.properties, len(node.children)
+
+
+def write_example_traces(tmp_path, num_traces: int = 3) -> list[str]:
+    filenames = []
+    for i in range(num_traces):
+        filename = str(tmp_path / f"run_{i}.json")
+        builder = build_trace(name=f"run_{i}", module_filters=__name__)
+        builder.event_handlers.append(JsonFileWriter(filename))
+        with builder.scope():
+            f(i + 1)
+        filenames.append(filename)
+    return filenames
+
+
+def test_strip_trace_extension():
+    assert strip_trace_extension("a/run.json.gz") == "a/run"
+    assert strip_trace_extension("run.llmtc") == "run"
+    assert strip_trace_extension("run.custom.json") == "run"
+    assert strip_trace_extension("run.dedup.json") == "run"
+    assert strip_trace_extension("run.txt") == "run"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_merge(tmp_path, jobs):
+    filenames = write_example_traces(tmp_path)
+    output = str(tmp_path / "merged.json")
+    main(["merge", "-o", output, "-j", str(jobs), *filenames])
+
+    merged_trace = Trace.load_file(output)
+    assert merged_trace.name == "merged"
+    assert merged_trace.properties == {"merged_files": filenames}
+    assert [node.name for node in merged_trace.traces] == ["run_0", "run_1", "run_2"]
+
+    # The event ids are unique, and the subtrees are unchanged otherwise.
+    event_id_map = merged_trace.build_event_id_map()
+    assert len(event_id_map) == 3 + sum(len(Trace.load_file(filename).build_event_id_map()) for filename in filenames)
+    for scope, filename in zip(merged_trace.traces, filenames):
+        trace = Trace.load_file(filename)
+        assert scope.properties["source_file"] == filename
+        assert [get_node_summary(node) for node in iter_preorder(scope.children, operator.attrgetter("children"))] == [
+            get_node_summary(node) for node in iter_preorder(trace.traces, operator.attrgetter("children"))
+        ]
+
+    # The merged file is indexed, too.
+    with TraceFileReader(output) as reader:
+        assert reader.load_node(merged_trace.traces[1].event_id) == merged_trace.traces[1]
+
+
+def test_merge_deep_traces(tmp_path):
+    # Deeper than the recursion limit, so the workers must not pickle the node trees.
+    depth = 3000
+    filenames = []
+    for i in range(2):
+        node = None
+        for event_id in reversed(range(depth)):
+            node = TraceNode(
+                kind=TraceNodeKind.CALL,
+                name=f"level_{event_id}",
+                event_id=event_id,
+                start_time_ms=event_id,
+                end_time_ms=2 * depth - event_id,
+                delta_frame_infos=[],
+                properties={},
+                children=[] if node is None else [node],
+            )
+        filename = str(tmp_path / f"deep_{i}.json")
+        with open(filename, "wb") as f:
+            f.write(dumps_trace(Trace(name=f"deep_{i}", traces=[node], properties={}, unique_objects={})))
+        filenames.append(filename)
+
+    output = str(tmp_path / "merged.json")
+    main(["merge", "-o", output, "-j", "2", *filenames])
+
+    merged_trace = load_trace_file(output)
+    for scope in merged_trace.traces:
+        names = [node.name for node in iter_preorder(scope.children, operator.attrgetter("children"))]
+        assert names == [f"level_{level}" for level in range(depth)]
+
+
+def test_merge_traces_copies_nodes(tmp_path):
+    traces = [Trace.load_file(filename) for filename in write_example_traces(tmp_path)]
+    event_ids = [list(trace.build_event_id_map()) for trace in traces]
+
+    unique_objects: dict[str, object] = {}
+    merged = list(merge_traces([(f"run_{i}", trace) for i, trace in enumerate(traces)], unique_objects))
+
+    assert [list(trace.build_event_id_map()) for trace in traces] == event_ids
+    merged_event_ids = [node.event_id for node in iter_preorder(merged, operator.attrgetter("children"))]
+    assert len(set(merged_event_ids)) == len(merged_event_ids)
+
+
+def test_merge_traces_unique_object_collision(tmp_path):
+    trace = Trace.load_file(write_example_traces(tmp_path)[0])
+    same = trace.model_copy(update=dict(unique_objects={"model": {"name": "a"}}))
+    other = trace.model_copy(update=dict(unique_objects={"model": {"name": "b"}}))
+
+    unique_objects: dict[str, object] = {}
+    list(merge_traces([("a.json", same), ("a_again.json", same)], unique_objects))
+    assert unique_objects == {"model": {"name": "a"}}
+
+    with pytest.raises(ValueError, match="model"):
+        list(merge_traces([("a.json", same), ("b.json", other)], {}))
+
+
+@pytest.mark.parametrize("to", ["json", "json.gz", "json.zst", "columnar", "custom", "dedup"])
+def test_convert(tmp_path, to):
+    if to == "json.zst":
+        pytest.importorskip("zstandard")
+    if to == "columnar":
+        pytest.importorskip("numpy")
+
+    filenames = write_example_traces(tmp_path)
+    output_dir = tmp_path / "converted"
+    output_dir.mkdir()
+    main(["convert", "--to", to, "--output-dir", str(output_dir), "-j", "1", *filenames])
+
+    for i, filename in enumerate(filenames):
+        trace = Trace.load_file(filename)
+        extensions = {"columnar": ".llmtc", "custom": ".custom.json", "dedup": ".dedup.json"}
+        output_filename = str(output_dir / f"run_{i}") + extensions.get(to, "." + to)
+        if to == "custom":
+            with open(output_filename) as f:
+                custom_dict = json.load(f)
+            assert custom_dict["traces"] == [
+                node.to_custom_dict(include_timing=False, include_lineno=False) for node in trace.traces
+            ]
+        elif to == "columnar":
+            from llmtracer.columnar import ColumnarTrace
+
+            with ColumnarTrace(output_filename) as columnar_trace:
+                assert columnar_trace.to_trace() == trace
+        else:
+            assert Trace.load_file(output_filename) == trace
+
+
+def test_slim(tmp_path):
+    filename = write_example_traces(tmp_path, num_traces=2)[1]
+    main(["slim", "--drop-frame-infos", "--max-property-size", "50", "-j", "1", filename])
+
+    slim_trace = Trace.load_file(tmp_path / "run_1.slim.json")
+    trace = Trace.load_file(filename)
+    g_node = trace.traces[0].children[0].children[1]
+    slim_g_node = slim_trace.traces[0].children[0].children[1]
+    assert slim_g_node.delta_frame_infos == []
+    assert slim_g_node.properties["arguments"] == g_node.properties["arguments"]
+    assert slim_g_node.properties["result"] == skipped_property_placeholder(
+        len(json.dumps(g_node.properties["result"]))
+    )
+
+
+def test_summarize(tmp_path, capsys):
+    pytest.importorskip("numpy")
+    filenames = write_example_traces(tmp_path)
+    main(["summarize", "--json", "-j", "1", *filenames])
+    captured = capsys.readouterr()
+
+    summary = json.loads(captured.out)
+    assert summary["total"]["num_files"] == 3
+    assert summary["total"]["names"]["g"]["count"] == 1 + 2 + 3
+    assert summary["total"]["names"]["f"]["count"] == 3
+    assert summary["files"][filenames[1]]["kinds"]["CALL"]["count"] == 1 + 2
+    f_stats = summary["total"]["names"]["f"]
+    assert 0 <= f_stats["self_ms"] <= f_stats["total_ms"]
+    assert "summarize: 3 files" in captured.err
+
+
+def test_refuses_to_overwrite_inputs(tmp_path):
+    (filename,) = write_example_traces(tmp_path, num_traces=1)
+    with pytest.raises(SystemExit):
+        main(["convert", "--to", "json", "-j", "1", filename])
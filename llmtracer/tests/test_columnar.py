@@ -0,0 +1,98 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from llmtracer import build_trace, trace_calls
+from llmtracer.trace_schema import TraceNodeKind
+
+np = pytest.importorskip("numpy")
+
+from llmtracer.columnar import ColumnarTrace, write_columnar_trace  # noqa: E402
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def g(x: int):
+    return [x] * x
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def build_example_trace():
+    builder = build_trace(name="columnar", module_filters=__name__)
+    with builder.scope():
+        f(3)
+        f(2)
+    return builder.build()
+
+
+def test_columnar_roundtrip(tmp_path):
+    trace = build_example_trace()
+    filename = tmp_path / "trace.llmtc"
+    write_columnar_trace(trace, filename)
+
+    with ColumnarTrace(filename) as columnar_trace:
+        assert columnar_trace.num_nodes == len(trace.build_event_id_map())
+        assert columnar_trace.to_trace() == trace
+
+
+def test_columnar_columns(tmp_path):
+    trace = build_example_trace()
+    filename = tmp_path / "trace.llmtc"
+    write_columnar_trace(trace, filename)
+
+    with ColumnarTrace(filename) as columnar_trace:
+        # Pre-order: the scope, then f(3) with its three g calls, then f(2) with its two g calls.
+        names = [columnar_trace.get_name(i) for i in range(columnar_trace.num_nodes)]
+        assert names == [None, "f", "g", "g", "g", "f", "g", "g"]
+        assert columnar_trace.parent.tolist() == [-1, 0, 1, 1, 1, 0, 5, 5]
+        assert columnar_trace.depth.tolist() == [0, 1, 2, 2, 2, 1, 2, 2]
+        assert columnar_trace.subtree_end.tolist() == [8, 5, 3, 4, 5, 8, 7, 8]
+        assert columnar_trace.get_children(0).tolist() == [1, 5]
+        assert columnar_trace.get_properties(2) == trace.traces[0].children[0].children[0].properties
+        assert columnar_trace.get_frame_infos(1) == trace.traces[0].children[0].delta_frame_infos
+
+        durations = columnar_trace.duration_ms
+        assert columnar_trace.total_time_by_name().get("g", 0) == durations[np.array(names) == "g"].sum()
+        assert sum(columnar_trace.total_time_by_kind().values()) == durations.sum()
+        assert set(columnar_trace.total_time_by_kind()) <= {TraceNodeKind.SCOPE, TraceNodeKind.CALL}
+
+
+def test_columnar_close(tmp_path):
+    filename = tmp_path / "trace.llmtc"
+    write_columnar_trace(build_example_trace(), filename)
+
+    columnar_trace = ColumnarTrace(filename)
+    columnar_trace.close()
+    assert columnar_trace._mmap.closed
+
+    # Arrays that are still referenced keep the map alive.
+    columnar_trace = ColumnarTrace(filename)
+    start_time_ms = columnar_trace.start_time_ms
+    expected = start_time_ms.copy()
+    columnar_trace.close()
+    assert not columnar_trace._mmap.closed
+    assert (start_time_ms == expected).all()
+
+
+def test_not_a_columnar_trace(tmp_path):
+    filename = tmp_path / "trace.json"
+    filename.write_bytes(b"{}" * 10)
+    with pytest.raises(ValueError):
+        ColumnarTrace(filename)
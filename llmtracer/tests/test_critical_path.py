@@ -0,0 +1,117 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from xml.etree import ElementTree
+
+from llmtracer.critical_path import analyze_critical_path, find_critical_chain
+from llmtracer.handlers.svg_writer import create_svg_from_trace
+from llmtracer.trace_schema import MARKS_PROPERTY, Trace, TraceNode, TraceNodeKind
+
+_next_event_id = 0
+
+
+def make_node(name, start, end, children=()):
+    global _next_event_id
+    _next_event_id += 1
+    return TraceNode(
+        kind=TraceNodeKind.CALL,
+        name=name,
+        event_id=_next_event_id,
+        start_time_ms=start,
+        end_time_ms=end,
+        delta_frame_infos=[],
+        properties={},
+        children=list(children),
+    )
+
+
+def test_find_critical_chain():
+    # a and b run in parallel; c waits for b; d runs in parallel to c and ends before it.
+    a = make_node("a", 0, 10)
+    b = make_node("b", 0, 20)
+    c = make_node("c", 25, 50)
+    d = make_node("d", 30, 40)
+    assert find_critical_chain([a, b, c, d]) == [b, c]
+    assert find_critical_chain([]) == []
+
+    # Zero-length nodes at the same time must not loop.
+    e = make_node("e", 5, 5)
+    f = make_node("f", 5, 5)
+    # With the same start, too, the first of them (in the given order) ends the chain, and nothing comes before it.
+    assert find_critical_chain([e, f]) == [e]
+    assert find_critical_chain([f, e]) == [f]
+
+    # Among nodes with the same end, the one that started first is on the chain.
+    g = make_node("g", 10, 20)
+    h = make_node("h", 0, 20)
+    i = make_node("i", 15, 20)
+    assert find_critical_chain([g, h, i]) == [h]
+
+
+def test_analyze_critical_path():
+    a = make_node("a", 0, 10)
+    b = make_node("b", 0, 20)
+    b_inner = make_node("b_inner", 2, 15)
+    b.children.append(b_inner)
+    c = make_node("c", 25, 50)
+    d = make_node("d", 30, 40, [make_node("d_inner", 31, 35)])
+    root = make_node("root", 0, 55, [a, b, c, d])
+    trace = Trace(name=None, traces=[root], properties={}, unique_objects={})
+
+    analysis = analyze_critical_path(trace.traces)
+    assert [node.name for node in analysis.get_critical_path()] == ["root", "b", "b_inner", "c"]
+    assert analysis.get_critical_path(d) == d.children
+
+    slack = {node.name: analysis.slack_ms[node.event_id] for node in [root, a, b, b_inner, c, d, d.children[0]]}
+    # a is needed by c (the next node on the path), d by the end of the root.
+    assert slack == {"root": 0, "a": 25 - 10, "b": 0, "b_inner": 0, "c": 0, "d": 55 - 40, "d_inner": 55 - 40}
+    assert all(analysis.is_critical(node) for node in analysis.get_critical_path())
+    assert analysis.is_critical(root)
+    assert not analysis.is_critical(a)
+
+
+def test_svg_highlights_critical_path():
+    a = make_node("a", 0, 10)
+    b = make_node("b", 0, 20)
+    trace = Trace(name=None, traces=[make_node("root", 0, 20, [a, b])], properties={}, unique_objects={})
+
+    svg = create_svg_from_trace(trace).tostring()
+    assert 'data-slack-ms="10"' in svg
+    assert svg.count('stroke="#6c71c4"') == 2
+    assert "data-slack-ms" not in create_svg_from_trace(trace, highlight_critical_path=False).tostring()
+
+
+def test_svg_zero_length_parent():
+    child = make_node("child", 5, 5)
+    root = make_node("root", 5, 5, [child])
+    trace = Trace(name=None, traces=[root], properties={}, unique_objects={})
+
+    svg = ElementTree.fromstring(create_svg_from_trace(trace).tostring())
+    node_groups = [element for element in svg.iter() if "data-raw" in element.attrib]
+    assert [element.get("id") for element in node_groups] == [str(root.event_id), str(child.event_id)]
+    assert [json.loads(element.get("data-raw"))["name"] for element in node_groups] == ["root", "child"]
+    # The child is nested in the root and collapsed (instead of dividing by the zero duration of the root).
+    assert node_groups[1] in list(node_groups[0])
+    assert (node_groups[1].get("x"), node_groups[1].get("width")) == ("0.0%", "0.0%")
+
+
+def test_svg_marks():
+    trace = Trace(name=None, traces=[make_node("root", 0, 10)], properties={}, unique_objects={})
+    trace.traces[0].properties[MARKS_PROPERTY] = {"names": ["retry"], "name_ids": [0, 0], "offset_ms": [2.5, 5.0]}
+    svg = create_svg_from_trace(trace).tostring()
+    assert svg.count("<title>retry</title>") == 2
+    assert 'x1="49.750%"' in svg
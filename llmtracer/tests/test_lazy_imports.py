@@ -0,0 +1,50 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import llmtracer
+from llmtracer.trace_builder import trace_object_converter
+
+HEAVY_MODULES = ["wandb", "langchain", "langchain_core", "reflex", "requests", "svgwrite", "starlette"]
+
+
+def test_import_does_not_load_heavy_modules():
+    # Use a fresh interpreter, so that other tests cannot have imported anything already.
+    code = (
+        "import sys, llmtracer\n"
+        "loaded = sorted({name.split('.')[0] for name in sys.modules} & set(sys.argv[1:]))\n"
+        "print(','.join(loaded))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(llmtracer.__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", code, *HEAVY_MODULES], check=True, capture_output=True, text=True, env=env
+    )
+    assert result.stdout.strip() == ""
+
+
+def test_lazy_langchain_converter():
+    messages = pytest.importorskip("langchain_core.messages")
+
+    message = messages.AIMessage(content="Hello", foo="bar")
+    converted = trace_object_converter(message)
+    assert converted["content"] == "Hello"
+    assert converted["type"] == "ai"
+    assert converted["foo"] == "bar"
@@ -14,11 +14,15 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import gc
+import sys
+import types
+import weakref
 from dataclasses import dataclass
 
 import pydantic
 
-from llmtracer.object_converter import DynamicObjectConverter, ObjectConverter
+from llmtracer.object_converter import DynamicObjectConverter, ObjectConverter, _conversion_plans, get_conversion_plan
 
 
 def test_object_converter():
@@ -74,3 +78,96 @@ def test_object_converter():
 
     # convert a nested object
     assert converter({'a': Test(1, '2')}) == {'a': {'a': 2, 'b': '2'}}
+
+
+def test_conversion_plans():
+    @dataclass
+    class Point:
+        x: int
+        y: int
+
+    class Model(pydantic.BaseModel, extra='allow'):
+        a: int
+        hidden: str = pydantic.Field('secret', exclude=True)
+
+        @pydantic.computed_field  # type: ignore
+        @property
+        def double_a(self) -> int:
+            return self.a * 2
+
+    class SerializedModel(pydantic.BaseModel):
+        a: int
+
+        @pydantic.field_serializer('a')
+        def serialize_a(self, a: int):
+            return a + 1
+
+    converter = DynamicObjectConverter()
+
+    assert get_conversion_plan(Point).field_names == ('x', 'y')
+    assert get_conversion_plan(Point) is get_conversion_plan(Point)
+    assert get_conversion_plan(list) is None
+
+    model = Model(a=1, point=Point(1, 2))
+    assert converter(model) == {'a': 1, 'double_a': 2, 'point': {'x': 1, 'y': 2}}
+    assert converter(model) == {key: converter(value) for key, value in model.model_dump(mode='python').items()}
+
+    assert get_conversion_plan(SerializedModel).use_model_dump
+    assert converter(SerializedModel(a=1)) == {'a': 2}
+
+
+def test_dispatch_cache_is_invalidated():
+    @dataclass
+    class Test:
+        a: int
+
+    converter = DynamicObjectConverter()
+    assert converter(Test(1)) == {'a': 1}
+
+    converter.register_converter(lambda test, _: {'b': test.a}, Test)
+    assert converter(Test(1)) == {'b': 1}
+
+    # Modifying the converters directly also invalidates the cache.
+    converter.converters[Test] = lambda test, _: {'c': test.a}
+    assert converter(Test(1)) == {'c': 1}
+    del converter.converters[Test]
+    assert converter(Test(1)) == {'a': 1}
+
+
+def test_conversion_plans_do_not_keep_classes_alive():
+    @dataclass
+    class Dynamic:
+        a: int
+
+    converter = DynamicObjectConverter()
+    assert converter(Dynamic(1)) == {'a': 1}
+    assert Dynamic in _conversion_plans
+
+    class_ref = weakref.ref(Dynamic)
+    del Dynamic
+    gc.collect()
+    assert class_ref() is None
+
+
+def test_lazy_converter_keeps_registration_order(monkeypatch):
+    module = types.ModuleType("lazy_test_module")
+
+    class Base:
+        pass
+
+    class Sub(Base):
+        pass
+
+    module.Base = Base  # type: ignore
+
+    converter = DynamicObjectConverter()
+    converter.register_lazy_converter(lambda obj, _: "lazy-base", "lazy_test_module", "Base")
+    converter.register_converter(lambda obj, _: "custom-sub", Sub)
+    assert converter(Sub()) == "custom-sub"
+
+    # Resolving the lazy converter once its module is imported must not give it precedence over later ones.
+    monkeypatch.setitem(sys.modules, "lazy_test_module", module)
+    assert converter(Base()) == "lazy-base"
+    assert converter(Sub()) == "custom-sub"
+    assert list(converter.converters) == [Base, Sub]
+    assert not converter.lazy_converters
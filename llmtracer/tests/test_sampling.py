@@ -0,0 +1,195 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import random
+
+import pytest
+
+from llmtracer import build_trace, event_scope, trace_calls
+from llmtracer.sampling import (
+    AnyOf,
+    KeepFailedTraces,
+    KeepLatencyOutliers,
+    KeepSlowTraces,
+    RateLimit,
+    SampleFirstThenEvery,
+    SampleProbability,
+)
+from llmtracer.trace_builder import TraceBuilderEventHandler, TraceNodeBuilder
+from llmtracer.trace_schema import TraceNodeKind
+
+
+class CountingHandler(TraceBuilderEventHandler):
+    def __init__(self):
+        self.num_event_scope_final = 0
+        self.num_scope_final = 0
+        self.num_traces = []
+
+    def on_event_scope_final(self, builder):
+        self.num_event_scope_final += 1
+        self.num_traces.append(len(builder.build().traces))
+
+    def on_scope_final(self, builder):
+        self.num_scope_final += 1
+
+
+def run_scope(builder, name: str, fail: bool = False, caught: bool = False):
+    try:
+        with builder.scope(name):
+            with event_scope("llm"):
+                with event_scope("prompt"):
+                    pass
+                if caught:
+                    try:
+                        with event_scope("retry"):
+                            raise ValueError("retry")
+                    except ValueError:
+                        pass
+            if fail:
+                raise ValueError("fail")
+    except ValueError:
+        pass
+
+
+def test_keep_failed_traces():
+    handler = CountingHandler()
+    builder = build_trace(module_filters=__name__, sampling_policy=KeepFailedTraces())
+    builder.event_handlers.append(handler)
+
+    run_scope(builder, "ok")
+    # Dropped scopes never reach the handlers.
+    assert handler.num_event_scope_final == 0
+    assert handler.num_scope_final == 0
+
+    run_scope(builder, "failed", fail=True)
+    run_scope(builder, "caught", caught=True)
+    run_scope(builder, "ok2")
+
+    assert [trace.name for trace in builder.build().traces] == ["failed", "caught"]
+    # Kept scopes are passed to the handlers once.
+    assert handler.num_event_scope_final == 2
+    assert handler.num_scope_final == 2
+    assert handler.num_traces == [1, 2]
+
+
+def test_without_sampling_policy():
+    handler = CountingHandler()
+    builder = build_trace(module_filters=__name__)
+    builder.event_handlers.append(handler)
+    run_scope(builder, "ok")
+    assert handler.num_event_scope_final == 3
+    assert handler.num_scope_final == 1
+
+
+def create_node(name: str, duration_ms: int, children=()) -> TraceNodeBuilder:
+    node = TraceNodeBuilder(
+        kind=TraceNodeKind.SCOPE,
+        name=name,
+        event_id=0,
+        start_time_ms=0,
+        end_time_ms=duration_ms,
+        delta_frame_infos=[],
+        stack_height=0,
+    )
+    node.children.extend(children)
+    return node
+
+
+def test_keep_slow_traces():
+    policy = KeepSlowTraces(min_duration_ms=100)
+    assert policy.should_keep(create_node("scope", 100))
+    assert not policy.should_keep(create_node("scope", 99))
+
+
+def test_keep_latency_outliers():
+    policy = KeepLatencyOutliers(percentile=90, window=10, min_samples=5)
+    # Not enough samples yet.
+    assert not policy.should_keep(create_node("scope", 10, [create_node("llm", 1000)]))
+    for _ in range(10):
+        assert not policy.should_keep(create_node("scope", 10, [create_node("llm", 5)]))
+    assert policy.should_keep(create_node("scope", 10, [create_node("llm", 6)]))
+    assert not policy.should_keep(create_node("scope", 10, [create_node("llm", 5)]))
+
+    # Only the last `window` durations count.
+    for _ in range(10):
+        policy.should_keep(create_node("scope", 10, [create_node("llm", 100)]))
+    assert not policy.should_keep(create_node("scope", 10, [create_node("llm", 50)]))
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_any_of(fail: bool):
+    outliers = KeepLatencyOutliers(min_samples=1)
+    builder = build_trace(module_filters=__name__, sampling_policy=AnyOf(KeepFailedTraces(), outliers))
+    run_scope(builder, "scope", fail=fail)
+    # All policies see every scope.
+    assert set(outliers._durations) == {"scope", "llm", "prompt"}
+    assert len(builder.build().traces) == int(fail)
+
+
+def test_sample_first_then_every():
+    sampler = SampleFirstThenEvery(first_n=2, every_k=3)
+    assert [sampler.should_sample("f") for _ in range(8)] == [True, True, False, False, True, False, False, True]
+    # Calls are counted per name.
+    assert sampler.should_sample("g")
+
+
+def test_rate_limit():
+    now = 0.0
+    sampler = RateLimit(calls_per_second=2, burst=2, timer=lambda: now)
+    assert [sampler.should_sample("f") for _ in range(3)] == [True, True, False]
+    assert sampler.should_sample("g")
+    now = 0.5
+    assert [sampler.should_sample("f") for _ in range(2)] == [True, False]
+    now = 10.0
+    assert [sampler.should_sample("f") for _ in range(3)] == [True, True, False]
+
+
+def test_sample_probability():
+    sampler = SampleProbability(0.25, rng=random.Random(0))
+    num_sampled = sum(sampler.should_sample("f") for _ in range(1000))
+    assert 200 < num_sampled < 300
+
+
+@trace_calls(capture_args=True, sampler=SampleFirstThenEvery(first_n=1, every_k=3))
+def sampled_call(x: int):
+    return x
+
+
+def test_trace_calls_sampler():
+    builder = build_trace(module_filters=__name__)
+    with builder.scope():
+        assert [sampled_call(i) for i in range(5)] == list(range(5))
+    (scope,) = builder.build().traces
+
+    assert [child.properties["arguments"] for child in scope.children] == [{"x": 0}, {"x": 3}]
+    unsampled = scope.properties["unsampled"]
+    assert list(unsampled) == ["sampled_call"]
+    assert unsampled["sampled_call"]["count"] == 3
+    assert unsampled["sampled_call"]["duration_ms"] >= 0
+
+
+def test_event_scope_sampler():
+    sampler = SampleFirstThenEvery(first_n=1, every_k=100)
+    builder = build_trace(module_filters=__name__)
+    with builder.scope():
+        with event_scope("outer"):
+            for _ in range(3):
+                with event_scope("inner", sampler=sampler):
+                    pass
+    (scope,) = builder.build().traces
+    (outer,) = scope.children
+
+    assert [child.name for child in outer.children] == ["inner"]
+    assert outer.properties["unsampled"]["inner"]["count"] == 2
@@ -14,7 +14,16 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from llmtracer import build_trace, event_scope, trace_calls
+import contextlib
+import json
+
+import pytest
+
+from llmtracer import build_trace, event_scope, mark, register_object, trace_calls
+from llmtracer.frame_info import FrameInfo, FrameInfoTable
+from llmtracer.trace_builder import CapturedException, SiblingAggregate, TraceNodeBuilder, get_duration_histogram_bucket
+from llmtracer.trace_schema import MARKS_PROPERTY, TraceNodeKind
+from llmtracer.trace_serializer import dumps_trace, dumps_trace_builder
 
 
 def test_trace():
@@ -105,3 +114,240 @@ def test_trace_calls():
             'properties': {},
         }
     ]
+
+
+def test_register_object():
+    shared_list = [1, 2, 3]
+
+    @trace_calls(capture_args=True)
+    def f(value):
+        pass
+
+    with build_trace(module_filters=__name__, stack_frame_context=0).scope() as builder:
+        register_object(shared_list, "shared_list", {"length": 3})
+        f(shared_list)
+        f([1, 2, 3])
+
+    trace = builder.build()
+    assert trace.unique_objects == {"shared_list": {"length": 3}}
+    assert [node.properties for node in trace.traces[0].children] == [
+        {'arguments': {'value': {'unique_object': 'shared_list'}}},
+        {'arguments': {'value': [1, 2, 3]}},
+    ]
+
+
+def test_deep_trace():
+    depth = 2000
+
+    with build_trace(module_filters=__name__, stack_frame_context=0).scope() as builder:
+        # Enter the scopes iteratively, so the traced program itself does not hit the recursion limit.
+        with contextlib.ExitStack() as stack:
+            for i in range(depth):
+                stack.enter_context(event_scope(f"level_{i}"))
+
+    trace = builder.build()
+    event_id_map = trace.build_event_id_map()
+    assert len(event_id_map) == depth + 1
+    assert event_id_map[depth + 1].name == f"level_{depth - 1}"
+
+    custom_dict = trace.to_custom_dict()['traces'][0]
+    for _ in range(depth):
+        custom_dict = custom_dict['children'][0]
+    assert custom_dict['name'] == f"level_{depth - 1}"
+
+    assert dumps_trace_builder(builder).count(b'"children":[') == depth + 1
+
+
+@trace_calls(capture_args=True)
+def repeated_call(i: int):
+    return i
+
+
+def test_trace_calls_wrong_signature():
+    with build_trace(module_filters=__name__).scope() as builder:
+        with pytest.raises(TypeError):
+            repeated_call(1, 2)
+    # The arguments are bound before the node is created.
+    assert builder.build().traces[0].children == []
+
+
+def test_frame_info_table():
+    table = FrameInfoTable()
+    frame_info = table.intern("module", 1, "f", ["f()\n"], 0)
+    assert table.intern("module", 1, "f", ["f()\n"], 0) is frame_info
+    assert table.intern("module", 2, "f", ["f()\n"], 0) is not frame_info
+    assert table.get_id(frame_info) == 0
+    # Equal frame infos from elsewhere map to the same id.
+    assert table.get_id(FrameInfo(module="module", lineno=1, function="f", code_context=["f()\n"], index=0)) == 0
+    assert len(table) == 2
+
+
+def test_shared_frame_infos():
+    with build_trace(module_filters=__name__).scope() as builder:
+        for _ in range(3):
+            with event_scope("loop"):
+                pass
+
+    loop_nodes = builder.build().traces[0].children
+    assert len(loop_nodes) == 3
+    assert all(node.delta_frame_infos[0] is loop_nodes[0].delta_frame_infos[0] for node in loop_nodes)
+
+
+def test_finished_nodes_drop_their_parent():
+    with build_trace(module_filters=__name__).scope() as builder:
+        with event_scope("outer"):
+            outer = builder.current_event_node
+            with event_scope("inner"):
+                inner = builder.current_event_node
+                assert inner.parent is outer
+            # The parent link is cleared when the node finishes, even though its parent is still open.
+            assert inner.parent is None
+            assert outer.parent is not None
+            assert outer.children == [inner]
+    assert outer.parent is None
+
+
+def test_node_properties():
+    node = TraceNodeBuilder(
+        kind=TraceNodeKind.CALL,
+        name="f",
+        event_id=1,
+        start_time_ms=0,
+        delta_frame_infos=[],
+        stack_height=0,
+        properties={"a": 1},
+    )
+    assert node.get_properties() == {"a": 1}
+
+    node = TraceNodeBuilder.create_root()
+    assert node.get_properties() == {}
+    assert node._properties is None
+    node.properties["a"] = 1
+    assert node.get_properties() == {"a": 1}
+
+
+def test_compact_nodes():
+    with build_trace(module_filters=__name__).scope() as builder:
+        with event_scope("outer"):
+            outer = builder.current_event_node
+            assert outer.parent is not None
+            with event_scope("inner", properties=dict(tag="a")):
+                inner = builder.current_event_node
+
+    assert not hasattr(outer, "__dict__")
+    # Finished nodes drop their parent (no reference cycles), and properties are only allocated when needed.
+    assert outer.parent is None and inner.parent is None
+    assert outer._properties is None
+    assert outer.get_properties() == {} and outer._properties is None
+    assert inner.get_properties() == {"tag": "a"}
+    outer.properties["late"] = 1
+    assert builder.build().traces[0].children[0].properties == {"late": 1}
+
+
+def test_nested_exception_is_captured_once():
+    with build_trace(module_filters=__name__).scope() as builder:
+        try:
+            with event_scope("outer"):
+                outer = builder.current_event_node
+                with event_scope("inner"):
+                    inner = builder.current_event_node
+                    raise ValueError("failed")
+        except ValueError as e:
+            assert builder._propagating_exception[0] is e
+        # The next event drops the handled exception (and so the frames of its traceback).
+        with event_scope("after"):
+            assert builder._propagating_exception is None
+
+    captured = inner.properties["exception"]
+    assert isinstance(captured, CapturedException)
+    assert outer.properties["exception"] is captured
+
+    trace = builder.build()
+    outer_node = trace.traces[0].children[0]
+    assert isinstance(outer_node.properties["exception"], str)
+    assert 'raise ValueError("failed")' in outer_node.properties["exception"]
+    assert outer_node.children[0].properties["exception"] == outer_node.properties["exception"]
+    assert json.loads(dumps_trace_builder(builder))["traces"][0]["children"][0]["properties"] == outer_node.properties
+
+
+def test_mark():
+    with build_trace(module_filters=__name__).scope() as builder:
+        with event_scope("stream", properties={"marks": "user"}):
+            node = builder.current_event_node
+            mark("token", "a")
+            mark("retry")
+            mark("token", {"index": 2})
+        num_frame_infos = len(builder.frame_info_table)
+
+    # Marks create no nodes (and capture no frames).
+    assert node.children == [] and len(builder.frame_info_table) == num_frame_infos
+    (stream,) = builder.build().traces[0].children
+    assert stream.properties[MARKS_PROPERTY]["names"] == ["token", "retry"]
+    assert stream.properties[MARKS_PROPERTY]["name_ids"] == [0, 1, 0]
+    # The marks do not clash with a user property of the same name.
+    assert stream.properties["marks"] == "user"
+    marks = stream.get_marks()
+    assert [(name, payload) for _, name, payload in marks] == [("token", "a"), ("retry", None), ("token", {"index": 2})]
+    assert all(stream.start_time_ms <= time_ms <= stream.end_time_ms + 1 for time_ms, _, _ in marks)
+    assert json.loads(dumps_trace_builder(builder))["traces"][0]["children"][0]["properties"] == stream.properties
+
+    # Outside of a trace, marks are ignored.
+    mark("ignored")
+
+
+def test_aggregate_siblings():
+    with build_trace(module_filters=__name__, stack_frame_context=0, aggregate_siblings=2).scope() as builder:
+        for i in range(10):
+            repeated_call(i)
+        # A different call site is not merged.
+        repeated_call(10)
+        for i in range(2):
+            with event_scope("loop"):
+                repeated_call(11 + i)
+
+    trace = builder.build()
+    aggregate_node, single_node, loop_node = trace.traces[0].children
+    assert aggregate_node.name == "repeated_call"
+    stats = aggregate_node.properties["aggregate"]
+    assert stats["count"] == 10
+    assert stats["total_duration_ms"] >= stats["max_duration_ms"] >= stats["min_duration_ms"] >= 0
+    assert sum(stats["histogram_log2"]) == 10
+    exemplar_args = [child.properties["arguments"]["i"] for child in aggregate_node.children]
+    assert exemplar_args[:2] == [0, 1]
+    assert len(exemplar_args) == 4
+
+    assert single_node.properties == {"arguments": {"i": 10}}
+    assert loop_node.properties["aggregate"]["count"] == 2
+    assert [len(child.children) for child in loop_node.children] == [1, 1]
+
+    # The fast serializer sees the same tree.
+    assert dumps_trace_builder(builder) == dumps_trace(trace)
+
+
+def test_aggregate_siblings_keeps_failures():
+    builder = build_trace(module_filters=__name__, stack_frame_context=0, aggregate_siblings=1)
+    with builder.scope():
+        for i in range(3):
+            try:
+                with event_scope("call"):
+                    if i == 1:
+                        raise ValueError()
+            except ValueError:
+                pass
+    children = builder.build().traces[0].children
+    assert ["exception" in child.properties for child in children] == [False, True, False]
+
+
+def test_sibling_aggregate_exemplars():
+    def create_node(event_id: int) -> TraceNodeBuilder:
+        return TraceNodeBuilder(
+            kind=TraceNodeKind.CALL, name="f", event_id=event_id, start_time_ms=0, delta_frame_infos=[], stack_height=0
+        )
+
+    aggregate = SiblingAggregate(num_exemplars=2)
+    nodes = [create_node(event_id) for event_id in range(6)]
+    for node, duration_ms in zip(nodes, [1, 1, 5, 1, 9, 3]):
+        aggregate.add_exemplar(node, duration_ms)
+    assert aggregate.get_exemplars() == [nodes[0], nodes[1], nodes[2], nodes[4]]
+
+    assert [get_duration_histogram_bucket(duration_ms) for duration_ms in [0, 1, 2, 3, 4, 1000]] == [0, 1, 2, 2, 3, 10]
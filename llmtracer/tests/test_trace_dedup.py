@@ -0,0 +1,74 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+
+from llmtracer import Trace, build_trace, trace_calls
+from llmtracer.trace_dedup import dedup_trace, is_dedup_trace, save_dedup_trace, write_dedup_trace
+from llmtracer.trace_loader import load_trace_file, load_trace_stream, skipped_property_placeholder
+from llmtracer.trace_serializer import dumps_trace
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def fibonacci(n: int) -> int:
+    if n < 2:
+        return n
+    return fibonacci(n - 1) + fibonacci(n - 2)
+
+
+def build_example_trace() -> Trace:
+    builder = build_trace(name="fibonacci", module_filters=__name__)
+    with builder.scope():
+        fibonacci(12)
+        fibonacci(12)
+    return builder.build()
+
+
+def test_dedup_trace():
+    trace = build_example_trace()
+    document = dedup_trace(trace)
+
+    num_nodes = len(trace.build_event_id_map())
+    assert len(document["timings"]["duration_ms"]) == num_nodes
+    # fibonacci(0..12) from two call sites (and the scope).
+    assert len(document["shapes"]) <= 2 * 13 + 1
+
+    stream = io.BytesIO()
+    write_dedup_trace(trace, stream)
+    data = stream.getvalue()
+    assert is_dedup_trace(data)
+    assert not is_dedup_trace(dumps_trace(trace))
+    assert len(data) * 5 < len(dumps_trace(trace))
+
+    assert Trace.load_stream(io.BytesIO(data)) == trace
+    assert load_trace_stream(io.BytesIO(data)) == trace
+
+
+def test_dedup_trace_file(tmp_path):
+    trace = build_example_trace()
+    filename = tmp_path / "trace.dedup.json.gz"
+    save_dedup_trace(trace, filename)
+    assert Trace.load_file(filename) == trace
+
+    slim_trace = load_trace_file(filename, include_frame_infos=False, max_property_size=7)
+    for node, slim_node in zip(trace.build_event_id_map().values(), slim_trace.build_event_id_map().values()):
+        assert slim_node.event_id == node.event_id
+        assert slim_node.delta_frame_infos == []
+        assert slim_node.properties.get("result") == node.properties.get("result")
+    assert slim_trace.traces[0].children[0].properties["arguments"] == skipped_property_placeholder(8)
+
+    # Nodes of the same shape do not share their properties.
+    slim_trace.traces[0].children[0].properties["result"] = 0
+    assert slim_trace.traces[0].children[1].properties["result"] == 144
@@ -0,0 +1,157 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+
+import pytest
+
+from llmtracer.tools.cli import main
+from llmtracer.trace_diff import (
+    DiffStatus,
+    build_diff_trace,
+    collect_run_samples,
+    convert_diff_to_flame_graph_data,
+    diff_trace_files,
+    diff_traces,
+    format_call_path,
+)
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+
+
+def make_node(name, start, end, children=(), kind=TraceNodeKind.CALL):
+    return TraceNode(
+        kind=kind,
+        name=name,
+        event_id=0,
+        start_time_ms=start,
+        end_time_ms=end,
+        delta_frame_infos=[],
+        properties={},
+        children=list(children),
+    )
+
+
+def make_run(llm_ms: int, num_tools: int, with_retry: bool = False) -> Trace:
+    children = [make_node("llm", 0, llm_ms, kind=TraceNodeKind.LLM)]
+    children += [make_node("tool", llm_ms + i, llm_ms + i + 1, kind=TraceNodeKind.TOOL) for i in range(num_tools)]
+    if with_retry:
+        children.append(make_node("retry", 0, 5))
+    root = make_node("agent", 0, llm_ms + num_tools + 10, children, kind=TraceNodeKind.AGENT)
+    return Trace(name=None, traces=[root], properties={}, unique_objects={})
+
+
+def test_collect_run_samples():
+    samples = collect_run_samples(make_run(100, 2))
+    assert samples.durations_ms == {
+        (("AGENT", "agent", 0),): 112,
+        (("AGENT", "agent", 0), ("LLM", "llm", 0)): 100,
+        (("AGENT", "agent", 0), ("TOOL", "tool", 0)): 1,
+        (("AGENT", "agent", 0), ("TOOL", "tool", 1)): 1,
+    }
+    assert samples.call_counts[(("AGENT", "agent"), ("TOOL", "tool"))] == 2
+
+
+def test_diff_traces():
+    baseline = [make_run(100, 2), make_run(110, 2)]
+    candidate = [make_run(200, 3, with_retry=True), make_run(220, 3, with_retry=True)]
+    report = diff_traces(baseline, candidate)
+    assert report.num_baseline_runs == report.num_candidate_runs == 2
+
+    paths = {format_call_path(path_diff.path): path_diff for path_diff in report.paths}
+    llm_diff = paths["AGENT:agent#0/LLM:llm#0"]
+    assert llm_diff.status == DiffStatus.CHANGED
+    assert llm_diff.delta_ms == pytest.approx(105)
+    assert llm_diff.relative_delta == pytest.approx(105 / 105)
+    assert llm_diff.t_statistic is not None and llm_diff.t_statistic > 0
+    assert report.paths[0].path[-1][1] == "agent"
+    assert {format_call_path(path_diff.path) for path_diff in report.new_paths} == {
+        "AGENT:agent#0/CALL:retry#0",
+        "AGENT:agent#0/TOOL:tool#2",
+    }
+    assert report.missing_paths == []
+
+    count_changes = {count_diff.site[-1][1]: count_diff for count_diff in report.call_count_changes}
+    assert count_changes.keys() == {"tool", "retry"}
+    assert count_changes["tool"].delta == 1
+
+    reverse_report = diff_traces(candidate, baseline)
+    assert {format_call_path(path_diff.path) for path_diff in reverse_report.missing_paths} == {
+        "AGENT:agent#0/CALL:retry#0",
+        "AGENT:agent#0/TOOL:tool#2",
+    }
+
+    json.dumps(report.to_dict())
+
+
+def test_diff_outputs():
+    report = diff_traces([make_run(100, 2)], [make_run(150, 1, with_retry=True)])
+
+    diff_trace = build_diff_trace(report)
+    (root,) = diff_trace.traces
+    assert [child.name for child in root.children] == ["llm", "tool", "tool #1", "retry"]
+    assert root.children[0].properties["delta_ms"] == 50
+    assert root.children[2].properties["status"] == DiffStatus.MISSING
+
+    flame_graph_data = convert_diff_to_flame_graph_data(report)
+    (root_data,) = flame_graph_data["children"]
+    assert [child["name"] for child in root_data["children"]] == ["llm", "tool", "tool #1", "retry"]
+    assert root_data["children"][0]["backgroundColor"].startswith("#ff")
+
+
+def test_diff_trace_children_fit_into_parents():
+    # The children run concurrently, so they do not fit into the parent one after the other.
+    root = make_node("agent", 0, 10, [make_node("llm", 0, 10), make_node("llm", 0, 10)], kind=TraceNodeKind.AGENT)
+    run = Trace(name=None, traces=[root], properties={}, unique_objects={})
+
+    (diff_root,) = build_diff_trace(diff_traces([run], [run])).traces
+    assert [(child.start_time_ms, child.end_time_ms) for child in diff_root.children] == [(0, 10), (10, 10)]
+
+
+def test_diff_files_and_cli(tmp_path, capsys):
+    filenames = {}
+    for side, runs in {"baseline": [make_run(100, 2)] * 2, "candidate": [make_run(150, 2)] * 2}.items():
+        filenames[side] = []
+        for i, trace in enumerate(runs):
+            filename = str(tmp_path / f"{side}_{i}.json")
+            with open(filename, "w") as f:
+                f.write(trace.model_dump_json())
+            filenames[side].append(filename)
+
+    report = diff_trace_files(filenames["baseline"], filenames["candidate"])
+    assert report.paths[0].delta_ms == 50
+
+    output = tmp_path / "report.json"
+    main(
+        [
+            "diff",
+            "--baseline",
+            *filenames["baseline"],
+            "--candidate",
+            *filenames["candidate"],
+            "-o",
+            str(output),
+            "--flame-graph",
+            str(tmp_path / "flame_graph.json"),
+            "--svg",
+            str(tmp_path / "diff.svg"),
+            "-j",
+            "1",
+        ]
+    )
+    assert json.loads(output.read_text()) == json.loads(json.dumps(report.to_dict()))
+    assert (tmp_path / "flame_graph.json").exists()
+    assert (tmp_path / "diff.svg").exists()
+    assert "+50.0 ms" in capsys.readouterr().out
@@ -0,0 +1,130 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import io
+
+import pytest
+
+from llmtracer import JsonFileWriter, Trace, build_trace, trace_calls
+from llmtracer.trace_files import Compression, get_compression, open_trace_file_for_reading, wrap_decompressing_stream
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def f(prompt: str):
+    return prompt.upper()
+
+
+def build_example_trace(*event_handlers):
+    builder = build_trace(module_filters=__name__)
+    builder.event_handlers.extend(event_handlers)
+    with builder.scope():
+        f("hello " * 100)
+        f("world " * 100)
+    return builder
+
+
+def assert_written_trace(written_trace: Trace, trace: Trace):
+    # The file is written when the scope exits, so the scope's overhead in it misses the time of this write.
+    written_scope, scope = written_trace.traces[0], trace.traces[0]
+    assert written_scope.tracer_overhead_ms < scope.tracer_overhead_ms
+    written_scope.tracer_overhead_ms = scope.tracer_overhead_ms
+    assert written_trace == trace
+
+
+def test_get_compression():
+    assert get_compression("trace.json") == Compression.NONE
+    assert get_compression("trace.json.gz") == Compression.GZIP
+    assert get_compression("trace.svgz") == Compression.GZIP
+    assert get_compression("trace.json.ZST") == Compression.ZSTD
+
+
+@pytest.mark.parametrize("extension", ["json", "json.gz", "json.zst"])
+def test_compressed_json_file_writer(tmp_path, extension):
+    if extension.endswith("zst"):
+        pytest.importorskip("zstandard")
+
+    filename = tmp_path / f"trace.{extension}"
+    builder = build_example_trace(JsonFileWriter(str(filename)))
+
+    assert_written_trace(Trace.load_file(filename), builder.build())
+    with open(filename, "rb") as f:
+        assert_written_trace(Trace.load_stream(f), builder.build())
+        f.seek(0)
+        is_compressed = f.read(1) != b"{"
+    assert is_compressed == (extension != "json")
+
+    with open_trace_file_for_reading(filename) as f:
+        assert f.read(1) == b"{"
+
+
+def test_wrap_decompressing_stream():
+    # Seekable streams are rewound (and returned as they are if they are not compressed).
+    stream = io.BytesIO(b'{"a": 1}')
+    assert wrap_decompressing_stream(stream) is stream and stream.tell() == 0
+    assert wrap_decompressing_stream(io.BytesIO(gzip.compress(b'{"a": 1}'))).read() == b'{"a": 1}'
+
+
+def test_load_stream_non_seekable():
+    raw = gzip.compress(build_example_trace().build().json().encode())
+
+    class NonSeekable(io.RawIOBase):
+        def __init__(self):
+            self.inner = io.BytesIO(raw)
+
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            data = self.inner.read(len(buffer))
+            buffer[: len(data)] = data
+            return len(data)
+
+    assert Trace.load_stream(NonSeekable()).traces[0].children[0].name == "f"
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_load_stream_short_reads(compress):
+    data = build_example_trace().build().json().encode()
+    if compress:
+        data = gzip.compress(data)
+
+    class ShortReads:
+        """A non-seekable stream (not an io.RawIOBase) that returns at most 3 bytes per read."""
+
+        def __init__(self):
+            self.inner = io.BytesIO(data)
+
+        def seekable(self):
+            return False
+
+        def read(self, size=-1):
+            return self.inner.read(3 if size < 0 else min(size, 3))
+
+    stream = ShortReads()
+    assert Trace.load_stream(stream).traces[0].children[0].name == "f"
+    assert stream.inner.read() == b""
+
+
+def test_svgz_writer(tmp_path):
+    pytest.importorskip("svgwrite")
+    from llmtracer.handlers.svg_writer import SvgFileWriter
+
+    filename = tmp_path / "trace.svgz"
+    build_example_trace(SvgFileWriter(str(filename)))
+
+    with gzip.open(filename, "rt", encoding="utf-8") as f:
+        assert f.read().startswith("<?xml")
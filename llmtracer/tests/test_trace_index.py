@@ -0,0 +1,130 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+import pytest
+
+from llmtracer import JsonFileWriter, Trace, build_trace, trace_calls
+from llmtracer.trace_index import TraceFileReader, TraceIndex, get_index_filename
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def g(x: int):
+    return {"x": x, "text": "ü" * x}
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def write_example_trace(filename):
+    builder = build_trace(name="indexed", module_filters=__name__)
+    builder.event_handlers.append(JsonFileWriter(str(filename)))
+    with builder.scope():
+        f(3)
+        f(2)
+    return Trace.load_file(filename)
+
+
+def test_index_roundtrip(tmp_path):
+    filename = tmp_path / "trace.json"
+    trace = write_example_trace(filename)
+
+    index = TraceIndex.load(get_index_filename(filename))
+    assert index.file_size == os.path.getsize(filename)
+    assert list(index.event_id) == list(trace.build_event_id_map())
+    assert list(index.parent) == [-1, 0, 1, 1, 1, 0, 5, 5]
+    assert list(index.subtree_end) == [8, 5, 3, 4, 5, 8, 7, 8]
+    assert index.get_children(-1) == [0]
+    assert index.get_children(0) == [1, 5]
+
+
+def test_load_node(tmp_path):
+    filename = tmp_path / "trace.json"
+    trace = write_example_trace(filename)
+    event_id_map = trace.build_event_id_map()
+
+    with TraceFileReader(filename) as reader:
+        for event_id, node in event_id_map.items():
+            assert reader.load_node(event_id) == node
+
+        scope = trace.traces[0]
+        assert reader.load_node(scope.event_id, depth=0) == scope.model_copy(update=dict(children=[]))
+        assert reader.load_node(scope.event_id, depth=1) == scope.model_copy(
+            update=dict(children=[child.model_copy(update=dict(children=[])) for child in scope.children])
+        )
+        assert reader.load_node(scope.event_id, depth=2) == scope
+
+        assert reader.get_child_event_ids(None) == [scope.event_id]
+        assert reader.get_child_event_ids(scope.event_id) == [child.event_id for child in scope.children]
+        assert reader.get_parent_event_id(scope.children[1].event_id) == scope.event_id
+
+        with pytest.raises(KeyError):
+            reader.load_node(-1)
+
+
+def test_stale_index(tmp_path):
+    filename = tmp_path / "trace.json"
+    write_example_trace(filename)
+    with open(filename, "ab") as f:
+        f.write(b" ")
+
+    with pytest.raises(ValueError):
+        TraceFileReader(filename)
+
+
+def test_stale_index_same_size(tmp_path):
+    filename = tmp_path / "trace.json"
+    write_example_trace(filename)
+    stat = os.stat(filename)
+    # Rewrite the file with the same size, but a different modification time.
+    data = bytearray(filename.read_bytes())
+    data[-1:] = b" "
+    filename.write_bytes(bytes(data))
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    with pytest.raises(ValueError):
+        TraceFileReader(filename)
+
+
+def test_index_is_replaced_before_the_trace(tmp_path, monkeypatch):
+    filename = tmp_path / "trace.json"
+    replaced = []
+    original_replace = os.replace
+
+    def replace(src, dst):
+        replaced.append(os.path.basename(dst))
+        original_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", replace)
+    write_example_trace(filename)
+    assert replaced[-2:] == ["trace.json.idx", "trace.json"]
+
+
+def test_no_index_for_compressed_files(tmp_path):
+    filename = tmp_path / "trace.json.gz"
+    write_example_trace(filename)
+    assert not os.path.exists(get_index_filename(filename))
+
+
+def test_find_unsorted_event_ids():
+    index = TraceIndex()
+    index.event_id.extend([5, 3, 9])
+    assert index.find(3) == 1
+    assert index.find(9) == 2
+    assert index.find(4) is None
@@ -0,0 +1,121 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+
+import pytest
+
+from llmtracer import JsonFileWriter, Trace, build_trace, trace_calls
+from llmtracer.trace_loader import _load_trace, load_trace_file, load_trace_stream, skipped_property_placeholder
+from llmtracer.trace_serializer import dumps_trace
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def g(x: int):
+    return {"x": x, "text": "ü" * 100 * x, "number": 1.5e10}
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def build_example_trace() -> Trace:
+    builder = build_trace(name="streaming", module_filters=__name__)
+    with builder.scope():
+        f(3)
+        f(2)
+    return builder.build()
+
+
+def test_load_trace_stream():
+    trace = build_example_trace()
+    assert load_trace_stream(io.BytesIO(dumps_trace(trace))) == trace
+    # Pretty-printed JSON with a different key order (children first) and tiny chunks.
+    pretty_json = json.dumps(
+        {"unique_objects": {}, "properties": {}, "traces": json.loads(trace.model_dump_json())["traces"], "name": None},
+        indent=2,
+        sort_keys=True,
+        ensure_ascii=False,
+    ).encode()
+    for chunk_size in [1, 7, 1 << 20]:
+        loaded_trace = _load_trace(io.BytesIO(pretty_json), True, None, chunk_size)
+        assert loaded_trace == trace.model_copy(update=dict(name=None, properties={}, unique_objects={}))
+
+
+def test_numbers_across_chunks():
+    trace = build_example_trace()
+    trace.traces[0].properties.update(numbers=[10.25, -2.5e-10, 12345, 1e100])
+    data = dumps_trace(trace)
+    # Numbers must not be cut off at the chunk boundaries (e.g. `10.` or `1e`).
+    for chunk_size in range(1, 64):
+        assert _load_trace(io.BytesIO(data), True, None, chunk_size) == trace
+
+
+def test_load_trace_file(tmp_path):
+    trace = build_example_trace()
+    for extension in ["json", "json.gz"]:
+        filename = tmp_path / f"trace.{extension}"
+        builder = build_trace(name="file", module_filters=__name__)
+        builder.event_handlers.append(JsonFileWriter(str(filename)))
+        with builder.scope():
+            f(2)
+        assert load_trace_file(filename) == Trace.load_file(filename)
+    assert trace.traces
+
+
+def test_skipping():
+    trace = build_example_trace()
+    data = dumps_trace(trace)
+
+    loaded_trace = load_trace_stream(io.BytesIO(data), include_frame_infos=False, max_property_size=100)
+    event_id_map = trace.build_event_id_map()
+    for event_id, node in loaded_trace.build_event_id_map().items():
+        original_node = event_id_map[event_id]
+        assert node.delta_frame_infos == []
+        for key, value in node.properties.items():
+            size = len(json.dumps(original_node.properties[key], separators=(",", ":"), ensure_ascii=False))
+            assert value == (original_node.properties[key] if size <= 100 else skipped_property_placeholder(size))
+
+
+def test_deep_trace():
+    depth = 10000
+    node_json = (
+        '{{"kind":"CALL","name":"level_{0}","event_id":{0},"start_time_ms":0,"end_time_ms":1,'
+        '"delta_frame_infos":[],"properties":{{}},"children":['
+    )
+    data = (
+        '{"name":null,"traces":['
+        + "".join(node_json.format(i) for i in range(depth))
+        + "]}" * depth
+        + '],"properties":{},"unique_objects":{}}'
+    )
+    trace = load_trace_stream(io.BytesIO(data.encode()))
+
+    node = trace.traces[0]
+    assert node.name == "level_0"
+    for i in range(1, depth):
+        (node,) = node.children
+        assert node.name == f"level_{i}"
+    assert node.children == []
+
+
+def test_invalid_json():
+    with pytest.raises(json.JSONDecodeError):
+        load_trace_stream(io.BytesIO(b'{"name": null, "traces": [{"kind": "CALL",'))
+    with pytest.raises(json.JSONDecodeError):
+        load_trace_stream(io.BytesIO(b'{"name": null, "traces": []} trailing'))
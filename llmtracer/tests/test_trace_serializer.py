@@ -0,0 +1,114 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import json
+
+from llmtracer import JsonFileWriter, Trace, build_trace, event_scope, trace_calls
+from llmtracer.trace_serializer import dumps_node_without_children, dumps_trace, dumps_trace_builder, json_dumps
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def f(value: int):
+    with event_scope("inner", properties=dict(tags=["a"])):
+        return value * 3
+
+
+def test_dumps_trace_builder_round_trip():
+    with build_trace(module_filters=__name__, name="test").scope() as builder:
+        f(3)
+        f(5)
+
+    raw = dumps_trace_builder(builder)
+    trace = builder.build()
+    assert Trace.parse_raw(raw) == trace
+    assert dumps_trace(trace) == raw
+
+
+def test_dumps_frame_info_table():
+    with build_trace(module_filters=__name__).scope() as builder:
+        f(3)
+        f(5)
+
+    document = json.loads(dumps_trace_builder(builder))
+    scope = document["traces"][0]
+    first_call, second_call = scope["children"]
+    assert "delta_frame_infos" not in first_call
+    # The calls come from different lines, but the frame of the event scope in `f` is stored once.
+    assert first_call["delta_frame_ids"] != second_call["delta_frame_ids"]
+    assert first_call["children"][0]["delta_frame_ids"][0] == second_call["children"][0]["delta_frame_ids"][0]
+    frame_ids = [
+        frame_id
+        for node in (scope, first_call, second_call, first_call["children"][0])
+        for frame_id in node["delta_frame_ids"]
+    ]
+    assert sorted(set(frame_ids)) == list(range(len(document["frame_infos"])))
+    assert all(frame_info["module"] == __name__ for frame_info in document["frame_infos"])
+
+
+def test_validate_does_not_modify_trace_dicts():
+    with build_trace(module_filters=__name__).scope() as builder:
+        f(3)
+
+    document = json.loads(dumps_trace_builder(builder))
+    document_copy = copy.deepcopy(document)
+    trace = Trace.model_validate(document)
+    assert document == document_copy
+    assert Trace.model_validate(document) == trace == builder.build()
+
+
+def test_dumps_running_nodes():
+    with build_trace(module_filters=__name__).scope() as builder:
+        with event_scope("outer"):
+            trace = Trace.parse_raw(dumps_trace_builder(builder))
+
+    outer = trace.traces[0].children[0]
+    assert outer.name == "outer"
+    assert outer.running
+    assert outer.end_time_ms >= outer.start_time_ms
+    assert json.loads(dumps_node_without_children(outer))["children"] == []
+
+
+def test_json_dumps():
+    assert json.loads(json_dumps({"a": {1}, 2: (1, "ü")})) == {"a": [1], "2": [1, "ü"]}
+    # Values that orjson does not support fall back to the standard library.
+    assert json.loads(json_dumps({"big": 2**70, "text": "ü"})) == {"big": 2**70, "text": "ü"}
+    assert json.loads(json_dumps(["\ud800", "ü"])) == ["\ud800", "ü"]
+
+
+def test_dumps_trace_builder_fallback_values():
+    with build_trace(module_filters=__name__).scope() as builder:
+        with event_scope("outer", properties=dict(big=2**70, text="\udcff")):
+            pass
+
+    trace = Trace.parse_raw(dumps_trace_builder(builder))
+    assert trace.traces[0].children[0].properties == dict(big=2**70, text="\udcff")
+
+
+def test_json_file_writer(tmp_path):
+    filename = str(tmp_path / "trace.json")
+    builder = build_trace(module_filters=__name__)
+    builder.event_handlers.append(JsonFileWriter(filename))
+    with builder.scope():
+        f(1)
+
+    trace = builder.build()
+    written_trace = Trace.parse_file(filename)
+    # The file is written when the scope exits, so the scope's overhead in it misses the time of this write.
+    written_scope, scope = written_trace.traces[0], trace.traces[0]
+    assert written_scope.tracer_overhead_ms < scope.tracer_overhead_ms
+    written_scope.tracer_overhead_ms = scope.tracer_overhead_ms
+    assert written_trace == trace
@@ -0,0 +1,89 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from llmtracer import JsonFileWriter, Trace, build_trace, event_scope, trace_calls
+from llmtracer.sampling import KeepFailedTraces
+from llmtracer.trace_index import TraceFileReader, TraceIndex, get_index_filename
+from llmtracer.trace_serializer import dumps_trace, dumps_trace_builder
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def g(x: int):
+    return {"x": x, "text": "ü" * x}
+
+
+@trace_calls(capture_args=True)
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def run(builder, num_calls: int = 10) -> list[int]:
+    num_resident_nodes = []
+    with builder.scope():
+        for i in range(num_calls):
+            f(i % 4)
+            num_resident_nodes.append(builder.num_resident_nodes)
+    return num_resident_nodes
+
+
+def test_spill_finished_subtrees():
+    builder = build_trace(module_filters=__name__, stack_frame_context=0, max_resident_nodes=8)
+    # Finished subtrees are spilled as soon as the budget is exceeded.
+    assert max(run(builder)) <= 8
+    assert [child.spilled is not None for child in builder.event_root.children[0].children] == [True] * 8 + [False] * 2
+
+    reference = build_trace(module_filters=__name__, stack_frame_context=0)
+    run(reference)
+
+    trace = builder.build()
+    reference_trace = reference.build()
+    assert trace.to_custom_dict(include_timing=False, include_lineno=False) == reference_trace.to_custom_dict(
+        include_timing=False, include_lineno=False
+    )
+    assert dumps_trace_builder(builder) == dumps_trace(trace)
+
+
+def test_spill_with_index(tmp_path):
+    filename = tmp_path / "trace.json"
+    builder = build_trace(module_filters=__name__, max_resident_nodes=4)
+    builder.event_handlers.append(JsonFileWriter(str(filename)))
+    run(builder)
+
+    trace = Trace.load_file(filename)
+    event_id_map = trace.build_event_id_map()
+    index = TraceIndex.load(get_index_filename(filename))
+    assert list(index.event_id) == list(event_id_map)
+
+    with TraceFileReader(filename) as reader:
+        for event_id, node in event_id_map.items():
+            assert reader.load_node(event_id) == node
+            assert reader.get_child_event_ids(event_id) == [child.event_id for child in node.children]
+
+
+def test_spill_with_sampling():
+    builder = build_trace(module_filters=__name__, max_resident_nodes=1, sampling_policy=KeepFailedTraces())
+    with builder.scope():
+        try:
+            with event_scope("failed"):
+                raise ValueError()
+        except ValueError:
+            pass
+        f(2)
+    with builder.scope():
+        f(2)
+        f(1)
+    (scope,) = builder.build().traces
+    assert [child.name for child in scope.children] == ["failed", "f"]
+    assert builder.num_resident_nodes == 1
@@ -0,0 +1,170 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import json
+import time
+
+from llmtracer import Trace, build_trace, event_scope, trace_calls
+from llmtracer.object_converter import DynamicObjectConverter
+from llmtracer.trace_builder import TraceBuilderEventHandler
+from llmtracer.trace_serializer import dumps_trace, dumps_trace_builder
+
+HANDLER_SLEEP_S = 0.01
+
+
+class SlowHandler(TraceBuilderEventHandler):
+    def on_event_scope_final(self, builder):
+        time.sleep(HANDLER_SLEEP_S)
+
+
+@trace_calls(capture_args=True, capture_return=True)
+def g(x: int):
+    return [x] * x
+
+
+@trace_calls
+def f(n: int):
+    return [g(i) for i in range(n)]
+
+
+def build_slow_trace(subtract_tracer_overhead: bool) -> Trace:
+    builder = build_trace(module_filters=__name__, subtract_tracer_overhead=subtract_tracer_overhead)
+    builder.event_handlers.append(SlowHandler())
+    with builder.scope():
+        with event_scope("outer"):
+            for _ in range(3):
+                with event_scope("inner"):
+                    pass
+    return builder.build()
+
+
+def test_tracer_overhead_per_node():
+    builder = build_trace(module_filters=__name__)
+    with builder.scope():
+        f(3)
+    trace = builder.build()
+
+    (scope,) = trace.traces
+    (f_node,) = scope.children
+    assert all(node.tracer_overhead_ms > 0 for node in trace.build_event_id_map().values())
+    # The overhead of a node includes the overhead of its descendants.
+    assert f_node.tracer_overhead_ms > sum(child.tracer_overhead_ms for child in f_node.children)
+    assert scope.tracer_overhead_ms > f_node.tracer_overhead_ms
+
+    summary = trace.get_tracer_overhead_summary()
+    assert summary.num_nodes == 5
+    assert summary.tracer_overhead_ms == scope.tracer_overhead_ms
+    assert summary.overhead_per_node_us == summary.tracer_overhead_ms * 1000 / 5
+
+
+def test_tracer_overhead_includes_handlers():
+    builder = build_trace(module_filters=__name__)
+    builder.event_handlers.append(SlowHandler())
+    with builder.scope():
+        with event_scope("outer"):
+            for _ in range(3):
+                with event_scope("inner"):
+                    pass
+        outer_node = builder.current_event_node.children[0]
+        # The handlers of a node run when it exits, so they are charged to it (and not to its parent).
+        assert outer_node.tracer_overhead_ms >= 4 * HANDLER_SLEEP_S * 1000
+        assert all(inner.tracer_overhead_ms >= HANDLER_SLEEP_S * 1000 for inner in outer_node.children)
+        inner_overhead_ms = sum(inner.tracer_overhead_ms for inner in outer_node.children)
+        outer_self_overhead_ms = outer_node.tracer_overhead_ms - inner_overhead_ms
+        # Its own handler only: the handlers of the inner nodes (three times as many) are not charged twice.
+        assert HANDLER_SLEEP_S * 1000 <= outer_self_overhead_ms < inner_overhead_ms
+
+    trace = builder.build()
+    (outer,) = trace.traces[0].children
+    assert outer.end_time_ms - outer.start_time_ms >= 3 * HANDLER_SLEEP_S * 1000
+
+
+class SlowArgument:
+    pass
+
+
+def convert_slow_argument(obj: SlowArgument, converter) -> str:
+    time.sleep(HANDLER_SLEEP_S)
+    return "slow"
+
+
+slow_object_converter = DynamicObjectConverter(converters={SlowArgument: convert_slow_argument})
+
+
+@trace_calls(capture_args=True, object_converter=slow_object_converter)
+def h(argument: SlowArgument):
+    return None
+
+
+def test_tracer_overhead_includes_argument_conversion():
+    builder = build_trace(module_filters=__name__)
+    with builder.scope():
+        with event_scope("outer"):
+            h(SlowArgument())
+    trace = builder.build()
+
+    (outer,) = trace.traces[0].children
+    (h_node,) = outer.children
+    assert h_node.properties["arguments"] == {"argument": "slow"}
+    # The arguments are converted within the call's node (and not charged to the outer node's own overhead).
+    assert h_node.tracer_overhead_ms >= HANDLER_SLEEP_S * 1000
+    assert outer.tracer_overhead_ms - h_node.tracer_overhead_ms < h_node.tracer_overhead_ms
+
+
+def test_subtract_tracer_overhead():
+    trace = build_slow_trace(subtract_tracer_overhead=True)
+    (scope,) = trace.traces
+    (outer,) = scope.children
+    assert outer.tracer_overhead_ms >= 3 * HANDLER_SLEEP_S * 1000
+    # Without the subtraction, the duration would include the overhead of the (finished) children (up to the
+    # rounding of the times to ms).
+    unadjusted_outer = build_slow_trace(subtract_tracer_overhead=False).traces[0].children[0]
+    assert (
+        unadjusted_outer.end_time_ms - unadjusted_outer.start_time_ms
+        >= sum(child.tracer_overhead_ms for child in unadjusted_outer.children) - 1
+    )
+    assert outer.end_time_ms - outer.start_time_ms < sum(child.tracer_overhead_ms for child in outer.children)
+    # The adjusted times stay nested.
+    for parent in [scope, outer]:
+        for child in parent.children:
+            assert parent.start_time_ms <= child.start_time_ms <= child.end_time_ms <= parent.end_time_ms
+
+
+def test_subtract_tracer_overhead_running_nodes():
+    builder = build_trace(module_filters=__name__, subtract_tracer_overhead=True)
+    # Pretend that the tracer has spent a minute on itself already.
+    builder.tracer_overhead_ns = 60 * 10**9
+    with builder.scope():
+        with event_scope("running"):
+            for trace in (builder.build(), Trace.model_validate_json(dumps_trace_builder(builder))):
+                running = trace.traces[0].children[0]
+                assert running.running
+                # Running nodes end at the adjusted time, too (and not a minute later).
+                assert 0 <= running.end_time_ms - running.start_time_ms < 60 * 1000
+
+
+def test_tracer_overhead_serialization():
+    builder = build_trace(module_filters=__name__)
+    with builder.scope():
+        f(2)
+    trace = builder.build()
+    assert Trace.model_validate_json(dumps_trace_builder(builder)) == trace
+
+    # Traces without the field load with no overhead.
+    trace_dict = json.loads(dumps_trace(trace))
+    del trace_dict["traces"][0]["tracer_overhead_ms"]
+    loaded_trace = Trace.load_stream(io.BytesIO(json.dumps(trace_dict).encode()))
+    assert loaded_trace.traces[0].tracer_overhead_ms == 0.0
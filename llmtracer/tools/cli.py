@@ -0,0 +1,559 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+The `llmtracer` command line tool: merge, convert, slim, summarize and diff many trace files.
+
+Files are processed in parallel by a process pool (`--jobs`). JSON traces are loaded with the streaming loader, and
+merged traces are written node by node while the inputs are still being loaded. Every command reports its throughput
+on stderr.
+
+Supported formats (chosen by extension): `.json`, `.json.gz`, `.json.zst`, the deduplicated JSON format `.dedup.json`
+(see `llmtracer.trace_dedup`) and the columnar format `.llmtc` (which requires NumPy). `convert --to custom` writes
+the `TraceNode.to_custom_dict` representation (without timings and line numbers), which is useful for diffing traces.
+
+`summarize` uses `llmtracer.analytics` and requires NumPy, too.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import operator
+import os
+import sys
+import time
+import typing
+from dataclasses import dataclass
+
+from llmtracer.handlers.json_writer import save_json_trace_file
+from llmtracer.trace_dedup import DEDUP_EXTENSION, save_dedup_trace
+from llmtracer.trace_diff import (
+    RunSet,
+    build_diff_trace,
+    collect_run_samples_from_file,
+    convert_diff_to_flame_graph_data,
+    diff_run_sets,
+    format_call_path,
+    format_call_site,
+)
+from llmtracer.trace_loader import load_trace_file, skipped_property_placeholder
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.trace_serializer import json_dumps, write_trace, write_trace_nodes
+from llmtracer.utils.tree_traversal import iter_preorder, transform_bottom_up, visit_top_down
+
+COLUMNAR_EXTENSION = ".llmtc"
+
+FORMAT_EXTENSIONS = {
+    "json": ".json",
+    "json.gz": ".json.gz",
+    "json.zst": ".json.zst",
+    "columnar": COLUMNAR_EXTENSION,
+    "dedup": DEDUP_EXTENSION,
+    "custom": ".custom.json",
+}
+
+_TRACE_EXTENSIONS = sorted(FORMAT_EXTENSIONS.values(), key=len, reverse=True)
+
+
+def strip_trace_extension(filename: str) -> str:
+    for extension in _TRACE_EXTENSIONS:
+        if filename.lower().endswith(extension):
+            return filename[: -len(extension)]
+    return os.path.splitext(filename)[0]
+
+
+def get_trace_format(filename: str) -> str:
+    lower_filename = filename.lower()
+    for trace_format, extension in sorted(FORMAT_EXTENSIONS.items(), key=lambda item: -len(item[1])):
+        if trace_format != "custom" and lower_filename.endswith(extension):
+            return trace_format
+    return "json"
+
+
+def slim_trace(trace: Trace, include_frame_infos: bool = True, max_property_size: int | None = None):
+    """Drop frame infos and replace large property values in place (like the streaming loader does)."""
+    for node in iter_preorder(trace.traces, operator.attrgetter("children")):
+        if not include_frame_infos:
+            node.delta_frame_infos = []
+        if max_property_size is not None:
+            for key, value in node.properties.items():
+                size = len(json_dumps(value).decode("utf-8"))
+                if size > max_property_size:
+                    node.properties[key] = skipped_property_placeholder(size)
+
+
+def load_trace(filename: str, include_frame_infos: bool = True, max_property_size: int | None = None) -> Trace:
+    """Load a trace in any supported format (JSON traces are loaded incrementally)."""
+    if get_trace_format(filename) != "columnar":
+        return load_trace_file(filename, include_frame_infos=include_frame_infos, max_property_size=max_property_size)
+
+    from llmtracer.columnar import ColumnarTrace
+
+    with ColumnarTrace(filename) as columnar_trace:
+        trace = columnar_trace.to_trace()
+    slim_trace(trace, include_frame_infos, max_property_size)
+    return trace
+
+
+def save_trace(trace: Trace, filename: str, trace_format: str | None = None):
+    """Save a trace in the given format (by default, chosen by extension)."""
+    trace_format = trace_format or get_trace_format(filename)
+    if trace_format == "columnar":
+        from llmtracer.columnar import write_columnar_trace
+
+        write_columnar_trace(trace, filename)
+    elif trace_format == "dedup":
+        save_dedup_trace(trace, filename)
+    elif trace_format == "custom":
+        custom_dict = dict(
+            name=trace.name,
+            traces=[node.to_custom_dict(include_timing=False, include_lineno=False) for node in trace.traces],
+            properties=trace.properties,
+            unique_objects=trace.unique_objects,
+        )
+        with open(filename, "wb") as f:
+            f.write(json_dumps(custom_dict))
+    else:
+        save_json_trace_file(filename, lambda f, index: write_trace(trace, f, index))
+
+
+def count_nodes(trace: Trace) -> int:
+    return sum(1 for _ in iter_preorder(trace.traces, operator.attrgetter("children")))
+
+
+@dataclass
+class FileStats:
+    input_bytes: int = 0
+    output_bytes: int = 0
+    num_nodes: int = 0
+
+    def __iadd__(self, other: 'FileStats'):
+        self.input_bytes += other.input_bytes
+        self.output_bytes += other.output_bytes
+        self.num_nodes += other.num_nodes
+        return self
+
+
+@dataclass(frozen=True)
+class ConvertTask:
+    input_filename: str
+    output_filename: str
+    trace_format: str
+    include_frame_infos: bool = True
+    max_property_size: int | None = None
+
+
+def convert_file(task: ConvertTask) -> FileStats:
+    trace = load_trace(task.input_filename, task.include_frame_infos, task.max_property_size)
+    save_trace(trace, task.output_filename, task.trace_format)
+    return FileStats(
+        input_bytes=os.path.getsize(task.input_filename),
+        output_bytes=os.path.getsize(task.output_filename),
+        num_nodes=count_nodes(trace),
+    )
+
+
+def summarize_trace(trace: Trace) -> dict[str, typing.Any]:
+    """Node counts and total (inclusive) and self time per kind and per name (computed by `llmtracer.analytics`)."""
+    from llmtracer.analytics import flatten_trace, latency_stats
+
+    flat_trace = flatten_trace(trace)
+
+    def summarize_groups(group_by: str, format_key: typing.Callable[[typing.Any], str]) -> dict[str, dict[str, int]]:
+        stats = latency_stats(flat_trace, group_by)
+        return {
+            format_key(key): dict(count=count, total_ms=round(total_ms), self_ms=round(self_ms))
+            for key, count, total_ms, self_ms in zip(
+                stats.keys, stats.count.tolist(), stats.total_ms.tolist(), stats.self_ms.tolist()
+            )
+        }
+
+    if trace.traces:
+        duration_ms = max(node.end_time_ms for node in trace.traces) - min(node.start_time_ms for node in trace.traces)
+    else:
+        duration_ms = 0
+    return dict(
+        num_nodes=len(flat_trace),
+        duration_ms=duration_ms,
+        tracer_overhead_ms=sum(node.tracer_overhead_ms for node in trace.traces),
+        kinds=summarize_groups("kind", operator.attrgetter("value")),
+        names=summarize_groups("name", str),
+    )
+
+
+def merge_summaries(summaries: typing.Iterable[dict[str, typing.Any]]) -> dict[str, typing.Any]:
+    merged: dict[str, typing.Any] = dict(
+        num_files=0, num_nodes=0, duration_ms=0, tracer_overhead_ms=0.0, kinds={}, names={}
+    )
+    for summary in summaries:
+        merged["num_files"] += 1
+        merged["num_nodes"] += summary["num_nodes"]
+        merged["duration_ms"] += summary["duration_ms"]
+        merged["tracer_overhead_ms"] += summary["tracer_overhead_ms"]
+        for key in ("kinds", "names"):
+            for name, stats in summary[key].items():
+                merged_stats = merged[key].setdefault(name, dict(count=0, total_ms=0, self_ms=0))
+                for stat, value in stats.items():
+                    merged_stats[stat] += value
+    return merged
+
+
+def summarize_file(filename: str) -> tuple[dict[str, typing.Any], FileStats]:
+    summary = summarize_trace(load_trace(filename, include_frame_infos=False))
+    return summary, FileStats(input_bytes=os.path.getsize(filename), num_nodes=summary["num_nodes"])
+
+
+@dataclass
+class PicklableTrace:
+    """
+    A trace with its nodes in a pre-order list (without children) and the index of each node's parent (or -1).
+
+    Pickling a deep trace tree (to send it from a worker process) recurses once per level. This does not.
+    """
+
+    trace: Trace
+    nodes: list[TraceNode]
+    parents: list[int]
+
+    @classmethod
+    def from_trace(cls, trace: Trace) -> 'PicklableTrace':
+        nodes: list[TraceNode] = []
+        parents: list[int] = []
+
+        def visit(node: TraceNode, parent: int) -> int:
+            nodes.append(node.model_copy(update=dict(children=[])))
+            parents.append(parent)
+            return len(nodes) - 1
+
+        visit_top_down(trace.traces, operator.attrgetter("children"), visit, -1)
+        return cls(trace.model_copy(update=dict(traces=[])), nodes, parents)
+
+    def to_trace(self) -> Trace:
+        roots: list[TraceNode] = []
+        for node, parent in zip(self.nodes, self.parents):
+            (roots if parent < 0 else self.nodes[parent].children).append(node)
+        return self.trace.model_copy(update=dict(traces=roots))
+
+
+def load_file_for_merge(filename: str) -> tuple[PicklableTrace, FileStats]:
+    picklable_trace = PicklableTrace.from_trace(load_trace(filename))
+    return picklable_trace, FileStats(input_bytes=os.path.getsize(filename), num_nodes=len(picklable_trace.nodes))
+
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+
+def imap_ordered(function: typing.Callable[[T], R], items: typing.Iterable[T], jobs: int) -> typing.Iterator[R]:
+    """
+    Map a function over items in a process pool and yield the results in order.
+
+    At most `2 * jobs` items are in flight at once, so the results do not pile up in memory when they are consumed
+    slowly (e.g. while writing a merged trace).
+    """
+    if jobs == 1:
+        yield from map(function, items)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending: collections.deque[concurrent.futures.Future] = collections.deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class ThroughputReporter:
+    """Accumulates file stats and reports the throughput of a command on stderr."""
+
+    def __init__(self, command: str):
+        self.command = command
+        self.stats = FileStats()
+        self.num_files = 0
+        self.start_time = time.perf_counter()
+
+    def add(self, stats: FileStats):
+        self.num_files += 1
+        self.stats += stats
+
+    def report(self):
+        elapsed_s = max(time.perf_counter() - self.start_time, 1e-9)
+        input_mb = self.stats.input_bytes / 1e6
+        message = (
+            f"{self.command}: {self.num_files} files, {self.stats.num_nodes} nodes, {input_mb:.1f} MB in"
+            f" {elapsed_s:.2f} s ({input_mb / elapsed_s:.1f} MB/s, {self.stats.num_nodes / elapsed_s:.0f} nodes/s)"
+        )
+        if self.stats.output_bytes:
+            message += f", {self.stats.output_bytes / 1e6:.1f} MB written"
+        print(message, file=sys.stderr)
+
+
+def _get_output_filename(input_filename: str, output_dir: str | None, suffix: str) -> str:
+    directory, basename = os.path.split(input_filename)
+    return os.path.join(output_dir if output_dir is not None else directory, strip_trace_extension(basename) + suffix)
+
+
+def _run_convert_tasks(command: str, tasks: list[ConvertTask], jobs: int):
+    for task in tasks:
+        if os.path.abspath(task.input_filename) == os.path.abspath(task.output_filename):
+            raise ValueError(f"{task.input_filename} would be overwritten!")
+    reporter = ThroughputReporter(command)
+    for stats in imap_ordered(convert_file, tasks, jobs):
+        reporter.add(stats)
+    reporter.report()
+
+
+def convert_command(args: argparse.Namespace):
+    suffix = FORMAT_EXTENSIONS[args.to]
+    tasks = [
+        ConvertTask(filename, _get_output_filename(filename, args.output_dir, suffix), args.to)
+        for filename in args.inputs
+    ]
+    _run_convert_tasks("convert", tasks, args.jobs)
+
+
+def slim_command(args: argparse.Namespace):
+    tasks = []
+    for filename in args.inputs:
+        trace_format = args.to or get_trace_format(filename)
+        output_filename = _get_output_filename(filename, args.output_dir, ".slim" + FORMAT_EXTENSIONS[trace_format])
+        tasks.append(
+            ConvertTask(
+                filename,
+                output_filename,
+                trace_format,
+                include_frame_infos=not args.drop_frame_infos,
+                max_property_size=args.max_property_size,
+            )
+        )
+    _run_convert_tasks("slim", tasks, args.jobs)
+
+
+def summarize_command(args: argparse.Namespace):
+    reporter = ThroughputReporter("summarize")
+    summaries = {}
+    for filename, (summary, stats) in zip(args.inputs, imap_ordered(summarize_file, args.inputs, args.jobs)):
+        summaries[filename] = summary
+        reporter.add(stats)
+    total = merge_summaries(summaries.values())
+
+    if args.json:
+        print(json.dumps(dict(files=summaries, total=total), indent=1))
+    else:
+        for filename, summary in summaries.items():
+            print(f"{filename}: {summary['num_nodes']} nodes, {summary['duration_ms']} ms")
+        print(f"Total: {total['num_files']} files, {total['num_nodes']} nodes, {total['duration_ms']} ms")
+        for key in ("kinds", "names"):
+            print(f"\nTop {key} by total time:")
+            top = sorted(total[key].items(), key=lambda item: item[1]["total_ms"], reverse=True)[: args.top]
+            for name, stats in top:
+                print(
+                    f"  {name:<40} {stats['count']:>10} calls {stats['total_ms']:>14} ms"
+                    f" {stats['self_ms']:>14} ms self"
+                )
+    reporter.report()
+
+
+def merge_unique_objects(unique_objects: dict[str, object], other: dict[str, object], filename: str):
+    """
+    Merge the unique objects of a trace into `unique_objects`.
+
+    Nodes refer to unique objects by name, so we cannot rename them. Names that are already taken by a different
+    object raise a `ValueError`.
+    """
+    for name, properties in other.items():
+        existing = unique_objects.setdefault(name, properties)
+        if existing is not properties and existing != properties:
+            raise ValueError(f"{filename} registers a different unique object {name!r} than an earlier trace!")
+
+
+def merge_traces(
+    traces: typing.Iterable[tuple[str, Trace]], unique_objects: dict[str, object]
+) -> typing.Iterator[TraceNode]:
+    """
+    Wrap the nodes of each trace in a scope node (named after the trace or its file).
+
+    The nodes are copied with new event ids, so they stay unique (the input traces are not modified). The unique
+    objects of the traces are merged into `unique_objects` (see `merge_unique_objects`).
+    """
+    next_event_id = 1
+    for filename, trace in traces:
+        merge_unique_objects(unique_objects, trace.unique_objects, filename)
+
+        scope_event_id = next_event_id
+        nodes = iter_preorder(trace.traces, operator.attrgetter("children"))
+        min_event_id = min((node.event_id for node in nodes), default=scope_event_id + 1)
+        shift = scope_event_id + 1 - min_event_id
+        next_event_id = scope_event_id + 1
+
+        def renumber(node: TraceNode, children: list[TraceNode], _depth: int) -> TraceNode:
+            nonlocal next_event_id
+            event_id = node.event_id + shift
+            next_event_id = max(next_event_id, event_id + 1)
+            return node.model_copy(update=dict(event_id=event_id, children=children))
+
+        roots = [transform_bottom_up(root, operator.attrgetter("children"), renumber) for root in trace.traces]
+        yield TraceNode.model_construct(
+            kind=TraceNodeKind.SCOPE,
+            name=trace.name or os.path.basename(filename),
+            event_id=scope_event_id,
+            start_time_ms=min((node.start_time_ms for node in roots), default=0),
+            end_time_ms=max((node.end_time_ms for node in roots), default=0),
+            running=any(node.running for node in roots),
+            tracer_overhead_ms=sum(node.tracer_overhead_ms for node in roots),
+            delta_frame_infos=[],
+            properties=dict(trace.properties) | {"source_file": filename},
+            children=roots,
+        )
+
+
+def merge_command(args: argparse.Namespace):
+    if get_trace_format(args.output) in ("columnar", "dedup"):
+        raise ValueError(
+            f"Merging into the {get_trace_format(args.output)} format is not supported. Merge into JSON and convert"
+            " instead."
+        )
+
+    reporter = ThroughputReporter("merge")
+
+    def iter_traces():
+        for filename, (picklable_trace, stats) in zip(
+            args.inputs, imap_ordered(load_file_for_merge, args.inputs, args.jobs)
+        ):
+            reporter.add(stats)
+            yield filename, picklable_trace.to_trace()
+
+    unique_objects: dict[str, object] = {}
+    properties: dict[str, object] = {"merged_files": list(args.inputs)}
+    # The nodes are written while the inputs are loaded; the merged unique objects are written last.
+    save_json_trace_file(
+        args.output,
+        lambda f, index: write_trace_nodes(
+            f, args.name, merge_traces(iter_traces(), unique_objects), properties, unique_objects, index
+        ),
+    )
+    reporter.stats.output_bytes = os.path.getsize(args.output)
+    reporter.report()
+
+
+def diff_command(args: argparse.Namespace):
+    reporter = ThroughputReporter("diff")
+    run_sets = RunSet(), RunSet()
+    for run_set, filenames in zip(run_sets, (args.baseline, args.candidate)):
+        for filename, samples in zip(filenames, imap_ordered(collect_run_samples_from_file, filenames, args.jobs)):
+            run_set.add_run(samples)
+            reporter.add(FileStats(input_bytes=os.path.getsize(filename), num_nodes=sum(samples.call_counts.values())))
+    report = diff_run_sets(*run_sets)
+
+    if args.output is not None:
+        with open(args.output, "wb") as f:
+            f.write(json_dumps(report.to_dict()))
+    if args.flame_graph is not None:
+        with open(args.flame_graph, "wb") as f:
+            f.write(json_dumps(convert_diff_to_flame_graph_data(report)))
+    if args.svg is not None:
+        from llmtracer.handlers.svg_writer import save_trace_as_svg
+
+        save_trace_as_svg(args.svg, build_diff_trace(report), highlight_critical_path=False)
+
+    print(f"{report.num_baseline_runs} baseline runs vs {report.num_candidate_runs} candidate runs")
+    print(f"\nTop paths by latency delta ({len(report.new_paths)} new, {len(report.missing_paths)} missing):")
+    for path_diff in report.paths[: args.top]:
+        relative_delta = path_diff.relative_delta
+        relative_text = f" ({relative_delta:+.0%})" if relative_delta is not None else ""
+        print(
+            f"  {path_diff.delta_ms:+12.1f} ms{relative_text:>8} {path_diff.status:<8}"
+            f" {format_call_path(path_diff.path)}"
+        )
+    if report.call_count_changes:
+        print("\nCall count changes:")
+        for count_diff in report.call_count_changes[: args.top]:
+            print(
+                f"  {count_diff.baseline.mean:10.1f} -> {count_diff.candidate.mean:<10.1f}"
+                f" {format_call_site(count_diff.site)}"
+            )
+    reporter.report()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="llmtracer", description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_jobs_argument(subparser: argparse.ArgumentParser):
+        subparser.add_argument(
+            "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="The number of worker processes."
+        )
+
+    def add_common_arguments(subparser: argparse.ArgumentParser):
+        subparser.add_argument("inputs", nargs="+", help="The trace files.")
+        add_jobs_argument(subparser)
+
+    merge_parser = subparsers.add_parser("merge", help="Merge traces into one JSON trace.")
+    merge_parser.add_argument("-o", "--output", required=True, help="The merged trace file (.json, .json.gz, ...).")
+    merge_parser.add_argument("--name", default="merged", help="The name of the merged trace.")
+    add_common_arguments(merge_parser)
+    merge_parser.set_defaults(function=merge_command)
+
+    convert_parser = subparsers.add_parser("convert", help="Convert traces to another format.")
+    convert_parser.add_argument("--to", choices=list(FORMAT_EXTENSIONS), required=True, help="The output format.")
+    convert_parser.add_argument("--output-dir", help="The output directory (defaults to the input's directory).")
+    add_common_arguments(convert_parser)
+    convert_parser.set_defaults(function=convert_command)
+
+    slim_parser = subparsers.add_parser("slim", help="Drop frame infos and large properties (writes *.slim.*).")
+    slim_parser.add_argument("--drop-frame-infos", action="store_true", help="Drop the delta frame infos.")
+    slim_parser.add_argument(
+        "--max-property-size", type=int, help="Replace property values with more JSON characters by a placeholder."
+    )
+    slim_parser.add_argument("--to", choices=list(FORMAT_EXTENSIONS), help="The output format (defaults to input's).")
+    slim_parser.add_argument("--output-dir", help="The output directory (defaults to the input's directory).")
+    add_common_arguments(slim_parser)
+    slim_parser.set_defaults(function=slim_command)
+
+    summarize_parser = subparsers.add_parser("summarize", help="Summarize node counts and times per kind and name.")
+    summarize_parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    summarize_parser.add_argument("--top", type=int, default=20, help="The number of kinds and names to show.")
+    add_common_arguments(summarize_parser)
+    summarize_parser.set_defaults(function=summarize_command)
+
+    diff_parser = subparsers.add_parser("diff", help="Diff the latencies of baseline and candidate runs.")
+    diff_parser.add_argument("--baseline", nargs="+", required=True, help="The trace files of the baseline runs.")
+    diff_parser.add_argument("--candidate", nargs="+", required=True, help="The trace files of the candidate runs.")
+    diff_parser.add_argument("-o", "--output", help="Write the report as JSON.")
+    diff_parser.add_argument("--flame-graph", help="Write the diff flame graph data as JSON.")
+    diff_parser.add_argument("--svg", help="Write the diff as interactive SVG (.svg or .svgz).")
+    diff_parser.add_argument("--top", type=int, default=20, help="The number of paths and call sites to show.")
+    add_jobs_argument(diff_parser)
+    diff_parser.set_defaults(function=diff_command)
+
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    """This is the entry point for the CLI."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    try:
+        args.function(args)
+    except (ValueError, OSError) as e:
+        parser.exit(1, f"llmtracer {args.command}: error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,15 +19,16 @@ import pprint  # noqa: F401
 import threading
 import typing
 import weakref
-from enum import Enum
 
 import reflex as rx
 import reflex_chakra as rc
 from starlette import status
 
 from llmtracer import Trace, TraceNode, TraceNodeKind
+from llmtracer.trace_loader import load_trace_file, load_trace_stream
 
-from .flame_graph import FlameGraphNode, flame_graph
+from .flame_graph import flame_graph
+from .flame_graph_data import FlameGraphNode, SolarizedColors, convert_trace_to_flame_graph_data
 from .json_view import json_view
 from .pcconfig import config
 
@@ -35,27 +36,6 @@ docs_url = "https://pynecone.io/docs/getting-started/introduction"
 filename = f"{config.app_name}/{config.app_name}.py"
 
 
-# solarized colors as HTML hex
-# https://ethanschoonover.com/solarized/
-class SolarizedColors(str, Enum):
-    base03 = "#002b36"
-    base02 = "#073642"
-    base01 = "#586e75"
-    base00 = "#657b83"
-    base0 = "#839496"
-    base1 = "#93a1a1"
-    base2 = "#eee8d5"
-    base3 = "#fdf6e3"
-    yellow = "#b58900"
-    orange = "#cb4b16"
-    red = "#dc322f"
-    magenta = "#d33682"
-    violet = "#6c71c4"
-    blue = "#268bd2"
-    cyan = "#2aa198"
-    green = "#859900"
-
-
 class NodeInfo(rx.Base):
     node_name: str
     kind: TraceNodeKind
@@ -78,7 +58,7 @@ class Wrapper(rx.Base):
 
 
 def load_example_trace():
-    return Trace.parse_file("optimization_unit_trace_example.json")
+    return load_trace_file("optimization_unit_trace_example.json")
 
 
 async def send_event(state: rx.State, event_handler: rx.event.EventHandler):
@@ -138,65 +118,6 @@ class StreamedTracesSingleton:
             self._receivers[main_state.get_sid()] = main_state
 
 
-def convert_trace_node_kind_to_color(kind: TraceNodeKind):
-    if kind == TraceNodeKind.SCOPE:
-        return SolarizedColors.base1
-    elif kind == TraceNodeKind.AGENT:
-        return SolarizedColors.green
-    elif kind == TraceNodeKind.LLM:
-        return SolarizedColors.blue
-    elif kind == TraceNodeKind.CHAIN:
-        return SolarizedColors.cyan
-    elif kind == TraceNodeKind.CALL:
-        return SolarizedColors.yellow
-    elif kind == TraceNodeKind.EVENT:
-        return SolarizedColors.orange
-    elif kind == TraceNodeKind.TOOL:
-        return SolarizedColors.magenta
-    else:
-        return SolarizedColors.base2
-
-
-def convert_node_to_color(node: TraceNode):
-    if "exception" in node.properties:
-        return SolarizedColors.red
-    else:
-        return "black"
-
-
-def convert_trace_to_flame_graph_data(trace: Trace) -> dict:
-    def convert_node(node: TraceNode, discount=1.0) -> FlameGraphNode:
-        children = []
-        last_ms = node.start_time_ms
-        for child in node.children:
-            gap_s = child.start_time_ms - last_ms
-            if gap_s > 0:
-                children.append(
-                    FlameGraphNode(
-                        name="",
-                        background_color="#00000000",
-                        value=gap_s,
-                        children=[],
-                    )
-                )
-            children.append(convert_node(child, discount=discount * 0.95))
-            last_ms = child.end_time_ms
-
-        duration_s = node.end_time_ms - node.start_time_ms
-        node_name = node.name or "/Unnamed/"
-        return FlameGraphNode(
-            id=str(node.event_id),
-            name=node_name if not node.running else f"{node_name} (*)",
-            value=duration_s * discount,
-            children=children,
-            background_color=convert_trace_node_kind_to_color(node.kind),
-            color=convert_node_to_color(node),
-        )
-
-    converted_node = convert_node(trace.traces[-1]).dict(exclude_unset=True)
-    return converted_node
-
-
 class State(rx.State):
     """The app state."""
 
@@ -248,8 +169,8 @@ class State(rx.State):
         print(f"Received file upload {files}")
         assert len(files) == 1, "Expected exactly one file"
         file = files[0]
-        upload_data = await file.read()
-        self._trace = Trace.parse_raw(upload_data)  # type: ignore
+        # Parse the spooled upload incrementally (compressed traces are decompressed while they are parsed).
+        self._trace = load_trace_stream(file.file)
         self.trace_name = None
         self.update_flame_graph()
 
@@ -451,7 +372,7 @@ def index() -> rx.Component:
                             rc.button("Load Example", on_click=State.load_default_flame_graph),
                             rc.divider(margin="0.5em"),
                             rx.upload(
-                                rc.text("Drag and drop files here or click to select trace json file."),
+                                rc.text("Drag and drop files here or click to select trace json file (.gz/.zst ok)."),
                                 rx.vstack(rx.foreach(rx.selected_files("trace-upload"), rx.text)),
                                 border="1px dotted rgb(107,99,246)",
                                 padding="1em",
@@ -20,6 +20,7 @@ from dataclasses import dataclass
 
 import requests
 
+from llmtracer.trace_serializer import dumps_trace_builder
 from llmtracer.utils.weakrefs import WeakKeyIdMap
 
 from . import pcconfig
@@ -48,11 +49,11 @@ def trace_viewer_send_trace_builder(trace_builder: 'TraceBuilder', force: bool =
     """
     # Get the TraceUpdates object for this trace
     trace_updates = _trace_builder_updates.get(trace_builder)
-    trace = trace_builder.build()
     if trace_updates is None:
-        if trace.name is not None:
+        trace_name = trace_builder.event_root.name
+        if trace_name is not None:
             # Use the trace name as the token if it is set
-            token = trace.name
+            token = trace_name
         else:
             # Generate a random token based on the current time
             token = str(int(time.time()))
@@ -69,8 +70,8 @@ def trace_viewer_send_trace_builder(trace_builder: 'TraceBuilder', force: bool =
     trace_updates.last_sent_ms = now_ms
 
     url = pcconfig.config.api_url + "/trace/" + trace_updates.token
-    payload = trace.dict()
+    payload = dumps_trace_builder(trace_builder)
     try:
-        requests.post(url, json=payload, timeout=0.05)
+        requests.post(url, data=payload, headers={"Content-Type": "application/json"}, timeout=0.05)
     except requests.exceptions.RequestException:
         pass
@@ -15,17 +15,8 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import reflex as rx
-from pydantic import BaseModel, Field
 
-
-class FlameGraphNode(BaseModel):
-    name: str
-    value: int | float
-    children: list["FlameGraphNode"]
-    color: str | None = None
-    backgroundColor: str | None = Field(None, alias="background_color")
-    tooltip: str | None = None
-    id: str | None = None
+from .flame_graph_data import FlameGraphNode  # noqa: F401
 
 
 class FlameGraph(rx.Component):
@@ -0,0 +1,140 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Conversion of traces into the data of the viewer's flame graph.
+
+This module does not depend on reflex, so it can be used (and benchmarked) without the viewer.
+"""
+import collections
+import operator
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+from llmtracer.critical_path import analyze_critical_path
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.utils.tree_traversal import transform_bottom_up
+
+
+class FlameGraphNode(BaseModel):
+    name: str
+    value: int | float
+    children: list["FlameGraphNode"]
+    color: str | None = None
+    backgroundColor: str | None = Field(None, alias="background_color")
+    tooltip: str | None = None
+    id: str | None = None
+
+
+# solarized colors as HTML hex
+# https://ethanschoonover.com/solarized/
+class SolarizedColors(str, Enum):
+    base03 = "#002b36"
+    base02 = "#073642"
+    base01 = "#586e75"
+    base00 = "#657b83"
+    base0 = "#839496"
+    base1 = "#93a1a1"
+    base2 = "#eee8d5"
+    base3 = "#fdf6e3"
+    yellow = "#b58900"
+    orange = "#cb4b16"
+    red = "#dc322f"
+    magenta = "#d33682"
+    violet = "#6c71c4"
+    blue = "#268bd2"
+    cyan = "#2aa198"
+    green = "#859900"
+
+
+def convert_trace_node_kind_to_color(kind: TraceNodeKind):
+    if kind == TraceNodeKind.SCOPE:
+        return SolarizedColors.base1
+    elif kind == TraceNodeKind.AGENT:
+        return SolarizedColors.green
+    elif kind == TraceNodeKind.LLM:
+        return SolarizedColors.blue
+    elif kind == TraceNodeKind.CHAIN:
+        return SolarizedColors.cyan
+    elif kind == TraceNodeKind.CALL:
+        return SolarizedColors.yellow
+    elif kind == TraceNodeKind.EVENT:
+        return SolarizedColors.orange
+    elif kind == TraceNodeKind.TOOL:
+        return SolarizedColors.magenta
+    else:
+        return SolarizedColors.base2
+
+
+def convert_node_to_color(node: TraceNode):
+    if "exception" in node.properties:
+        return SolarizedColors.red
+    else:
+        return "black"
+
+
+def convert_trace_to_flame_graph_data(trace: Trace) -> dict:
+    # Nodes on the critical path are marked in the name, and the tooltips show the slack of the other nodes.
+    critical_path_analysis = analyze_critical_path(trace.traces)
+
+    def convert_node(node: TraceNode, converted_children: list[dict], depth: int) -> dict:
+        discount = 0.95**depth
+        children = []
+        last_ms = node.start_time_ms
+        for child, converted_child in zip(node.children, converted_children):
+            gap_s = child.start_time_ms - last_ms
+            if gap_s > 0:
+                children.append(
+                    FlameGraphNode(
+                        name="",
+                        background_color="#00000000",
+                        value=gap_s,
+                        children=[],
+                    ).dict(exclude_unset=True)
+                )
+            children.append(converted_child)
+            last_ms = child.end_time_ms
+
+        duration_s = node.end_time_ms - node.start_time_ms
+        node_name = node.name or "/Unnamed/"
+        if node.running:
+            node_name += " (*)"
+        slack_ms = critical_path_analysis.slack_ms[node.event_id]
+        if slack_ms == 0:
+            node_name = f"▶ {node_name}"
+            tooltip = f"{node_name}: {duration_s / 1000:.2f} s (critical path)"
+        else:
+            tooltip = f"{node_name}: {duration_s / 1000:.2f} s (slack: {slack_ms / 1000:.2f} s)"
+        marks = node.get_marks()
+        if marks:
+            mark_counts = collections.Counter(name for _, name, _ in marks)
+            tooltip += " · marks: " + ", ".join(
+                name if count == 1 else f"{name} ×{count}" for name, count in mark_counts.most_common()
+            )
+        # Convert to dicts right away: nested pydantic models would be serialized recursively.
+        converted_node = FlameGraphNode(
+            id=str(node.event_id),
+            name=node_name,
+            tooltip=tooltip,
+            value=duration_s * discount,
+            children=[],
+            background_color=convert_trace_node_kind_to_color(node.kind),
+            color=convert_node_to_color(node),
+        ).dict(exclude_unset=True)
+        converted_node["children"] = children
+        return converted_node
+
+    return transform_bottom_up(trace.traces[-1], operator.attrgetter("children"), convert_node)
@@ -17,24 +17,32 @@ Simple logger/execution tracker that uses tracks the stack frames and 'data'.
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import array
+import heapq
 import inspect
+import operator
 import time
 import traceback
+import types
 import typing
+import weakref
 from contextlib import contextmanager
 from contextvars import ContextVar
 from dataclasses import dataclass, field
 from functools import partial, wraps
 from typing import ClassVar
 
-from langchain.schema import BaseMessage
-
 from llmtracer import module_filtering
-from llmtracer.frame_info import FrameInfo, get_frame_infos
-from llmtracer.object_converter import DynamicObjectConverter, ObjectConverter, convert_pydantic_model
-from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.frame_info import FrameInfo, FrameInfoTable, get_frame_infos
+from llmtracer.object_converter import _PRIMITIVE_TYPES, DynamicObjectConverter, ObjectConverter, convert_pydantic_model
+from llmtracer.trace_schema import MARKS_PROPERTY, Trace, TraceNode, TraceNodeKind
 from llmtracer.utils.callable_wrapper import CallableWrapper
-from llmtracer.utils.weakrefs import WeakKeyIdMap
+from llmtracer.utils.tree_traversal import iter_preorder, transform_bottom_up
+from llmtracer.utils.weakrefs import WeakKeyIdMap, supports_weakrefs
+
+if typing.TYPE_CHECKING:
+    from llmtracer.sampling import CallSampler, SamplingPolicy
+    from llmtracer.trace_spill import SpilledSubtree, SpillFile
 
 T = typing.TypeVar("T")
 P = typing.ParamSpec("P")
@@ -44,8 +52,8 @@ trace_object_converter = DynamicObjectConverter()
 trace_module_filters = None
 
 # TODO: move this somewhere else?
-# chat messages need to be converted to JSON
-trace_object_converter.register_converter(convert_pydantic_model, BaseMessage)
+# chat messages need to be converted to JSON (registered lazily, so we do not have to import langchain here)
+trace_object_converter.register_lazy_converter(convert_pydantic_model, "langchain_core.messages.base", "BaseMessage")
 
 
 def default_timer() -> int:
@@ -59,9 +67,173 @@ def default_timer() -> int:
 
 
 @dataclass
+class SiblingAggregate:
+    """
+    The exemplars of an aggregated node (see `TraceBuilder.aggregate_siblings`).
+
+    The statistics are kept in the node's `aggregate` property, so they are serialized with it.
+    """
+
+    num_exemplars: int
+    first: list['TraceNodeBuilder'] = field(default_factory=list)
+    # Min-heap of (duration, event id, node) of the slowest nodes that are not among the first ones.
+    slowest: list[tuple[int, int, 'TraceNodeBuilder']] = field(default_factory=list)
+
+    def add_exemplar(self, node: 'TraceNodeBuilder', duration_ms: int) -> 'TraceNodeBuilder | None':
+        """
+        Keep the node as exemplar if it is among the first or slowest ones.
+
+        Returns the node that is not (or no longer) an exemplar: the given node, the one it replaced, or None.
+        """
+        if len(self.first) < self.num_exemplars:
+            self.first.append(node)
+            return None
+        entry = (duration_ms, node.event_id, node)
+        if len(self.slowest) < self.num_exemplars:
+            heapq.heappush(self.slowest, entry)
+            return None
+        if self.slowest and entry[:2] > self.slowest[0][:2]:
+            return heapq.heapreplace(self.slowest, entry)[2]
+        return node
+
+    def get_exemplars(self) -> list['TraceNodeBuilder']:
+        """
+        The exemplars in call order.
+        """
+        return self.first + sorted((node for _, _, node in self.slowest), key=operator.attrgetter("event_id"))
+
+
+class DeferredProperty:
+    """
+    A property value of a node builder that is only converted to JSON when the trace is built or serialized.
+    """
+
+    __slots__ = ()
+
+    def to_jsonable(self) -> object:
+        raise NotImplementedError()
+
+
+class CapturedException(DeferredProperty):
+    """
+    An exception captured by `TraceBuilder.exit_event`, formatted only when the trace is built or serialized.
+
+    All nodes that an exception propagates through share one instance (as their `exception` property), so the
+    traceback is extracted and formatted once. The source lines are only looked up when formatting.
+
+    The sharing is in memory only: each of those nodes still serializes the full formatted traceback, so that readers
+    of a node's `exception` property do not have to resolve it from another node.
+    """
+
+    __slots__ = ("traceback_exception", "_formatted")
+
+    def __init__(self, exception: BaseException):
+        self.traceback_exception = traceback.TracebackException.from_exception(exception, lookup_lines=False)
+        self._formatted: str | None = None
+
+    def format(self) -> str:
+        if self._formatted is None:
+            self._formatted = '\n'.join(self.traceback_exception.format())
+        return self._formatted
+
+    def to_jsonable(self) -> str:
+        return self.format()
+
+    def __str__(self):
+        return self.format()
+
+    def __repr__(self):
+        return f"CapturedException({self.traceback_exception.exc_type.__qualname__})"
+
+
+class MarkTimeline(DeferredProperty):
+    """
+    The instant events of a node (see `TraceBuilder.mark`), stored as its reserved `_marks` property (`MARKS_PROPERTY`).
+
+    The marks are kept in columns: time offsets (in ms since the node's start), ids into the node's mark names, and
+    payloads (only allocated once a mark has one). In JSON:
+
+        {"names": [...], "name_ids": [...], "offset_ms": [...], "payloads": [...]}
+    """
+
+    __slots__ = ("names", "_name_ids", "name_ids", "offsets_ms", "payloads")
+
+    def __init__(self):
+        self.names: list[str] = []
+        self._name_ids: dict[str, int] = {}
+        self.name_ids = array.array("I")
+        self.offsets_ms = array.array("d")
+        self.payloads: list[object] | None = None
+
+    def __len__(self):
+        return len(self.offsets_ms)
+
+    def add(self, offset_ms: float, name: str, payload: object = None):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        if payload is not None and self.payloads is None:
+            self.payloads = [None] * len(self.offsets_ms)
+        self.name_ids.append(name_id)
+        self.offsets_ms.append(offset_ms)
+        if self.payloads is not None:
+            self.payloads.append(payload)
+
+    def to_jsonable(self) -> dict[str, list]:
+        jsonable: dict[str, list] = {
+            "names": list(self.names),
+            "name_ids": self.name_ids.tolist(),
+            "offset_ms": self.offsets_ms.tolist(),
+        }
+        if self.payloads is not None:
+            jsonable["payloads"] = list(self.payloads)
+        return jsonable
+
+    def __repr__(self):
+        return f"MarkTimeline({len(self)} marks)"
+
+
+def get_jsonable_properties(properties: dict[str, object]) -> dict[str, object]:
+    """
+    The properties with deferred values converted (a copy if there are any).
+    """
+    if not any(isinstance(value, DeferredProperty) for value in properties.values()):
+        return properties
+    return {
+        key: value.to_jsonable() if isinstance(value, DeferredProperty) else value for key, value in properties.items()
+    }
+
+
+def count_nodes(node: 'TraceNodeBuilder') -> int:
+    """
+    The number of nodes in the subtree that are in memory (not counting the stubs of spilled subtrees).
+    """
+    return sum(1 for node in iter_preorder([node], operator.attrgetter("children")) if node.spilled is None)
+
+
+def get_duration_histogram_bucket(duration_ms: int) -> int:
+    """
+    The log2 histogram bucket of a duration: bucket i counts durations in [2**(i-1), 2**i) ms (bucket 0 is 0ms).
+    """
+    return max(duration_ms, 0).bit_length()
+
+
+# Returned by `TraceNodeBuilder.get_properties` for nodes without properties. Never modified.
+_NO_PROPERTIES: dict[str, object] = {}
+
+
+@dataclass(slots=True, init=False)
 class TraceNodeBuilder:
     """
     A node builder in the trace tree.
+
+    Nodes are slotted and only allocate their properties dict when it is first accessed, as trace builders can hold
+    millions of them. (`__init__` is written out, so that the properties can still be passed as `properties`.)
+
+    Only open nodes have a `parent`: `TraceBuilder.exit_event` clears it when a node finishes, so finished subtrees
+    contain no reference cycles (and are freed by reference counting alone). Do not rely on the parent of finished
+    nodes.
     """
 
     kind: TraceNodeKind
@@ -72,9 +244,68 @@ class TraceNodeBuilder:
     stack_height: int
 
     end_time_ms: int | None = None
+    tracer_overhead_ms: float = 0.0
+    # The builder's `tracer_overhead_ns` when the node was opened.
+    tracer_overhead_ns_at_start: int = 0
+    # Cleared when the node is finished (see `TraceBuilder.exit_event`).
     parent: 'TraceNodeBuilder | None' = None
     children: list['TraceNodeBuilder'] = field(default_factory=list)
-    properties: dict[str, object] = field(default_factory=dict)
+    _properties: dict[str, object] | None = field(default=None, init=False, repr=False)
+    # Set for nodes that aggregate repeated sibling calls.
+    aggregate: SiblingAggregate | None = None
+    # Set for stubs of subtrees that were spilled to disk.
+    spilled: 'SpilledSubtree | None' = None
+
+    def __init__(
+        self,
+        kind: TraceNodeKind,
+        name: str | None,
+        event_id: int,
+        start_time_ms: int,
+        delta_frame_infos: list[FrameInfo],
+        stack_height: int,
+        end_time_ms: int | None = None,
+        tracer_overhead_ms: float = 0.0,
+        tracer_overhead_ns_at_start: int = 0,
+        parent: 'TraceNodeBuilder | None' = None,
+        children: list['TraceNodeBuilder'] | None = None,
+        aggregate: SiblingAggregate | None = None,
+        spilled: 'SpilledSubtree | None' = None,
+        properties: dict[str, object] | None = None,
+    ):
+        self.kind = kind
+        self.name = name
+        self.event_id = event_id
+        self.start_time_ms = start_time_ms
+        self.delta_frame_infos = delta_frame_infos
+        self.stack_height = stack_height
+        self.end_time_ms = end_time_ms
+        self.tracer_overhead_ms = tracer_overhead_ms
+        self.tracer_overhead_ns_at_start = tracer_overhead_ns_at_start
+        self.parent = parent
+        self.children = [] if children is None else children
+        self._properties = properties
+        self.aggregate = aggregate
+        self.spilled = spilled
+
+    @property
+    def properties(self) -> dict[str, object]:
+        """
+        The node's properties, allocated on first access. Use `get_properties` to only read them.
+        """
+        if self._properties is None:
+            self._properties = {}
+        return self._properties
+
+    @properties.setter
+    def properties(self, properties: dict[str, object]):
+        self._properties = properties
+
+    def get_properties(self) -> dict[str, object]:
+        """
+        The node's properties without allocating them. The result must not be modified.
+        """
+        return self._properties if self._properties is not None else _NO_PROPERTIES
 
     @classmethod
     def create_root(cls):
@@ -88,29 +319,50 @@ class TraceNodeBuilder:
         )
 
     def get_delta_frame_infos(
-        self, num_frames_to_skip: int = 0, module_filters: module_filtering.ModuleFilters | None = None, context=3
+        self,
+        num_frames_to_skip: int = 0,
+        module_filters: module_filtering.ModuleFilters | None = None,
+        context=3,
+        frame_info_table: FrameInfoTable | None = None,
     ):
         frame_infos, full_stack_height = get_frame_infos(
             num_top_frames_to_skip=num_frames_to_skip + 1,
             num_bottom_frames_to_skip=self.stack_height,
             module_filters=module_filters,
             context=context,
+            frame_info_table=frame_info_table,
         )
 
         return frame_infos, full_stack_height
 
-    def build(self):
-        return TraceNode(
-            kind=self.kind,
-            name=self.name,
-            event_id=self.event_id,
-            start_time_ms=self.start_time_ms,
-            end_time_ms=self.end_time_ms or default_timer(),
-            running=self.end_time_ms is None,
-            delta_frame_infos=self.delta_frame_infos,
-            properties=self.properties,
-            children=[sub_event.build() for sub_event in self.children],
-        )
+    def build(self, now_ms: int | None = None):
+        """
+        Build the `TraceNode` tree of this node.
+
+        Args:
+            now_ms: The end time to use for running nodes (defaults to the current time). `TraceBuilder.build` passes
+                its `get_time_ms()`, so running nodes use the same clock as the rest of the trace.
+        """
+        if now_ms is None:
+            now_ms = default_timer()
+
+        def build_node(node: TraceNodeBuilder, children: list[TraceNode], depth: int):
+            if node.spilled is not None:
+                return node.spilled.load()
+            return TraceNode(
+                kind=node.kind,
+                name=node.name,
+                event_id=node.event_id,
+                start_time_ms=node.start_time_ms,
+                end_time_ms=node.end_time_ms or now_ms,
+                running=node.end_time_ms is None,
+                tracer_overhead_ms=node.tracer_overhead_ms,
+                delta_frame_infos=node.delta_frame_infos,
+                properties=get_jsonable_properties(node.get_properties()),
+                children=children,
+            )
+
+        return transform_bottom_up(self, operator.attrgetter("children"), build_node)
 
 
 class TraceBuilderEventHandler:
@@ -121,7 +373,7 @@ class TraceBuilderEventHandler:
         pass
 
 
-@dataclass(weakref_slot=True, slots=True)
+@dataclass(weakref_slot=True, slots=True)  # type: ignore  # (mypy checks for Python 3.10)
 class TraceBuilder:
     _current: ClassVar[ContextVar['TraceBuilder | None']] = ContextVar("current_trace_builder", default=None)
 
@@ -131,17 +383,44 @@ class TraceBuilder:
     event_root: TraceNodeBuilder = field(default_factory=TraceNodeBuilder.create_root)
     object_map: WeakKeyIdMap[object, str] = field(default_factory=WeakKeyIdMap)
     unique_objects: dict[str, dict] = field(default_factory=dict)
+    # The frame infos of all nodes (so nodes from the same call site share them).
+    frame_info_table: FrameInfoTable = field(default_factory=FrameInfoTable)
 
     id_counter: int = 0
     current_event_node: TraceNodeBuilder | None = None
 
     event_handlers: list[TraceBuilderEventHandler] = field(default_factory=list)
+    # Tail-based sampling: buffer each scope and only pass it to the handlers if the policy keeps it.
+    sampling_policy: 'SamplingPolicy | None' = None
+    # Merge consecutive sibling nodes with the same name, kind and call site into one node (keeping this many of the
+    # first and of the slowest nodes as its children). None disables the aggregation.
+    aggregate_siblings: int | None = None
+    # Spill finished top-level subtrees (children of a scope) to a temporary file (in `spill_directory`) when more
+    # than this many nodes are in memory. None disables spilling.
+    max_resident_nodes: int | None = None
+    spill_directory: str | None = None
+    # The number of nodes in memory (not counting the small stubs of spilled subtrees).
+    num_resident_nodes: int = 0
+    _spill_file: 'SpillFile | None' = None
+    # The number of children of the current scope that cannot be spilled anymore (because they already were).
+    _num_spilled_children: int = 0
+    # The exception propagating out of the node that exited last (and its capture). It is dropped at the next event, so
+    # a handled exception (and the frames of its traceback) is not kept alive: when a node is entered or exits
+    # normally, the exception has stopped propagating (or is captured again if it is still propagating).
+    _propagating_exception: tuple[BaseException, CapturedException] | None = None
+
+    # Subtract the tracer's own overhead from the recorded times, so it does not distort the durations.
+    subtract_tracer_overhead: bool = False
+    # Total time the tracer has spent on itself (in ns, measured with `time.perf_counter_ns`).
+    tracer_overhead_ns: int = 0
+    _last_time_ms: int = 0
 
     def build(self):
+        now_ms = self.get_time_ms()
         return Trace(
             name=self.event_root.name,
             properties=self.event_root.properties,
-            traces=[child.build() for child in self.event_root.children],
+            traces=[child.build(now_ms) for child in self.event_root.children],
             unique_objects=self.unique_objects,
         )
 
@@ -149,6 +428,22 @@ class TraceBuilder:
         self.id_counter += 1
         return self.id_counter
 
+    def get_time_ms(self) -> int:
+        """
+        The current time for new events (minus the tracer overhead so far if `subtract_tracer_overhead` is set).
+        """
+        if not self.subtract_tracer_overhead:
+            return default_timer()
+        # The overhead is measured with a different clock, so make sure that the adjusted times never go backwards.
+        self._last_time_ms = max(self._last_time_ms, (time.time_ns() - self.tracer_overhead_ns) // 1_000_000)
+        return self._last_time_ms
+
+    def add_tracer_overhead(self, start_ns: int):
+        """
+        Account for the tracer's own work since `start_ns` (from `time.perf_counter_ns`).
+        """
+        self.tracer_overhead_ns += time.perf_counter_ns() - start_ns
+
     @contextmanager
     def scope(self, name: str | None = None):
         """
@@ -158,14 +453,37 @@ class TraceBuilder:
         self.current_event_node = self.event_root
 
         token = self._current.set(self)
+        self._num_spilled_children = 0
+        scope_node = None
         try:
             with self.event_scope(name=name, kind=TraceNodeKind.SCOPE, skip_frames=2):
+                scope_node = self.current_event_node
                 yield self
         finally:
-            for handler in self.event_handlers:
-                handler.on_scope_final(self)
+            if self.sampling_policy is None:
+                for handler in self.event_handlers:
+                    handler.on_scope_final(self)
+            elif scope_node is not None:
+                self._finish_sampled_scope(scope_node)
             self._current.reset(token)
             self.current_event_node = None
+            self._propagating_exception = None
+
+    def _finish_sampled_scope(self, scope_node: TraceNodeBuilder):
+        assert self.sampling_policy is not None
+        overhead_start_ns = time.perf_counter_ns()
+        keep = self.sampling_policy.should_keep(scope_node)
+        if not keep:
+            self.event_root.children.remove(scope_node)
+            self.num_resident_nodes -= count_nodes(scope_node)
+        self.add_tracer_overhead(overhead_start_ns)
+
+        if keep:
+            # The handlers were not called while the scope was buffered, so they only see it now (once).
+            for handler in self.event_handlers:
+                handler.on_event_scope_final(self)
+            for handler in self.event_handlers:
+                handler.on_scope_final(self)
 
     @contextmanager
     def event_scope(
@@ -174,19 +492,56 @@ class TraceBuilder:
         properties: dict[str, object] | None = None,
         kind: TraceNodeKind = TraceNodeKind.SCOPE,
         skip_frames: int = 0,
+        sampler: 'CallSampler | None' = None,
     ):
         """
         Context manager that allows to trace our program execution.
+
+        If the `sampler` does not sample the scope, it gets no node and is only counted in the current node (see
+        `add_unsampled_call`). Events within it are added to the current node then.
+        """
+        if sampler is not None and not sampler.should_sample(name):
+            start_ns = time.perf_counter_ns()
+            try:
+                yield
+            finally:
+                self.add_unsampled_call(name, time.perf_counter_ns() - start_ns)
+            return
+
+        event_node = self.enter_event(name, properties, kind, skip_frames=2 + skip_frames)
+        exception = None
+        try:
+            yield
+        except BaseException as e:
+            exception = e
+            raise
+        finally:
+            self.exit_event(event_node, exception)
+
+    def enter_event(
+        self,
+        name: str | None,
+        properties: dict[str, object] | None = None,
+        kind: TraceNodeKind = TraceNodeKind.SCOPE,
+        skip_frames: int = 0,
+    ) -> TraceNodeBuilder:
+        """
+        Open a new event node below the current one and make it current.
+
+        Prefer `event_scope`. This is for callers that cannot use a context manager. Every node must be closed
+        with `exit_event` (in reverse order).
         """
         assert self._current.get() is self
         assert self.current_event_node is not None
 
-        if properties is None:
-            properties = {}
-
-        start_time = default_timer()
+        overhead_start_ns = time.perf_counter_ns()
+        self._propagating_exception = None
+        start_time = self.get_time_ms()
         delta_frame_infos, stack_height = self.current_event_node.get_delta_frame_infos(
-            num_frames_to_skip=2 + skip_frames, module_filters=self.module_filters, context=self.stack_frame_context
+            num_frames_to_skip=1 + skip_frames,
+            module_filters=self.module_filters,
+            context=self.stack_frame_context,
+            frame_info_table=self.frame_info_table,
         )
         event_node = TraceNodeBuilder(
             kind=kind,
@@ -196,26 +551,195 @@ class TraceBuilder:
             delta_frame_infos=delta_frame_infos,
             stack_height=stack_height - 1,
             parent=self.current_event_node,
-            properties=dict(properties),
+            tracer_overhead_ns_at_start=self.tracer_overhead_ns,
         )
+        if properties:
+            event_node.properties = dict(properties)
         self.current_event_node.children.append(event_node)
-
-        old_event_node = self.current_event_node
         self.current_event_node = event_node
+        self.num_resident_nodes += 1
+        self.add_tracer_overhead(overhead_start_ns)
+        return event_node
 
-        try:
-            yield
-        except BaseException as e:
-            self.update_event_properties(exception='\n'.join(traceback.TracebackException.from_exception(e).format()))
-            raise
-        finally:
-            event_node.end_time_ms = default_timer()
-            self.current_event_node = old_event_node
+    def exit_event(self, event_node: TraceNodeBuilder, exception: BaseException | None = None):
+        """
+        Close the current event node (opened with `enter_event`), recording the exception it exited with (if any).
+        """
+        assert self.current_event_node is event_node
 
+        overhead_start_ns = time.perf_counter_ns()
+        if exception is not None:
+            event_node.properties["exception"] = self.capture_exception(exception)
+        else:
+            # The exception was handled below this node (a re-raised one is simply captured again).
+            self._propagating_exception = None
+        event_node.end_time_ms = self.get_time_ms()
+        # The work below is charged to this node, too. Aggregation, spilling and the handlers already need the
+        # overhead, so it is set to the overhead so far here and updated at the end.
+        event_node.tracer_overhead_ms = (
+            self.tracer_overhead_ns
+            + time.perf_counter_ns()
+            - overhead_start_ns
+            - event_node.tracer_overhead_ns_at_start
+        ) / 1e6
+        parent = event_node.parent
+        # Finished nodes do not need their parent anymore, and dropping it avoids a reference cycle per node.
+        event_node.parent = None
+        self.current_event_node = parent
+        aggregate_node = None
+        if self.aggregate_siblings is not None and exception is None and parent is not None:
+            aggregate_node = self._aggregate_with_previous_sibling(parent, event_node)
+        if (
+            self.max_resident_nodes is not None
+            and self.num_resident_nodes > self.max_resident_nodes
+            and parent is not None
+            and parent.parent is self.event_root
+        ):
+            self._spill_finished_children(parent)
+
+        # With a sampling policy, the handlers have to wait until we know whether the scope is kept.
+        if self.sampling_policy is None:
             for handler in self.event_handlers:
                 handler.on_event_scope_final(self)
+        self.add_tracer_overhead(overhead_start_ns)
+
+        tracer_overhead_ms = (self.tracer_overhead_ns - event_node.tracer_overhead_ns_at_start) / 1e6
+        if aggregate_node is not None:
+            aggregate_node.tracer_overhead_ms += tracer_overhead_ms - event_node.tracer_overhead_ms
+        event_node.tracer_overhead_ms = tracer_overhead_ms
+
+    def capture_exception(self, exception: BaseException) -> CapturedException:
+        """
+        Capture the exception, or return its existing capture if it is propagating from a nested node.
+        """
+        propagating_exception = self._propagating_exception
+        if propagating_exception is not None and propagating_exception[0] is exception:
+            return propagating_exception[1]
+        captured_exception = CapturedException(exception)
+        self._propagating_exception = (exception, captured_exception)
+        return captured_exception
+
+    def _aggregate_with_previous_sibling(
+        self, parent: TraceNodeBuilder, event_node: TraceNodeBuilder
+    ) -> TraceNodeBuilder | None:
+        """
+        Merge the (just finished) node into its previous sibling if that is the same call.
+
+        Returns the aggregate node it was merged into (or None).
+        """
+        assert self.aggregate_siblings is not None
+        if len(parent.children) < 2 or parent.children[-1] is not event_node:
+            return None
+        previous = parent.children[-2]
+        if (
+            previous.name != event_node.name
+            or previous.kind != event_node.kind
+            or "exception" in previous.get_properties()
+            or previous.spilled is not None
+            or previous.delta_frame_infos != event_node.delta_frame_infos
+        ):
+            return None
+
+        parent.children.pop()
+        if previous.aggregate is None:
+            previous = self._create_aggregate_node(previous)
+            parent.children[-1] = previous
+        self._add_to_aggregate_node(previous, event_node)
+        return previous
+
+    def _create_aggregate_node(self, first_node: TraceNodeBuilder) -> TraceNodeBuilder:
+        assert self.aggregate_siblings is not None
+        assert first_node.end_time_ms is not None
+        aggregate_node = TraceNodeBuilder(
+            kind=first_node.kind,
+            name=first_node.name,
+            event_id=self.next_id(),
+            start_time_ms=first_node.start_time_ms,
+            end_time_ms=first_node.end_time_ms,
+            delta_frame_infos=first_node.delta_frame_infos,
+            stack_height=first_node.stack_height,
+            tracer_overhead_ms=0.0,
+            aggregate=SiblingAggregate(self.aggregate_siblings),
+        )
+        aggregate_node.properties = dict(aggregate=dict(count=0, total_duration_ms=0, histogram_log2=[]))
+        self.num_resident_nodes += 1
+        self._add_to_aggregate_node(aggregate_node, first_node)
+        return aggregate_node
+
+    def _add_to_aggregate_node(self, aggregate_node: TraceNodeBuilder, node: TraceNodeBuilder):
+        assert aggregate_node.aggregate is not None and node.end_time_ms is not None
+        duration_ms = node.end_time_ms - node.start_time_ms
+        stats = typing.cast(dict, aggregate_node.properties["aggregate"])
+        if stats["count"] == 0:
+            stats["min_duration_ms"] = stats["max_duration_ms"] = duration_ms
+        else:
+            stats["min_duration_ms"] = min(stats["min_duration_ms"], duration_ms)
+            stats["max_duration_ms"] = max(stats["max_duration_ms"], duration_ms)
+        stats["count"] += 1
+        stats["total_duration_ms"] += duration_ms
+        histogram = stats["histogram_log2"]
+        bucket = get_duration_histogram_bucket(duration_ms)
+        if bucket >= len(histogram):
+            histogram.extend([0] * (bucket + 1 - len(histogram)))
+        histogram[bucket] += 1
+
+        aggregate_node.end_time_ms = node.end_time_ms
+        aggregate_node.tracer_overhead_ms += node.tracer_overhead_ms
+        dropped_node = aggregate_node.aggregate.add_exemplar(node, duration_ms)
+        if dropped_node is not None:
+            self.num_resident_nodes -= count_nodes(dropped_node)
+        if dropped_node is not node:
+            aggregate_node.children = aggregate_node.aggregate.get_exemplars()
+
+    def _spill_finished_children(self, scope_node: TraceNodeBuilder):
+        """
+        Spill all finished children of the scope node to disk (and replace them with stubs).
+
+        This is part of `exit_event`, which accounts for its overhead.
+        """
+        if self._spill_file is None:
+            from llmtracer.trace_spill import SpillFile
+
+            self._spill_file = SpillFile(self.spill_directory, self.frame_info_table)
+
+        children = scope_node.children
+        for i in range(self._num_spilled_children, len(children)):
+            child = children[i]
+            if child.end_time_ms is None or child.spilled is not None:
+                continue
+            num_nodes = count_nodes(child)
+            children[i] = self._spill_file.spill(child)
+            self.num_resident_nodes -= num_nodes
+        self._num_spilled_children = len(children)
+
+    def add_unsampled_call(self, name: str | None, duration_ns: int):
+        """
+        Account for a call (or event scope) that was not sampled in the current node's `unsampled` property.
+        """
+        assert self.current_event_node is not None
+        overhead_start_ns = time.perf_counter_ns()
+        unsampled = typing.cast(
+            dict[str | None, dict[str, typing.Any]], self.current_event_node.properties.setdefault("unsampled", {})
+        )
+        stats = unsampled.get(name)
+        if stats is None:
+            unsampled[name] = dict(count=1, duration_ms=duration_ns / 1e6)
+        else:
+            stats["count"] += 1
+            stats["duration_ms"] += duration_ns / 1e6
+        self.add_tracer_overhead(overhead_start_ns)
+
+    def register_object(self, obj: object, name: str, properties: dict[str, object], *, keep_alive: bool | None = None):
+        """
+        Register an object as unique, so that it will be serialized only once.
+
+        Objects are tracked by identity. By default, only objects that do not support weak references (e.g. dicts
+        and lists) are kept alive by the builder, so that their ids cannot be reused while the builder exists.
+        Pass `keep_alive` explicitly to override this.
+        """
+        if keep_alive is None:
+            keep_alive = not supports_weakrefs(obj)
 
-    def register_object(self, obj: object, name: str, properties: dict[str, object]):
         # Make name unique if needed
         if name in self.unique_objects:
             # if we are in a scope, we can use the scope name as a prefix
@@ -227,7 +751,7 @@ class TraceBuilder:
                 while f"{name}[{i}]" in self.unique_objects:
                     i += 1
                 name = f"{name}[{i}]"
-        self.object_map[obj] = name
+        self.object_map.put(obj, name, keep_alive=keep_alive)
         self.unique_objects[name] = properties
 
     def convert_object(self, obj: object, preferred_object_converter: ObjectConverter | None = None):
@@ -235,8 +759,9 @@ class TraceBuilder:
             preferred_object_converter = self.convert_object
 
         # if the object is in the map, we return its name as a reference
-        if obj in self.object_map:
-            return dict(unique_object=self.object_map[obj])
+        unique_object_name = self.object_map.get(obj)
+        if unique_object_name is not None:
+            return dict(unique_object=unique_object_name)
 
         return trace_object_converter(obj, preferred_object_converter)
 
@@ -266,14 +791,37 @@ class TraceBuilder:
         with self.event_scope(name, properties=properties, kind=kind, skip_frames=2):
             pass
 
+    def mark(self, name: str, payload: object = None):
+        """
+        Record an instant event (e.g. a retry, cache hit or streamed token) in the current node's marks timeline.
+
+        Unlike `add_event`, this creates no node: it captures no stack frames and does not call the handlers, so it
+        is cheap enough for high-frequency markers. The payload should be small.
+        """
+        node = self.current_event_node
+        assert node is not None
+        if self.subtract_tracer_overhead:
+            now_ms = (time.time_ns() - self.tracer_overhead_ns) / 1e6
+        else:
+            now_ms = time.time_ns() / 1e6
+        # Primitive payloads are stored as they are (without the object converter).
+        if type(payload) not in _PRIMITIVE_TYPES:
+            payload = self.convert_object(payload)
+        marks = node.get_properties().get(MARKS_PROPERTY)
+        if not isinstance(marks, MarkTimeline):
+            marks = node.properties[MARKS_PROPERTY] = MarkTimeline()
+        marks.add(now_ms - node.start_time_ms, name, payload)
+
     def update_event_properties(self, properties: dict[str, object] | None = None, /, **kwargs):
         """
         Update the properties of the current event.
         """
         assert self.current_event_node is not None
+        overhead_start_ns = time.perf_counter_ns()
         if properties is None:
             properties = {}
         self.current_event_node.properties.update(self.convert_object(properties | kwargs))
+        self.add_tracer_overhead(overhead_start_ns)
 
     def update_name(self, name: str):
         """
@@ -283,6 +831,11 @@ class TraceBuilder:
         self.current_event_node.name = name
 
 
+# The code objects of the functions decorated with `trace_calls`. Auto-instrumentation (see
+# `llmtracer.auto_instrumentation`) skips them, as their `CallTracer` already creates their nodes.
+call_tracer_code_objects: weakref.WeakSet[types.CodeType] = weakref.WeakSet()
+
+
 @dataclass
 class CallTracer(CallableWrapper, typing.Callable[P, T], typing.Generic[P, T]):  # type: ignore
     __signature__: inspect.Signature
@@ -292,6 +845,7 @@ class CallTracer(CallableWrapper, typing.Callable[P, T], typing.Generic[P, T]):
     __capture_return__: bool = False
     __capture_args__: bool | list[str] | slice = False
     __object_converter__: DynamicObjectConverter | None = None
+    __sampler__: 'CallSampler | None' = None
 
     def __call__(self, *args, **kwargs):
         # check if we are in a trace
@@ -299,16 +853,24 @@ class CallTracer(CallableWrapper, typing.Callable[P, T], typing.Generic[P, T]):
         if builder is None:
             return self.__wrapped__(*args, **kwargs)
 
+        # unsampled calls neither capture the stack nor the arguments
+        sampler = self.__sampler__
+        if sampler is not None and not sampler.should_sample(self.__wrapped_name__):
+            start_ns = time.perf_counter_ns()
+            try:
+                return self.__wrapped__(*args, **kwargs)
+            finally:
+                builder.add_unsampled_call(self.__wrapped_name__, time.perf_counter_ns() - start_ns)
+
         object_converter = self.__object_converter__
         if object_converter is None:
             object_converter = builder.convert_object
 
-        # build properties
-        properties = {}
+        arguments = None
         if self.__capture_args__ is not False:
-            # bind the arguments to the signature
+            # bind the arguments before creating the node, so that a call with the wrong signature raises without one
+            overhead_start_ns = time.perf_counter_ns()
             bound_args = self.__signature__.bind(*args, **kwargs)
-            # add the arguments to the properties
             if self.__capture_args__ is True:
                 arguments = bound_args.arguments
             elif isinstance(self.__capture_args__, list):
@@ -317,20 +879,27 @@ class CallTracer(CallableWrapper, typing.Callable[P, T], typing.Generic[P, T]):
                 arguments = {
                     arg: bound_args.arguments[arg] for arg in list(bound_args.arguments)[self.__capture_args__]
                 }
-
-            # anything that can be stored in a json is okay
-            converted_arguments = {}
-            for arg, value in arguments.items():
-                converted_arguments[arg] = object_converter(value)
-            properties["arguments"] = converted_arguments
+            builder.add_tracer_overhead(overhead_start_ns)
 
         # create event scope
-        with builder.event_scope(self.__wrapped_name__, properties, kind=self.__kind__, skip_frames=1):
+        with builder.event_scope(self.__wrapped_name__, kind=self.__kind__, skip_frames=1):
+            # convert the arguments within the node, so that it is charged with the overhead
+            if arguments is not None:
+                overhead_start_ns = time.perf_counter_ns()
+                # anything that can be stored in a json is okay
+                converted_arguments = {}
+                for arg, value in arguments.items():
+                    converted_arguments[arg] = object_converter(value)
+                builder.current_event_node.properties["arguments"] = converted_arguments
+                builder.add_tracer_overhead(overhead_start_ns)
+
             # call the function
             result = self.__wrapped__(*args, **kwargs)
 
             if self.__capture_return__:
+                overhead_start_ns = time.perf_counter_ns()
                 builder.current_event_node.properties.update({"result": object_converter(result)})
+                builder.add_tracer_overhead(overhead_start_ns)
         return result
 
 
@@ -350,9 +919,13 @@ def trace_calls(
     capture_return: bool = False,
     capture_args: bool | list[str] | slice = False,
     object_converter: DynamicObjectConverter | None = None,
+    sampler: 'CallSampler | None' = None,
 ):
     """
     Decorator that allows to trace our program execution.
+
+    With a `sampler` (see `llmtracer.sampling`), only sampled calls get a node. The others are only counted (with
+    their total duration) in the `unsampled` property of the current node.
     """
     if func is None:
         return partial(
@@ -361,6 +934,8 @@ def trace_calls(
             kind=kind,
             capture_return=capture_return,
             capture_args=capture_args,
+            object_converter=object_converter,
+            sampler=sampler,
         )
 
     # get the signature of the function
@@ -380,6 +955,10 @@ def trace_calls(
     if name is None:
         name = func.__name__
 
+    code = getattr(func, "__code__", None)
+    if code is not None:
+        call_tracer_code_objects.add(code)
+
     wrapped_function = wraps(func)(
         CallTracer(
             __signature__=signature,
@@ -389,6 +968,7 @@ def trace_calls(
             __capture_return__=capture_return,
             __capture_args__=capture_args,
             __object_converter__=object_converter,
+            __sampler__=sampler,
         )
     )
 
@@ -0,0 +1,211 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Deduplicated trace files: each structurally identical subtree is stored only once.
+
+The shape of a subtree is everything but its timings and event ids: kind, name, frame infos, properties and the shapes
+of its children. A deduplicated trace stores the unique shapes (children before their parents) and the per-node
+timings as columns in pre-order, so each instance of a shape is a contiguous slice of the columns:
+
+    {"format": "llmtracer-dedup", "version": 1, "name": ..., "properties": ..., "unique_objects": ...,
+     "shapes": [{"kind": ..., "name": ..., "delta_frame_infos": [...], "properties": {...}, "children": [...]}, ...],
+     "roots": [shape ids of the traces],
+     "timings": {"event_id_delta": [...], "start_time_delta_ms": [...], "duration_ms": [...],
+                 "tracer_overhead_ms": [...], "running": [pre-order indices of running nodes]}}
+
+Deltas are relative to the previous node in pre-order. `Trace.load_file` and the streaming loader expand these files
+transparently.
+"""
+import operator
+import os
+import typing
+
+from llmtracer.frame_info import FrameInfo, frame_info_to_jsonable
+from llmtracer.trace_files import open_trace_file_for_writing
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.trace_serializer import json_dumps, json_loads
+from llmtracer.utils.tree_traversal import iter_preorder, transform_bottom_up, visit_top_down
+
+DEDUP_FORMAT = "llmtracer-dedup"
+DEDUP_FORMAT_VERSION = 1
+DEDUP_EXTENSION = ".dedup.json"
+
+# Deduplicated traces are written with this prefix, so they can be detected without parsing them.
+DEDUP_PREFIX = b'{"format":"' + DEDUP_FORMAT.encode() + b'"'
+
+
+def load_dedup_json(data: bytes) -> Trace:
+    """Load a deduplicated trace from JSON bytes."""
+    return expand_dedup_trace(json_loads(data))
+
+
+def is_dedup_trace(data: bytes) -> bool:
+    """Whether the (start of the) JSON document is a deduplicated trace."""
+    return data.lstrip()[: len(DEDUP_PREFIX)] == DEDUP_PREFIX
+
+
+def _get_shape_fields(node: TraceNode) -> dict[str, typing.Any]:
+    return {
+        "kind": node.kind.value,
+        "name": node.name,
+        "delta_frame_infos": [frame_info_to_jsonable(frame_info) for frame_info in node.delta_frame_infos],
+        "properties": node.properties,
+    }
+
+
+def dedup_trace(trace: Trace) -> dict[str, typing.Any]:
+    """
+    Convert a trace to its deduplicated (jsonable) representation.
+    """
+    shapes: list[dict[str, typing.Any]] = []
+    # (fields JSON, child shape ids) -> shape id
+    shape_ids: dict[tuple[bytes, tuple[int, ...]], int] = {}
+
+    def add_shape(node: TraceNode, child_shape_ids: list[int], _depth: int) -> int:
+        fields = _get_shape_fields(node)
+        key = (json_dumps(fields), tuple(child_shape_ids))
+        shape_id = shape_ids.get(key)
+        if shape_id is None:
+            shape_id = shape_ids[key] = len(shapes)
+            shapes.append(fields | {"children": child_shape_ids})
+        return shape_id
+
+    roots = [transform_bottom_up(node, operator.attrgetter("children"), add_shape) for node in trace.traces]
+
+    event_id_delta: list[int] = []
+    start_time_delta_ms: list[int] = []
+    duration_ms: list[int] = []
+    tracer_overhead_ms: list[float] = []
+    running: list[int] = []
+    last_event_id = 0
+    last_start_time_ms = 0
+    for i, node in enumerate(iter_preorder(trace.traces, operator.attrgetter("children"))):
+        event_id_delta.append(node.event_id - last_event_id)
+        start_time_delta_ms.append(node.start_time_ms - last_start_time_ms)
+        duration_ms.append(node.end_time_ms - node.start_time_ms)
+        tracer_overhead_ms.append(node.tracer_overhead_ms)
+        if node.running:
+            running.append(i)
+        last_event_id = node.event_id
+        last_start_time_ms = node.start_time_ms
+
+    return {
+        "format": DEDUP_FORMAT,
+        "version": DEDUP_FORMAT_VERSION,
+        "name": trace.name,
+        "properties": trace.properties,
+        "unique_objects": trace.unique_objects,
+        "shapes": shapes,
+        "roots": roots,
+        "timings": {
+            "event_id_delta": event_id_delta,
+            "start_time_delta_ms": start_time_delta_ms,
+            "duration_ms": duration_ms,
+            "tracer_overhead_ms": tracer_overhead_ms,
+            "running": running,
+        },
+    }
+
+
+def write_dedup_trace(trace: Trace, stream: typing.BinaryIO):
+    """Write a trace as deduplicated JSON to a binary stream."""
+    stream.write(json_dumps(dedup_trace(trace)))
+
+
+def save_dedup_trace(trace: Trace, filename: str | os.PathLike):
+    """Save a trace as deduplicated JSON file (compressed if the filename ends with `.gz` or `.zst`)."""
+    with open_trace_file_for_writing(filename) as f:
+        write_dedup_trace(trace, f)
+
+
+def expand_dedup_trace(
+    document: dict[str, typing.Any],
+    include_frame_infos: bool = True,
+    transform_properties: typing.Callable[[dict[str, object]], dict[str, object]] | None = None,
+) -> Trace:
+    """
+    Expand a deduplicated trace (as parsed from JSON) into a full trace.
+
+    Nodes are created without validation (`model_construct`), so this is meant for trusted trace files. Instances of
+    a shape share the frame infos. Each node gets its own properties dict, but the (nested) property values are
+    shared, too: copy them before modifying them in place.
+
+    Args:
+        document: The deduplicated trace.
+        include_frame_infos: Whether to load the `delta_frame_infos` of the nodes (otherwise they are empty).
+        transform_properties: Applied to the properties of each shape (once), e.g. to skip large values.
+    """
+    if document.get("format") != DEDUP_FORMAT:
+        raise ValueError("Not a deduplicated trace!")
+    if document["version"] != DEDUP_FORMAT_VERSION:
+        raise ValueError(f"Unsupported deduplicated trace version {document['version']}!")
+
+    shapes = []
+    for shape in document["shapes"]:
+        properties = shape["properties"]
+        if transform_properties is not None:
+            properties = transform_properties(properties)
+        frame_infos = (
+            [FrameInfo.model_construct(**frame_info) for frame_info in shape["delta_frame_infos"]]
+            if include_frame_infos
+            else []
+        )
+        shapes.append((TraceNodeKind(shape["kind"]), shape["name"], frame_infos, properties, shape["children"]))
+
+    timings = document["timings"]
+    event_id_delta = timings["event_id_delta"]
+    start_time_delta_ms = timings["start_time_delta_ms"]
+    duration_ms = timings["duration_ms"]
+    tracer_overhead_ms = timings["tracer_overhead_ms"]
+    running = set(timings["running"])
+
+    traces: list[TraceNode] = []
+    event_id = 0
+    start_time_ms = 0
+    i = 0
+
+    def visit(shape_id: int, siblings: list[TraceNode]) -> list[TraceNode]:
+        """Expand a shape instance (in pre-order) and return the list for its children."""
+        nonlocal event_id, start_time_ms, i
+        kind, name, frame_infos, properties, _ = shapes[shape_id]
+        event_id += event_id_delta[i]
+        start_time_ms += start_time_delta_ms[i]
+        children: list[TraceNode] = []
+        siblings.append(
+            TraceNode.model_construct(
+                kind=kind,
+                name=name,
+                event_id=event_id,
+                start_time_ms=start_time_ms,
+                end_time_ms=start_time_ms + duration_ms[i],
+                running=i in running,
+                tracer_overhead_ms=tracer_overhead_ms[i],
+                delta_frame_infos=list(frame_infos),
+                properties=dict(properties),
+                children=children,
+            )
+        )
+        i += 1
+        return children
+
+    visit_top_down(document["roots"], lambda shape_id: shapes[shape_id][4], visit, traces)
+
+    return Trace.model_construct(
+        name=document["name"],
+        traces=traces,
+        properties=document["properties"],
+        unique_objects=document["unique_objects"],
+    )
@@ -0,0 +1,404 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Trace diffing for latency regressions.
+
+Nodes are aligned by their call path: the sequence of (kind, name, ordinal) from the root, where the ordinal counts the
+earlier siblings with the same kind and name. Each side (baseline and candidate) can consist of many runs; runs are
+reduced to per-path durations and per-call-site call counts one at a time, so only one trace is in memory at once.
+
+The report contains per-path latency statistics and deltas, new and missing paths, and call count changes per call
+site (the call path without ordinals). It can be turned into JSON (`TraceDiffReport.to_dict`), into a trace with the
+diff in the node properties (`build_diff_trace`, e.g. for the SVG writer or the viewer), and into flame graph data
+colored by the delta (`convert_diff_to_flame_graph_data`).
+"""
+import collections
+import math
+import operator
+import os
+import statistics
+import typing
+from dataclasses import dataclass, field
+
+from llmtracer.trace_loader import load_trace_file
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.utils.tree_traversal import visit_top_down
+
+# A call path: (kind, name, ordinal) for every node from the root.
+CallPath = tuple[tuple[str, str | None, int], ...]
+# A call site: (kind, name) for every node from the root.
+CallSite = tuple[tuple[str, str | None], ...]
+
+
+@dataclass
+class RunSamples:
+    """The per-path durations and per-call-site call counts of a single run."""
+
+    durations_ms: dict[CallPath, int] = field(default_factory=dict)
+    call_counts: collections.Counter = field(default_factory=collections.Counter)
+
+
+def collect_run_samples(trace: Trace) -> RunSamples:
+    samples = RunSamples()
+
+    def visit(
+        node: TraceNode, parent: tuple[CallPath, CallSite, collections.Counter]
+    ) -> tuple[CallPath, CallSite, collections.Counter]:
+        parent_path, parent_site, sibling_counter = parent
+        kind_and_name = (node.kind.value, node.name)
+        # The ordinal counts the earlier siblings with the same kind and name.
+        ordinal = sibling_counter[kind_and_name]
+        sibling_counter[kind_and_name] += 1
+        path = parent_path + ((*kind_and_name, ordinal),)
+        site = parent_site + (kind_and_name,)
+        samples.durations_ms[path] = node.end_time_ms - node.start_time_ms
+        samples.call_counts[site] += 1
+        return path, site, collections.Counter()
+
+    root_context: tuple[CallPath, CallSite, collections.Counter] = ((), (), collections.Counter())
+    visit_top_down(trace.traces, operator.attrgetter("children"), visit, root_context)
+    return samples
+
+
+def collect_run_samples_from_file(filename: str | os.PathLike) -> RunSamples:
+    """Collect the samples of a trace file (loaded incrementally without frame infos and properties)."""
+    return collect_run_samples(load_trace_file(filename, include_frame_infos=False, max_property_size=0))
+
+
+@dataclass
+class RunSet:
+    """The samples of several runs of one side of a diff."""
+
+    num_runs: int = 0
+    durations_ms: dict[CallPath, list[int]] = field(default_factory=lambda: collections.defaultdict(list))
+    # The call counts per run (including zeros for runs without the call site).
+    call_counts: dict[CallSite, list[int]] = field(default_factory=dict)
+
+    def add_run(self, samples: RunSamples):
+        for path, duration_ms in samples.durations_ms.items():
+            self.durations_ms[path].append(duration_ms)
+        for site in samples.call_counts.keys() - self.call_counts.keys():
+            self.call_counts[site] = [0] * self.num_runs
+        for site, counts in self.call_counts.items():
+            counts.append(samples.call_counts.get(site, 0))
+        self.num_runs += 1
+
+    def add_trace(self, trace: Trace):
+        self.add_run(collect_run_samples(trace))
+
+    def add_file(self, filename: str | os.PathLike):
+        self.add_run(collect_run_samples_from_file(filename))
+
+
+@dataclass
+class SampleStats:
+    count: int
+    mean: float
+    median: float
+    stdev: float
+    min: float
+    max: float
+
+    @staticmethod
+    def from_samples(samples: typing.Sequence[float]) -> 'SampleStats | None':
+        if not samples:
+            return None
+        if len(samples) == 1:
+            (sample,) = samples
+            return SampleStats(count=1, mean=sample, median=sample, stdev=0.0, min=sample, max=sample)
+        return SampleStats(
+            count=len(samples),
+            mean=statistics.fmean(samples),
+            median=statistics.median(samples),
+            stdev=statistics.stdev(samples),
+            min=min(samples),
+            max=max(samples),
+        )
+
+
+def welch_t_statistic(baseline: SampleStats, candidate: SampleStats) -> float | None:
+    """Welch's t statistic for the difference of the means (None if it is undefined)."""
+    if baseline.count < 2 or candidate.count < 2:
+        return None
+    standard_error = math.sqrt(baseline.stdev**2 / baseline.count + candidate.stdev**2 / candidate.count)
+    if standard_error == 0:
+        return None
+    return (candidate.mean - baseline.mean) / standard_error
+
+
+class DiffStatus:
+    CHANGED = "changed"
+    NEW = "new"
+    MISSING = "missing"
+
+
+@dataclass
+class PathDiff:
+    path: CallPath
+    status: str
+    baseline: SampleStats | None
+    candidate: SampleStats | None
+
+    @property
+    def delta_ms(self) -> float:
+        return (self.candidate.mean if self.candidate else 0.0) - (self.baseline.mean if self.baseline else 0.0)
+
+    @property
+    def relative_delta(self) -> float | None:
+        if self.baseline is None or self.candidate is None or self.baseline.mean == 0:
+            return None
+        return self.delta_ms / self.baseline.mean
+
+    @property
+    def t_statistic(self) -> float | None:
+        if self.baseline is None or self.candidate is None:
+            return None
+        return welch_t_statistic(self.baseline, self.candidate)
+
+
+@dataclass
+class CallCountDiff:
+    site: CallSite
+    baseline: SampleStats
+    candidate: SampleStats
+
+    @property
+    def delta(self) -> float:
+        return self.candidate.mean - self.baseline.mean
+
+
+def format_call_path(path: CallPath) -> str:
+    return "/".join(f"{kind}:{name}#{ordinal}" for kind, name, ordinal in path)
+
+
+def format_call_site(site: CallSite) -> str:
+    return "/".join(f"{kind}:{name}" for kind, name in site)
+
+
+def _stats_to_dict(stats: SampleStats | None) -> dict | None:
+    return None if stats is None else dict(vars(stats))
+
+
+@dataclass
+class TraceDiffReport:
+    num_baseline_runs: int
+    num_candidate_runs: int
+    # Sorted by the absolute delta (largest first).
+    paths: list[PathDiff]
+    call_count_changes: list[CallCountDiff]
+    # All call paths in order of their first occurrence (parents before their children).
+    path_order: list[CallPath]
+
+    @property
+    def new_paths(self) -> list[PathDiff]:
+        return [path_diff for path_diff in self.paths if path_diff.status == DiffStatus.NEW]
+
+    @property
+    def missing_paths(self) -> list[PathDiff]:
+        return [path_diff for path_diff in self.paths if path_diff.status == DiffStatus.MISSING]
+
+    def to_dict(self) -> dict[str, typing.Any]:
+        """A JSON-serializable version of the report."""
+        return dict(
+            num_baseline_runs=self.num_baseline_runs,
+            num_candidate_runs=self.num_candidate_runs,
+            paths=[
+                dict(
+                    path=format_call_path(path_diff.path),
+                    status=path_diff.status,
+                    delta_ms=path_diff.delta_ms,
+                    relative_delta=path_diff.relative_delta,
+                    t_statistic=path_diff.t_statistic,
+                    baseline=_stats_to_dict(path_diff.baseline),
+                    candidate=_stats_to_dict(path_diff.candidate),
+                )
+                for path_diff in self.paths
+            ],
+            call_count_changes=[
+                dict(
+                    site=format_call_site(count_diff.site),
+                    delta=count_diff.delta,
+                    baseline=_stats_to_dict(count_diff.baseline),
+                    candidate=_stats_to_dict(count_diff.candidate),
+                )
+                for count_diff in self.call_count_changes
+            ],
+        )
+
+
+def diff_run_sets(baseline: RunSet, candidate: RunSet) -> TraceDiffReport:
+    # Parents occur before their children in each run set, so they also do in the union (which is not necessarily a
+    # pre-order, though: paths that only the candidate has come after all baseline paths).
+    path_order = list(baseline.durations_ms) + [
+        path for path in candidate.durations_ms if path not in baseline.durations_ms
+    ]
+    paths = []
+    for path in path_order:
+        baseline_stats = SampleStats.from_samples(baseline.durations_ms.get(path, []))
+        candidate_stats = SampleStats.from_samples(candidate.durations_ms.get(path, []))
+        if baseline_stats is None:
+            status = DiffStatus.NEW
+        elif candidate_stats is None:
+            status = DiffStatus.MISSING
+        else:
+            status = DiffStatus.CHANGED
+        paths.append(PathDiff(path=path, status=status, baseline=baseline_stats, candidate=candidate_stats))
+    # Stable, so ties keep the path order.
+    paths.sort(key=lambda path_diff: -abs(path_diff.delta_ms))
+
+    call_count_changes = []
+    for site in baseline.call_counts.keys() | candidate.call_counts.keys():
+        baseline_counts = baseline.call_counts.get(site) or [0] * baseline.num_runs
+        candidate_counts = candidate.call_counts.get(site) or [0] * candidate.num_runs
+        if not baseline_counts or not candidate_counts:
+            continue
+        if sum(baseline_counts) * len(candidate_counts) == sum(candidate_counts) * len(baseline_counts):
+            continue
+        baseline_stats = SampleStats.from_samples(baseline_counts)
+        candidate_stats = SampleStats.from_samples(candidate_counts)
+        assert baseline_stats is not None and candidate_stats is not None
+        call_count_changes.append(CallCountDiff(site=site, baseline=baseline_stats, candidate=candidate_stats))
+    call_count_changes.sort(key=lambda count_diff: (-abs(count_diff.delta), format_call_site(count_diff.site)))
+
+    return TraceDiffReport(
+        num_baseline_runs=baseline.num_runs,
+        num_candidate_runs=candidate.num_runs,
+        paths=paths,
+        call_count_changes=call_count_changes,
+        path_order=path_order,
+    )
+
+
+def diff_traces(baseline: typing.Iterable[Trace], candidate: typing.Iterable[Trace]) -> TraceDiffReport:
+    baseline_runs, candidate_runs = RunSet(), RunSet()
+    for trace in baseline:
+        baseline_runs.add_trace(trace)
+    for trace in candidate:
+        candidate_runs.add_trace(trace)
+    return diff_run_sets(baseline_runs, candidate_runs)
+
+
+def diff_trace_files(
+    baseline: typing.Iterable[str | os.PathLike], candidate: typing.Iterable[str | os.PathLike]
+) -> TraceDiffReport:
+    """Diff two sets of trace files (loading one file at a time)."""
+    baseline_runs, candidate_runs = RunSet(), RunSet()
+    for filename in baseline:
+        baseline_runs.add_file(filename)
+    for filename in candidate:
+        candidate_runs.add_file(filename)
+    return diff_run_sets(baseline_runs, candidate_runs)
+
+
+def build_diff_trace(report: TraceDiffReport) -> Trace:
+    """
+    Build a trace of the union of all call paths with the diff in the node properties.
+
+    The nodes span the mean candidate duration (or the baseline one for missing paths) and are laid out one after the
+    other within their parent, so the trace can be rendered by the SVG writer or the viewer. Children that do not fit
+    into their parent (the means of different paths need not add up) are cut off at its end.
+    """
+    diffs_by_path = {path_diff.path: path_diff for path_diff in report.paths}
+    diffs = [diffs_by_path[path] for path in report.path_order]
+    nodes: dict[CallPath, TraceNode] = {}
+    roots: list[TraceNode] = []
+    next_start_ms: dict[CallPath, int] = collections.defaultdict(int)
+    for event_id, path_diff in enumerate(diffs, start=1):
+        stats = path_diff.candidate or path_diff.baseline
+        assert stats is not None
+        kind, name, ordinal = path_diff.path[-1]
+        parent_path = path_diff.path[:-1]
+        parent = nodes.get(parent_path)
+        start_time_ms = next_start_ms[parent_path]
+        if parent is not None:
+            start_time_ms = min(max(start_time_ms, parent.start_time_ms), parent.end_time_ms)
+        end_time_ms = start_time_ms + round(stats.mean)
+        if parent is not None:
+            end_time_ms = min(end_time_ms, parent.end_time_ms)
+        node = TraceNode(
+            kind=TraceNodeKind(kind),
+            name=name if ordinal == 0 else f"{name} #{ordinal}",
+            event_id=event_id,
+            start_time_ms=start_time_ms,
+            end_time_ms=end_time_ms,
+            delta_frame_infos=[],
+            properties=dict(
+                status=path_diff.status,
+                delta_ms=path_diff.delta_ms,
+                relative_delta=path_diff.relative_delta,
+                t_statistic=path_diff.t_statistic,
+                baseline=_stats_to_dict(path_diff.baseline),
+                candidate=_stats_to_dict(path_diff.candidate),
+            ),
+            children=[],
+        )
+        next_start_ms[parent_path] = node.end_time_ms
+        nodes[path_diff.path] = node
+        (parent.children if parent is not None else roots).append(node)
+    return Trace(
+        name="diff",
+        traces=roots,
+        properties=dict(num_baseline_runs=report.num_baseline_runs, num_candidate_runs=report.num_candidate_runs),
+        unique_objects={},
+    )
+
+
+def _get_delta_color(path_diff_properties: dict) -> str:
+    status = path_diff_properties["status"]
+    if status == DiffStatus.NEW:
+        return "#859900"
+    elif status == DiffStatus.MISSING:
+        return "#93a1a1"
+    relative_delta = path_diff_properties["relative_delta"] or 0.0
+    # Red for slower, blue for faster; saturated at +-50%.
+    intensity = min(abs(relative_delta) / 0.5, 1.0)
+    channel = round(255 * (1 - intensity))
+    return f"#ff{channel:02x}{channel:02x}" if relative_delta > 0 else f"#{channel:02x}{channel:02x}ff"
+
+
+def convert_diff_to_flame_graph_data(report: TraceDiffReport) -> dict:
+    """
+    Flame graph data (in the format of the viewer's `FlameGraphNode`) for the diff, colored by the relative delta.
+    """
+
+    def convert_node(node: TraceNode) -> dict:
+        properties = node.properties
+        delta_ms = typing.cast(float, properties["delta_ms"])
+        relative_delta = properties["relative_delta"]
+        tooltip = f"{node.name} ({properties['status']}): {delta_ms:+.0f} ms"
+        if relative_delta is not None:
+            tooltip += f" ({relative_delta:+.0%})"
+        return dict(
+            id=str(node.event_id),
+            name=node.name or "/Unnamed/",
+            value=node.end_time_ms - node.start_time_ms,
+            backgroundColor=_get_delta_color(properties),
+            tooltip=tooltip,
+            children=[],
+        )
+
+    diff_trace = build_diff_trace(report)
+    root_children: list[dict] = []
+
+    def visit(node: TraceNode, siblings: list[dict]) -> list[dict]:
+        converted_node = convert_node(node)
+        siblings.append(converted_node)
+        return converted_node["children"]
+
+    visit_top_down(diff_trace.traces, operator.attrgetter("children"), visit, root_children)
+    return dict(
+        name="diff", value=sum(child["value"] for child in root_children), children=root_children, tooltip="diff"
+    )
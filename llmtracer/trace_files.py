@@ -0,0 +1,173 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Reading and writing (optionally compressed) trace files.
+
+The compression is chosen by file extension when writing (`.gz`/`.svgz` for gzip, `.zst`/`.zstd` for zstd) and by
+magic bytes when reading. zstd support requires the optional `zstandard` package.
+"""
+import enum
+import gzip
+import io
+import os
+import typing
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+_WRITE_BUFFER_SIZE = 1 << 20
+_GZIP_COMPRESS_LEVEL = 6
+_ZSTD_COMPRESS_LEVEL = 3
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Compression(str, enum.Enum):
+    NONE = "none"
+    GZIP = "gzip"
+    ZSTD = "zstd"
+
+
+_compression_by_extension = {
+    ".gz": Compression.GZIP,
+    ".gzip": Compression.GZIP,
+    ".svgz": Compression.GZIP,
+    ".zst": Compression.ZSTD,
+    ".zstd": Compression.ZSTD,
+}
+
+
+def get_compression(filename: str | os.PathLike) -> Compression:
+    """
+    Determine the compression from the file extension.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return _compression_by_extension.get(extension, Compression.NONE)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd-compressed traces require the zstandard package (pip install zstandard)!")
+    return zstandard
+
+
+def open_trace_file_for_writing(filename: str | os.PathLike, compression: Compression | None = None) -> typing.BinaryIO:
+    """
+    Open a binary file for writing that compresses its content.
+
+    Args:
+        filename: The file to write.
+        compression: The compression to use. Defaults to the compression implied by the file extension.
+    """
+    if compression is None:
+        compression = get_compression(filename)
+
+    if compression == Compression.NONE:
+        return open(filename, "wb")
+    elif compression == Compression.GZIP:
+        # Our writers emit many small chunks, so we buffer them before they hit the compressor.
+        return io.BufferedWriter(
+            gzip.open(filename, "wb", compresslevel=_GZIP_COMPRESS_LEVEL), buffer_size=_WRITE_BUFFER_SIZE
+        )  # type: ignore
+    elif compression == Compression.ZSTD:
+        compressor = _require_zstandard().ZstdCompressor(level=_ZSTD_COMPRESS_LEVEL)
+        return compressor.stream_writer(open(filename, "wb"), write_size=_WRITE_BUFFER_SIZE)
+    else:
+        raise ValueError(f"Unknown compression {compression}!")
+
+
+def detect_compression(magic: bytes) -> Compression:
+    """
+    Detect the compression from the first bytes of a file.
+    """
+    if magic.startswith(_GZIP_MAGIC):
+        return Compression.GZIP
+    elif magic.startswith(_ZSTD_MAGIC):
+        return Compression.ZSTD
+    return Compression.NONE
+
+
+def _read_at_most(stream: typing.BinaryIO, size: int) -> bytes:
+    """Read `size` bytes (or fewer at the end of the stream), even if `read` returns less at once."""
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class _PrefixedStream(io.RawIOBase):
+    """A raw stream that returns `prefix` and then the rest of any readable binary stream (which it does not close)."""
+
+    def __init__(self, prefix: bytes, stream: typing.BinaryIO):
+        self.prefix = prefix
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.prefix:
+            data, self.prefix = self.prefix[: len(buffer)], self.prefix[len(buffer) :]
+        else:
+            data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def wrap_decompressing_stream(stream: typing.BinaryIO) -> typing.BinaryIO:
+    """
+    Wrap a binary stream, so that gzip- or zstd-compressed content is decompressed while it is read.
+
+    The compression is detected from the magic bytes at the start of the stream. A seekable stream is rewound after
+    reading them and returned as it is if it is not compressed. Any other stream is wrapped in a buffered reader
+    that returns the magic bytes again before the rest of the stream (also if it is not compressed). Closing a
+    returned wrapper does not close the given stream.
+    """
+    if stream.seekable():
+        position = stream.tell()
+        magic = _read_at_most(stream, len(_ZSTD_MAGIC))
+        stream.seek(position)
+    else:
+        # We cannot seek back, so we put the magic bytes in front of the rest of the stream again.
+        magic = _read_at_most(stream, len(_ZSTD_MAGIC))
+        stream = io.BufferedReader(_PrefixedStream(magic, stream))  # type: ignore
+
+    compression = detect_compression(magic)
+    if compression == Compression.GZIP:
+        return gzip.GzipFile(fileobj=stream, mode="rb")  # type: ignore
+    elif compression == Compression.ZSTD:
+        return _require_zstandard().ZstdDecompressor().stream_reader(stream, closefd=False)
+    return stream
+
+
+def open_trace_file_for_reading(filename: str | os.PathLike) -> typing.BinaryIO:
+    """
+    Open a (possibly compressed) trace file for reading. The content is decompressed while it is read.
+    """
+    with open(filename, "rb") as f:
+        compression = detect_compression(f.read(len(_ZSTD_MAGIC)))
+
+    if compression == Compression.GZIP:
+        return gzip.open(filename, "rb")  # type: ignore
+    elif compression == Compression.ZSTD:
+        return _require_zstandard().ZstdDecompressor().stream_reader(open(filename, "rb"))
+    return open(filename, "rb")
@@ -0,0 +1,245 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Random-access index sidecars for JSON trace files.
+
+When a trace is written, the serializer can record the byte extent of every node. The index is saved next to the trace
+(`trace.json` -> `trace.json.idx`), and `TraceFileReader` uses it to load single nodes (or subtrees up to a given
+depth) by event id without parsing the whole file.
+
+Only uncompressed trace files can be indexed, as compressed streams cannot be read from an offset.
+"""
+import array
+import bisect
+import json
+import os
+import sys
+import typing
+from dataclasses import dataclass, field
+
+from llmtracer.frame_info import FrameInfo
+from llmtracer.trace_schema import TraceNode, resolve_delta_frame_ids, validate_frame_info_table
+from llmtracer.utils.tree_traversal import visit_top_down
+
+INDEX_MAGIC = b"LLMTIDX1"
+INDEX_VERSION = 1
+
+_COLUMNS = ["event_id", "parent", "subtree_end", "start_offset", "fields_end_offset", "end_offset"]
+
+
+def get_index_filename(trace_filename: str | os.PathLike) -> str:
+    return os.fspath(trace_filename) + ".idx"
+
+
+@dataclass
+class TraceIndex:
+    """
+    Byte extents of the nodes of a JSON trace file, in pre-order.
+
+    For node `i`:
+        `event_id[i]` is its event id,
+        `parent[i]` the index of its parent (-1 for roots),
+        `subtree_end[i]` the index after its last descendant,
+        `start_offset[i]`:`end_offset[i]` the bytes of the node's JSON object (including its children), and
+        `start_offset[i]`:`fields_end_offset[i]` the bytes of its fields up to (excluding) `,"children":[...]}`.
+
+    `frame_infos_start_offset`:`frame_infos_end_offset` are the bytes of the trace's frame info table (-1 if the trace
+    has none), which the nodes' `delta_frame_ids` refer to.
+    """
+
+    event_id: array.array = field(default_factory=lambda: array.array("q"))
+    parent: array.array = field(default_factory=lambda: array.array("q"))
+    subtree_end: array.array = field(default_factory=lambda: array.array("q"))
+    start_offset: array.array = field(default_factory=lambda: array.array("q"))
+    fields_end_offset: array.array = field(default_factory=lambda: array.array("q"))
+    end_offset: array.array = field(default_factory=lambda: array.array("q"))
+    # The size and modification time of the indexed trace file (to detect stale sidecars). The modification time is
+    # unknown (None) for indexes that are not saved next to a file.
+    file_size: int = 0
+    file_mtime_ns: int | None = None
+    frame_infos_start_offset: int = -1
+    frame_infos_end_offset: int = -1
+
+    _event_ids_sorted: bool | None = field(default=None, init=False, repr=False, compare=False)
+    _event_id_map: dict[int, int] | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __len__(self):
+        return len(self.event_id)
+
+    def find(self, event_id: int) -> int | None:
+        """Return the index of the node with the given event id (or None)."""
+        event_ids = self.event_id
+        if self._event_ids_sorted is None:
+            # Event ids are assigned in pre-order by the trace builder, so we can usually bisect.
+            self._event_ids_sorted = all(a < b for a, b in zip(event_ids, event_ids[1:]))
+        if self._event_ids_sorted:
+            i = bisect.bisect_left(event_ids, event_id)
+            return i if i < len(event_ids) and event_ids[i] == event_id else None
+
+        if self._event_id_map is None:
+            self._event_id_map = {event_id: i for i, event_id in enumerate(event_ids)}
+        return self._event_id_map.get(event_id)
+
+    def get_children(self, index: int) -> list[int]:
+        """Return the indices of the children of a node (or of the roots for index -1)."""
+        children = []
+        child = index + 1
+        end = self.subtree_end[index] if index >= 0 else len(self)
+        while child < end:
+            children.append(child)
+            child = self.subtree_end[child]
+        return children
+
+    def save(self, filename: str | os.PathLike):
+        header = json.dumps(
+            {
+                "version": INDEX_VERSION,
+                "num_nodes": len(self),
+                "file_size": self.file_size,
+                "file_mtime_ns": self.file_mtime_ns,
+                "frame_infos_start_offset": self.frame_infos_start_offset,
+                "frame_infos_end_offset": self.frame_infos_end_offset,
+            }
+        ).encode()
+        with open(filename, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(len(header).to_bytes(8, "little"))
+            f.write(header)
+            for column in _COLUMNS:
+                values: array.array = getattr(self, column)
+                if sys.byteorder == "big":
+                    values = array.array("q", values)
+                    values.byteswap()
+                values.tofile(f)
+
+    @classmethod
+    def load(cls, filename: str | os.PathLike) -> 'TraceIndex':
+        with open(filename, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{filename} is not a trace index file!")
+            header = json.loads(f.read(int.from_bytes(f.read(8), "little")))
+            if header["version"] != INDEX_VERSION:
+                raise ValueError(f"Unsupported trace index version {header['version']}!")
+
+            index = cls(
+                file_size=header["file_size"],
+                file_mtime_ns=header.get("file_mtime_ns"),
+                frame_infos_start_offset=header.get("frame_infos_start_offset", -1),
+                frame_infos_end_offset=header.get("frame_infos_end_offset", -1),
+            )
+            for column in _COLUMNS:
+                values: array.array = getattr(index, column)
+                values.fromfile(f, header["num_nodes"])
+                if sys.byteorder == "big":
+                    values.byteswap()
+        return index
+
+
+class TraceFileReader:
+    """
+    Random access to the nodes of an uncompressed JSON trace file using its index sidecar.
+    """
+
+    filename: str
+    index: TraceIndex
+
+    def __init__(self, filename: str | os.PathLike, index: TraceIndex | None = None):
+        self.filename = os.fspath(filename)
+        self.index = index if index is not None else TraceIndex.load(get_index_filename(filename))
+        stat = os.stat(self.filename)
+        if stat.st_size != self.index.file_size or self.index.file_mtime_ns not in (None, stat.st_mtime_ns):
+            raise ValueError(f"The index of {self.filename} is stale!")
+        self._file = open(self.filename, "rb")
+        self._frame_infos: list[FrameInfo] | None = None
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read(self, start: int, end: int) -> bytes:
+        self._file.seek(start)
+        return self._file.read(end - start)
+
+    def _get_frame_infos(self) -> list[FrameInfo]:
+        """The frame info table of the trace (loaded on first use)."""
+        if self._frame_infos is None:
+            self._frame_infos = validate_frame_info_table(
+                json.loads(self._read(self.index.frame_infos_start_offset, self.index.frame_infos_end_offset))
+            )
+        return self._frame_infos
+
+    def _load_node_dict(self, index: int, depth: int) -> dict[str, typing.Any]:
+        node_index = self.index
+
+        def get_children(item: tuple[int, int]) -> list[tuple[int, int]]:
+            node, node_depth = item
+            if node_depth == 0:
+                return []
+            return [(child, node_depth - 1) for child in node_index.get_children(node)]
+
+        def visit(item: tuple[int, int], siblings: list[dict[str, typing.Any]]) -> list[dict[str, typing.Any]]:
+            node = item[0]
+            node_dict = json.loads(self._read(node_index.start_offset[node], node_index.fields_end_offset[node]) + b'}')
+            node_dict["children"] = []
+            siblings.append(node_dict)
+            return node_dict["children"]
+
+        roots: list[dict[str, typing.Any]] = []
+        visit_top_down([(index, depth)], get_children, visit, roots)
+        return roots[0]
+
+    def load_node(self, event_id: int, depth: int | None = None) -> TraceNode:
+        """
+        Load a node by event id.
+
+        Args:
+            event_id: The event id of the node.
+            depth: How many levels of descendants to load (None for the whole subtree, 0 for no children). Nodes at
+                the depth limit are returned with an empty list of children.
+        """
+        index = self.index.find(event_id)
+        if index is None:
+            raise KeyError(event_id)
+
+        if depth is None:
+            data = self._read(self.index.start_offset[index], self.index.end_offset[index])
+            if self.index.frame_infos_start_offset < 0:
+                return TraceNode.model_validate_json(data)
+            node_dict = json.loads(data)
+        else:
+            node_dict = self._load_node_dict(index, depth)
+        if self.index.frame_infos_start_offset >= 0:
+            resolve_delta_frame_ids([node_dict], self._get_frame_infos())
+        return TraceNode.model_validate(node_dict)
+
+    def get_parent_event_id(self, event_id: int) -> int | None:
+        index = self.index.find(event_id)
+        if index is None:
+            raise KeyError(event_id)
+        parent = self.index.parent[index]
+        return self.index.event_id[parent] if parent >= 0 else None
+
+    def get_child_event_ids(self, event_id: int | None) -> list[int]:
+        """Return the event ids of the children of a node (or of the roots for None)."""
+        index = self.index.find(event_id) if event_id is not None else -1
+        if index is None:
+            raise KeyError(event_id)
+        return [self.index.event_id[child] for child in self.index.get_children(index)]
@@ -0,0 +1,321 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Streaming trace loader.
+
+`Trace.load_file` needs the whole document in memory and then validates it into a pydantic tree, which takes several
+times the size of the file at its peak (and fails for very deep traces). The loader here reads the file in chunks and
+builds `TraceNode`s while it goes: the trace and node structure is parsed incrementally (iteratively, so there is no
+depth limit) and only leaf values (properties, frame infos, ...) are decoded at once, using the C JSON scanner.
+
+Nodes are created without validation (`model_construct`), so this is meant for trusted trace files.
+
+Frame infos and large property values can be skipped while loading to save memory.
+
+Deduplicated traces (see `llmtracer.trace_dedup`) are detected and expanded.
+"""
+import codecs
+import json
+import operator
+import os
+import re
+import typing
+
+from llmtracer.frame_info import FrameInfo
+from llmtracer.trace_dedup import DEDUP_FORMAT, expand_dedup_trace
+from llmtracer.trace_files import open_trace_file_for_reading, wrap_decompressing_stream
+from llmtracer.trace_schema import Trace, TraceNode, TraceNodeKind
+from llmtracer.trace_serializer import json_dumps
+from llmtracer.utils.gc_pause import paused_gc
+from llmtracer.utils.tree_traversal import iter_preorder
+
+_CHUNK_SIZE = 1 << 20
+_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+# Fast paths for the (first and following) keys of an object.
+_KEY_PATTERN = re.compile(r'[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+_NEXT_KEY_PATTERN = re.compile(r'[ \t\n\r]*,[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+# A number that is followed by one of these was cut off at the end of the buffer (e.g. `1.` or `1e`).
+_NUMBER_CONTINUATION_CHARS = frozenset("0123456789.eE+-")
+
+
+class _JsonScanner:
+    """Incremental JSON tokenizer over a binary stream for the structural parts of a trace."""
+
+    def __init__(self, stream: typing.BinaryIO, chunk_size: int = _CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        # The (undocumented) scanner of the standard library's decoder parses a single JSON value at a position.
+        self._scan_once = json.JSONDecoder().scan_once  # type: ignore
+
+    def _read_more(self, min_size: int = 0) -> bool:
+        """Append at least one chunk (or `min_size` characters) to the buffer. Returns False at the end of the file."""
+        if self.eof:
+            return False
+        # Drop the consumed part of the buffer.
+        self.buffer = self.buffer[self.pos :]
+        self.pos = 0
+
+        data = self.stream.read(max(self.chunk_size, min_size))
+        if not data:
+            self.eof = True
+            self.buffer += self.decoder.decode(b"", final=True)
+            return False
+        self.buffer += self.decoder.decode(data)
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character (or '' at the end of the file)."""
+        while True:
+            buffer = self.buffer
+            # The pattern also matches no whitespace, so there always is a match.
+            pos = self.pos = _WHITESPACE_PATTERN.match(buffer, self.pos).end()  # type: ignore
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self._read_more():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expected {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def read_value(self) -> tuple[typing.Any, int]:
+        """Decode the next JSON value. Returns the value and the length of its JSON text."""
+        start = self.pos
+        try:
+            value, end = self._scan_once(self.buffer, start)
+            # A number at the end of the buffer might continue in the next chunk.
+            if end < len(self.buffer) and self.buffer[end] not in _NUMBER_CONTINUATION_CHARS:
+                self.pos = end
+                return value, end - start
+        except (StopIteration, json.JSONDecodeError):
+            pass
+
+        # Slow path: skip whitespace and read more until the value is complete.
+        self.peek()
+        while True:
+            start = self.pos
+            try:
+                value, end = self._scan_once(self.buffer, start)
+            except (StopIteration, json.JSONDecodeError) as e:
+                # The value might just be incomplete. Read as much again as we already have, so this stays linear.
+                if self._read_more(len(self.buffer)):
+                    continue
+                if isinstance(e, StopIteration):
+                    raise json.JSONDecodeError("Expecting value", self.buffer, start) from None
+                raise
+            if (end == len(self.buffer) or self.buffer[end] in _NUMBER_CONTINUATION_CHARS) and self._read_more():
+                continue
+            self.pos = end
+            return value, end - start
+
+    def read_key(self, after_value: bool) -> str | None:
+        """
+        Read the next key of an object (including the separating comma after a value).
+
+        Returns None at the end of the object (after consuming the closing brace).
+        """
+        match = (_NEXT_KEY_PATTERN if after_value else _KEY_PATTERN).match(self.buffer, self.pos)
+        if match is not None and match.end() < len(self.buffer):
+            self.pos = match.end()
+            return match.group(1)
+
+        char = self.peek()
+        if char == "}":
+            self.pos += 1
+            return None
+        if after_value:
+            self.expect(",")
+        key, _ = self.read_value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expected a key", self.buffer, self.pos)
+        self.expect(":")
+        return key
+
+
+def skipped_property_placeholder(size: int) -> str:
+    """The value that replaces properties that are too large to load."""
+    return f"<skipped {size} bytes>"
+
+
+class _TraceLoader:
+    def __init__(self, scanner: _JsonScanner, include_frame_infos: bool, max_property_size: int | None):
+        self.scanner = scanner
+        self.include_frame_infos = include_frame_infos
+        self.max_property_size = max_property_size
+
+    def read_properties(self) -> dict[str, object]:
+        scanner = self.scanner
+        if self.max_property_size is None:
+            properties, _ = scanner.read_value()
+            return properties
+
+        properties = {}
+        scanner.expect("{")
+        key = scanner.read_key(after_value=False)
+        while key is not None:
+            value, size = scanner.read_value()
+            properties[key] = value if size <= self.max_property_size else skipped_property_placeholder(size)
+            del value
+            key = scanner.read_key(after_value=True)
+        return properties
+
+    def read_node_fields(self, fields: dict[str, typing.Any], after_value: bool) -> bool:
+        """
+        Read the fields of a node until its end (returns False) or until its children start (returns True).
+
+        The scanner must be positioned after the opening brace or after a complete value (`after_value`).
+        """
+        scanner = self.scanner
+        while True:
+            key = scanner.read_key(after_value)
+            after_value = True
+            if key is None:
+                return False
+            elif key == "children":
+                scanner.expect("[")
+                return True
+            elif key == "properties":
+                fields[key] = self.read_properties()
+            elif key == "delta_frame_infos":
+                frame_infos, _ = scanner.read_value()
+                fields[key] = (
+                    [FrameInfo.model_construct(**frame_info) for frame_info in frame_infos]
+                    if self.include_frame_infos
+                    else []
+                )
+            elif key == "delta_frame_ids":
+                # The frame info table follows the nodes, so the ids are resolved by `resolve_frame_ids` later.
+                frame_ids, _ = scanner.read_value()
+                fields["delta_frame_infos"] = frame_ids if self.include_frame_infos else []
+            else:
+                fields[key], _ = scanner.read_value()
+
+    @staticmethod
+    def make_node(fields: dict[str, typing.Any]) -> TraceNode:
+        fields["kind"] = TraceNodeKind(fields["kind"])
+        fields.setdefault("children", [])
+        return TraceNode.model_construct(**fields)
+
+    def read_nodes(self) -> list[TraceNode]:
+        """Read a list of nodes (with all their descendants) iteratively."""
+        scanner = self.scanner
+        scanner.expect("[")
+        # The innermost open list of nodes is last. open_nodes[i] owns node_lists[i + 1].
+        node_lists: list[list[TraceNode]] = [[]]
+        open_nodes: list[dict[str, typing.Any]] = []
+        while True:
+            char = scanner.peek()
+            if char == ",":
+                scanner.pos += 1
+            elif char == "]":
+                scanner.pos += 1
+                children = node_lists.pop()
+                if not open_nodes:
+                    return children
+                fields = open_nodes[-1]
+                fields["children"] = children
+                if self.read_node_fields(fields, after_value=True):
+                    # A (duplicate) children key: the last one wins, like with json.loads.
+                    node_lists.append([])
+                else:
+                    open_nodes.pop()
+                    node_lists[-1].append(self.make_node(fields))
+            else:
+                scanner.expect("{")
+                fields = {}
+                if self.read_node_fields(fields, after_value=False):
+                    open_nodes.append(fields)
+                    node_lists.append([])
+                else:
+                    node_lists[-1].append(self.make_node(fields))
+
+    def read_trace(self) -> Trace:
+        scanner = self.scanner
+        fields: dict[str, typing.Any] = {}
+        scanner.expect("{")
+        key = scanner.read_key(after_value=False)
+        while key is not None:
+            if key == "traces":
+                fields[key] = self.read_nodes()
+            else:
+                fields[key], _ = scanner.read_value()
+            key = scanner.read_key(after_value=True)
+        if scanner.peek():
+            raise json.JSONDecodeError("Extra data", scanner.buffer, scanner.pos)
+        if fields.get("format") == DEDUP_FORMAT:
+            return expand_dedup_trace(fields, self.include_frame_infos, self.skip_large_properties)
+        frame_info_dicts = fields.pop("frame_infos", None)
+        if frame_info_dicts is not None and self.include_frame_infos:
+            self.resolve_frame_ids(fields.get("traces", []), frame_info_dicts)
+        return Trace.model_construct(**fields)
+
+    @staticmethod
+    def resolve_frame_ids(nodes: list[TraceNode], frame_info_dicts: list[dict[str, typing.Any]]):
+        """Replace the frame ids of the nodes by the (shared) frame infos of the table."""
+        frame_infos = [FrameInfo.model_construct(**frame_info) for frame_info in frame_info_dicts]
+        for node in iter_preorder(nodes, operator.attrgetter("children")):
+            frame_ids = node.delta_frame_infos
+            if frame_ids and not isinstance(frame_ids[0], FrameInfo):
+                node.delta_frame_infos = [frame_infos[frame_id] for frame_id in frame_ids]
+
+    def skip_large_properties(self, properties: dict[str, object]) -> dict[str, object]:
+        if self.max_property_size is None:
+            return properties
+        sizes = {key: len(json_dumps(value).decode("utf-8")) for key, value in properties.items()}
+        return {
+            key: value if sizes[key] <= self.max_property_size else skipped_property_placeholder(sizes[key])
+            for key, value in properties.items()
+        }
+
+
+def _load_trace(
+    stream: typing.BinaryIO, include_frame_infos: bool, max_property_size: int | None, chunk_size: int = _CHUNK_SIZE
+) -> Trace:
+    scanner = _JsonScanner(stream, chunk_size)
+    with paused_gc():
+        return _TraceLoader(scanner, include_frame_infos, max_property_size).read_trace()
+
+
+def load_trace_stream(
+    stream: typing.BinaryIO, *, include_frame_infos: bool = True, max_property_size: int | None = None
+) -> Trace:
+    """
+    Load a JSON trace incrementally from a binary stream.
+
+    gzip- and zstd-compressed content is decompressed while it is read.
+
+    Args:
+        stream: The binary stream to read from.
+        include_frame_infos: Whether to load the `delta_frame_infos` of the nodes (otherwise they are empty).
+        max_property_size: If given, node properties whose JSON is larger than this many characters are replaced by
+            a placeholder string (see `skipped_property_placeholder`).
+    """
+    return _load_trace(wrap_decompressing_stream(stream), include_frame_infos, max_property_size)
+
+
+def load_trace_file(
+    filename: str | os.PathLike, *, include_frame_infos: bool = True, max_property_size: int | None = None
+) -> Trace:
+    """
+    Load a JSON trace file incrementally (see `load_trace_stream`).
+    """
+    with open_trace_file_for_reading(filename) as f:
+        return _load_trace(f, include_frame_infos, max_property_size)
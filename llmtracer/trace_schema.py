@@ -15,11 +15,54 @@
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import enum
+import operator
+import os
+import typing
 
-from pydantic import BaseModel
-from wandb.sdk.data_types import trace_tree
+from pydantic import BaseModel, model_validator
 
 from llmtracer.frame_info import FrameInfo
+from llmtracer.trace_files import open_trace_file_for_reading, wrap_decompressing_stream
+from llmtracer.utils.tree_traversal import iter_preorder, transform_bottom_up
+
+# The reserved property that holds a node's marks (see `TraceBuilder.mark`), so they cannot clash with user properties.
+MARKS_PROPERTY = "_marks"
+
+
+def resolve_delta_frame_ids(node_dicts: list[dict[str, typing.Any]], frame_infos: list[FrameInfo]):
+    """
+    Replace the `delta_frame_ids` of (JSON) node dicts in place by the `delta_frame_infos` they refer to.
+    """
+    for node_dict in iter_preorder(node_dicts, lambda node_dict: node_dict.get("children", ())):
+        frame_ids = node_dict.pop("delta_frame_ids", None)
+        if frame_ids is not None:
+            node_dict["delta_frame_infos"] = [frame_infos[frame_id] for frame_id in frame_ids]
+
+
+def copy_with_delta_frame_infos(
+    node_dicts: list[dict[str, typing.Any]], frame_infos: list[FrameInfo]
+) -> list[dict[str, typing.Any]]:
+    """
+    Like `resolve_delta_frame_ids`, but return (shallow) copies of the node dicts and leave the given ones unchanged.
+    """
+
+    def copy_node_dict(node_dict: dict[str, typing.Any], children: list[dict[str, typing.Any]], depth: int):
+        node_dict = dict(node_dict)
+        if "children" in node_dict:
+            node_dict["children"] = children
+        frame_ids = node_dict.pop("delta_frame_ids", None)
+        if frame_ids is not None:
+            node_dict["delta_frame_infos"] = [frame_infos[frame_id] for frame_id in frame_ids]
+        return node_dict
+
+    return [
+        transform_bottom_up(node_dict, lambda node_dict: node_dict.get("children", ()), copy_node_dict)
+        for node_dict in node_dicts
+    ]
+
+
+def validate_frame_info_table(frame_info_dicts: list[dict[str, typing.Any]]) -> list[FrameInfo]:
+    return [FrameInfo.model_validate(frame_info_dict) for frame_info_dict in frame_info_dicts]
 
 
 class TraceNodeKind(str, enum.Enum):
@@ -27,12 +70,13 @@ class TraceNodeKind(str, enum.Enum):
     The type of event.
 
     We match wandb's span kind for convienence and add more.
+    (The values are spelled out, so we do not have to import wandb here.)
     """
 
-    LLM = trace_tree.SpanKind.LLM
-    CHAIN = trace_tree.SpanKind.CHAIN
-    AGENT = trace_tree.SpanKind.AGENT
-    TOOL = trace_tree.SpanKind.TOOL
+    LLM = "LLM"
+    CHAIN = "CHAIN"
+    AGENT = "AGENT"
+    TOOL = "TOOL"
     SCOPE = "SCOPE"
     CALL = "CALL"
     EVENT = "EVENT"
@@ -53,6 +97,10 @@ class TraceNode(BaseModel):
     start_time_ms: int
     end_time_ms: int
     running: bool = False
+    # Time the tracer itself spent within this node (including its descendants), e.g. capturing stack frames,
+    # converting arguments and dispatching handlers (also the node's own exit handlers, so a trace that a handler
+    # writes when a node exits cannot include that write in the node's overhead yet). (0 for running nodes.)
+    tracer_overhead_ms: float = 0.0
 
     delta_frame_infos: list[FrameInfo]
 
@@ -66,36 +114,68 @@ class TraceNode(BaseModel):
         if event_id_map is None:
             event_id_map = {}
 
-        event_id_map[self.event_id] = self
-        for child in self.children:
-            child.collect_event_id_map(event_id_map)
+        for node in iter_preorder([self], operator.attrgetter("children")):
+            event_id_map[node.event_id] = node
         return event_id_map
 
+    def get_marks(self) -> list[tuple[float, str, object]]:
+        """
+        The instant events of the node (see `TraceBuilder.mark`) as (time in ms, name, payload) tuples.
+        """
+        marks = typing.cast(dict[str, list], self.properties.get(MARKS_PROPERTY))
+        if not marks:
+            return []
+        names = marks["names"]
+        payloads = marks.get("payloads") or [None] * len(marks["offset_ms"])
+        return [
+            (self.start_time_ms + offset_ms, names[name_id], payload)
+            for offset_ms, name_id, payload in zip(marks["offset_ms"], marks["name_ids"], payloads)
+        ]
+
     def to_custom_dict(self, include_timing: bool = True, include_lineno: bool = True):
-        custom_dict = {
-            "kind": self.kind.value,
-            "name": self.name,
-            "event_id": self.event_id,
-            "delta_frame_infos": [
-                {
-                    "module": frame_info.module,
-                    "function": frame_info.function,
-                    "code_context": frame_info.code_context,
-                }
-                | ({"lineno": frame_info.lineno} if include_lineno else {})
-                for frame_info in self.delta_frame_infos
-            ],
-            "properties": self.properties,
-            "children": [
-                child.to_custom_dict(include_timing=include_timing, include_lineno=include_lineno)
-                for child in self.children
-            ],
-        }
-        if include_timing:
-            custom_dict["start_time_ms"] = self.start_time_ms
-            custom_dict["end_time_ms"] = self.end_time_ms
+        def convert_node(node: TraceNode, children: list[dict], depth: int):
+            custom_dict = {
+                "kind": node.kind.value,
+                "name": node.name,
+                "event_id": node.event_id,
+                "delta_frame_infos": [
+                    {
+                        "module": frame_info.module,
+                        "function": frame_info.function,
+                        "code_context": frame_info.code_context,
+                    }
+                    | ({"lineno": frame_info.lineno} if include_lineno else {})
+                    for frame_info in node.delta_frame_infos
+                ],
+                "properties": node.properties,
+                "children": children,
+            }
+            if include_timing:
+                custom_dict["start_time_ms"] = node.start_time_ms
+                custom_dict["end_time_ms"] = node.end_time_ms
+                custom_dict["tracer_overhead_ms"] = node.tracer_overhead_ms
 
-        return custom_dict
+            return custom_dict
+
+        return transform_bottom_up(self, operator.attrgetter("children"), convert_node)
+
+
+class TracerOverheadSummary(BaseModel):
+    """
+    How much of a trace's duration was spent in the tracer itself.
+    """
+
+    num_nodes: int
+    duration_ms: int
+    tracer_overhead_ms: float
+
+    @property
+    def overhead_fraction(self) -> float:
+        return self.tracer_overhead_ms / self.duration_ms if self.duration_ms else 0.0
+
+    @property
+    def overhead_per_node_us(self) -> float:
+        return self.tracer_overhead_ms * 1000 / self.num_nodes if self.num_nodes else 0.0
 
 
 class Trace(BaseModel):
@@ -108,6 +188,51 @@ class Trace(BaseModel):
     properties: dict[str, object]
     unique_objects: dict[str, object]
 
+    @model_validator(mode="before")
+    @classmethod
+    def _resolve_frame_info_table(cls, data: typing.Any) -> typing.Any:
+        # JSON traces store each frame info once (in `frame_infos`) and nodes refer to them by `delta_frame_ids`. The
+        # given dicts may be validated again (or used otherwise), so they are not modified.
+        if isinstance(data, dict) and "frame_infos" in data:
+            data = dict(data)
+            frame_infos = validate_frame_info_table(data.pop("frame_infos"))
+            if "traces" in data:
+                data["traces"] = copy_with_delta_frame_infos(data["traces"], frame_infos)
+        return data
+
+    @classmethod
+    def load_file(cls, filename: str | os.PathLike) -> 'Trace':
+        """
+        Load and validate a JSON trace file.
+
+        gzip- and zstd-compressed files are decompressed while they are read, but the (decompressed) document is
+        read into memory as a whole before it is parsed. Use `llmtracer.trace_loader.load_trace_file` to parse large
+        trusted traces incrementally.
+
+        Deduplicated traces (see `llmtracer.trace_dedup`) are expanded.
+        """
+        with open_trace_file_for_reading(filename) as f:
+            return cls._validate_json(f.read())
+
+    @classmethod
+    def load_stream(cls, stream: typing.BinaryIO) -> 'Trace':
+        """
+        Load and validate a JSON trace from a binary stream.
+
+        Like `load_file`, this decompresses gzip- and zstd-compressed content while it is read, but reads the
+        (decompressed) document into memory as a whole. Use `llmtracer.trace_loader.load_trace_stream` to parse it
+        incrementally.
+        """
+        return cls._validate_json(wrap_decompressing_stream(stream).read())
+
+    @classmethod
+    def _validate_json(cls, data: bytes) -> 'Trace':
+        from llmtracer import trace_dedup
+
+        if trace_dedup.is_dedup_trace(data):
+            return trace_dedup.load_dedup_json(data)
+        return cls.model_validate_json(data)
+
     def build_event_id_map(self) -> dict[int, TraceNode]:
         """
         Build a map from event id to node.
@@ -117,6 +242,25 @@ class Trace(BaseModel):
             trace.collect_event_id_map(event_id_map)
         return event_id_map
 
+    def get_tracer_overhead_summary(self) -> TracerOverheadSummary:
+        """
+        Summarize the tracer's own overhead over the whole trace.
+
+        The overhead of a node includes the overhead within its descendants, so the top-level nodes add up to the
+        total.
+        """
+        if self.traces:
+            duration_ms = max(node.end_time_ms for node in self.traces) - min(
+                node.start_time_ms for node in self.traces
+            )
+        else:
+            duration_ms = 0
+        return TracerOverheadSummary(
+            num_nodes=sum(1 for _ in iter_preorder(self.traces, operator.attrgetter("children"))),
+            duration_ms=duration_ms,
+            tracer_overhead_ms=sum(node.tracer_overhead_ms for node in self.traces),
+        )
+
     def to_custom_dict(self, include_timing: bool = True, include_lineno: bool = True):
         """
         Convert the trace to a jsonable format.
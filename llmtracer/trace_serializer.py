@@ -0,0 +1,339 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Fast serialization of traces to compact UTF-8 JSON bytes.
+
+This writes `TraceNodeBuilder` trees (and built `TraceNode` trees) directly, without going through the pydantic
+models first. The output can be loaded with `Trace.load_file` or `llmtracer.trace_loader.load_trace_file`.
+
+Traces store each distinct frame info once (in `frame_infos`, after the nodes), and the nodes refer to them by index
+(`delta_frame_ids`). Single nodes (`dumps_node_without_children`) keep their `delta_frame_infos` inline.
+
+If `orjson` is installed, it is used as the JSON backend (also for `json_loads`).
+"""
+import io
+import json
+import operator
+import typing
+
+import pydantic
+
+from llmtracer.frame_info import FrameInfoTable, frame_info_to_jsonable
+from llmtracer.trace_builder import DeferredProperty, TraceBuilder, TraceNodeBuilder, default_timer
+from llmtracer.trace_schema import Trace, TraceNode
+from llmtracer.utils.tree_traversal import TreeEvent, iter_enter_exit
+
+if typing.TYPE_CHECKING:
+    from llmtracer.trace_index import TraceIndex
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+
+def _default(obj: object):
+    """Convert values that the JSON backends do not support natively."""
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    elif isinstance(obj, pydantic.BaseModel):
+        return obj.model_dump(mode='json')
+    elif isinstance(obj, DeferredProperty):
+        return obj.to_jsonable()
+    raise TypeError(f"Object of type {type(obj).__qualname__} is not JSON serializable")
+
+
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=_default)
+_ascii_json_encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+
+def _stdlib_json_dumps(obj: object) -> bytes:
+    try:
+        return _json_encoder.encode(obj).encode('utf-8')
+    except UnicodeEncodeError:
+        # Strings with lone surrogates cannot be encoded as UTF-8, but they can be escaped in JSON.
+        return _ascii_json_encoder.encode(obj).encode('ascii')
+
+
+if orjson is not None:
+
+    def json_dumps(obj: object) -> bytes:
+        """Serialize an object to compact UTF-8 JSON bytes."""
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            # orjson rejects some values that the standard library supports (integers beyond 64 bits and strings
+            # with lone surrogates).
+            return _stdlib_json_dumps(obj)
+
+    json_loads = orjson.loads
+
+else:
+    json_dumps = _stdlib_json_dumps
+
+    _json_decoder = json.JSONDecoder()
+
+    def json_loads(data: bytes | str) -> typing.Any:
+        """Deserialize JSON from UTF-8 bytes or a string."""
+        return _json_decoder.decode(data.decode('utf-8') if isinstance(data, bytes) else data)
+
+
+def _get_node_fields(
+    node: TraceNodeBuilder | TraceNode, now_ms: int, frame_info_table: FrameInfoTable | None = None
+) -> dict:
+    """
+    Return the fields of a node (without its children) as a jsonable dict.
+
+    With a `frame_info_table`, the frame infos are stored as `delta_frame_ids` referring to the table.
+    """
+    end_time_ms = node.end_time_ms
+    if isinstance(node, TraceNode):
+        running = node.running
+    else:
+        running = end_time_ms is None
+        if running:
+            end_time_ms = now_ms
+
+    fields = {
+        "kind": node.kind.value,
+        "name": node.name,
+        "event_id": node.event_id,
+        "start_time_ms": node.start_time_ms,
+        "end_time_ms": end_time_ms,
+        "running": running,
+        "tracer_overhead_ms": node.tracer_overhead_ms,
+    }
+    if frame_info_table is not None:
+        fields["delta_frame_ids"] = [frame_info_table.get_id(frame_info) for frame_info in node.delta_frame_infos]
+    else:
+        fields["delta_frame_infos"] = [frame_info_to_jsonable(frame_info) for frame_info in node.delta_frame_infos]
+    fields["properties"] = node.get_properties() if isinstance(node, TraceNodeBuilder) else node.properties
+    return fields
+
+
+def dumps_node_without_children(node: TraceNodeBuilder | TraceNode, now_ms: int | None = None) -> bytes:
+    """
+    Serialize a single node (with an empty list of children).
+
+    Args:
+        node: The node to serialize.
+        now_ms: The end time to use for running nodes (defaults to the current time).
+    """
+    if now_ms is None:
+        now_ms = default_timer()
+    return json_dumps(_get_node_fields(node, now_ms) | {"children": []})
+
+
+class _IndexingWriter:
+    """Counts the written bytes and records the extents of the nodes in a `TraceIndex`."""
+
+    def __init__(self, write: typing.Callable[[bytes], typing.Any], index: 'TraceIndex'):
+        self._write = write
+        self.index = index
+        self.offset = 0
+        self.stack: list[int] = []
+
+    def write(self, data: bytes):
+        self.offset += len(data)
+        self._write(data)
+
+    def enter(self, event_id: int):
+        index = self.index
+        index.event_id.append(event_id)
+        index.parent.append(self.stack[-1] if self.stack else -1)
+        index.subtree_end.append(-1)
+        index.start_offset.append(self.offset)
+        index.fields_end_offset.append(-1)
+        index.end_offset.append(-1)
+        self.stack.append(len(index.event_id) - 1)
+
+    def end_fields(self):
+        self.index.fields_end_offset[self.stack[-1]] = self.offset
+
+    def exit(self):
+        node = self.stack.pop()
+        self.index.end_offset[node] = self.offset
+        self.index.subtree_end[node] = len(self.index.event_id)
+
+    def set_frame_infos_extent(self, start_offset: int):
+        self.index.frame_infos_start_offset = start_offset
+        self.index.frame_infos_end_offset = self.offset
+
+    def add_subtree(self, subtree_index: 'TraceIndex', start_offset: int):
+        """Append the (relative) index of a subtree that was written (verbatim) at `start_offset`."""
+        index = self.index
+        base = len(index.event_id)
+        parent = self.stack[-1] if self.stack else -1
+        index.event_id.extend(subtree_index.event_id)
+        index.parent.extend(parent if i == -1 else i + base for i in subtree_index.parent)
+        index.subtree_end.extend(i + base for i in subtree_index.subtree_end)
+        index.start_offset.extend(offset + start_offset for offset in subtree_index.start_offset)
+        index.fields_end_offset.extend(offset + start_offset for offset in subtree_index.fields_end_offset)
+        index.end_offset.extend(offset + start_offset for offset in subtree_index.end_offset)
+
+
+def _write_nodes(
+    write: typing.Callable[[bytes], typing.Any],
+    nodes: typing.Iterable[TraceNodeBuilder | TraceNode],
+    now_ms: int,
+    index_writer: _IndexingWriter | None,
+    frame_info_table: FrameInfoTable | None,
+):
+    """
+    Write the nodes (comma-separated), copying spilled subtrees from their spill file.
+
+    Spilled subtrees refer to the frame info table of their trace builder, so that has to be the `frame_info_table`.
+    """
+    for event, node, sibling_index in iter_enter_exit(nodes, operator.attrgetter("children")):
+        spilled = node.spilled if isinstance(node, TraceNodeBuilder) else None
+        if spilled is not None:
+            if event is TreeEvent.ENTER:
+                if sibling_index:
+                    write(b',')
+                if index_writer is not None:
+                    index_writer.add_subtree(spilled.read_index(), index_writer.offset)
+                write(spilled.read_json())
+            continue
+        if event is TreeEvent.ENTER:
+            if sibling_index:
+                write(b',')
+            if index_writer is not None:
+                index_writer.enter(node.event_id)
+            # Serialize the node's own fields in one go and splice the children in before the closing brace.
+            write(json_dumps(_get_node_fields(node, now_ms, frame_info_table))[:-1])
+            if index_writer is not None:
+                index_writer.end_fields()
+            write(b',"children":[')
+        else:
+            write(b']}')
+            if index_writer is not None:
+                index_writer.exit()
+
+
+def write_subtree(
+    write: typing.Callable[[bytes], typing.Any],
+    node: TraceNodeBuilder | TraceNode,
+    index: 'TraceIndex | None' = None,
+    frame_info_table: FrameInfoTable | None = None,
+):
+    """
+    Write a single node (with its children) as JSON object, optionally recording the (relative) node extents in `index`.
+
+    With a `frame_info_table`, the nodes refer to the frame infos in it by `delta_frame_ids`.
+    """
+    index_writer = None
+    if index is not None:
+        index_writer = _IndexingWriter(write, index)
+        write = index_writer.write
+    _write_nodes(write, [node], default_timer(), index_writer, frame_info_table)
+    if index_writer is not None:
+        index_writer.index.file_size = index_writer.offset
+
+
+def _write_trace(
+    write: typing.Callable[[bytes], typing.Any],
+    name: str | None,
+    nodes: typing.Iterable[TraceNodeBuilder | TraceNode],
+    properties: typing.Mapping[str, object],
+    unique_objects: typing.Mapping[str, object],
+    now_ms: int,
+    index: 'TraceIndex | None' = None,
+    frame_info_table: FrameInfoTable | None = None,
+):
+    if frame_info_table is None:
+        frame_info_table = FrameInfoTable()
+    index_writer = None
+    if index is not None:
+        index_writer = _IndexingWriter(write, index)
+        write = index_writer.write
+
+    write(b'{"name":')
+    write(json_dumps(name))
+    write(b',"traces":[')
+    _write_nodes(write, nodes, now_ms, index_writer, frame_info_table)
+    write(b'],"frame_infos":')
+    if index_writer is not None:
+        frame_infos_start_offset = index_writer.offset
+    write(json_dumps(frame_info_table.to_jsonable()))
+    if index_writer is not None:
+        index_writer.set_frame_infos_extent(frame_infos_start_offset)
+    write(b',"properties":')
+    write(json_dumps(properties))
+    write(b',"unique_objects":')
+    write(json_dumps(unique_objects))
+    write(b'}')
+    if index_writer is not None:
+        index_writer.index.file_size = index_writer.offset
+
+
+def write_trace_builder(builder: TraceBuilder, stream: typing.BinaryIO, index: 'TraceIndex | None' = None):
+    """
+    Stream the current state of a trace builder as compact JSON to a binary stream.
+
+    Running nodes are written with the current time as end time (like `TraceBuilder.build`).
+
+    Args:
+        builder: The trace builder.
+        stream: The binary stream to write to.
+        index: If given, the byte extents of the nodes (relative to the start of the output) are appended to it.
+    """
+    root = builder.event_root
+    _write_trace(
+        stream.write,
+        root.name,
+        root.children,
+        root.properties,
+        builder.unique_objects,
+        builder.get_time_ms(),
+        index,
+        builder.frame_info_table,
+    )
+
+
+def dumps_trace_builder(builder: TraceBuilder) -> bytes:
+    """Serialize the current state of a trace builder to compact JSON bytes."""
+    stream = io.BytesIO()
+    write_trace_builder(builder, stream)
+    return stream.getvalue()
+
+
+def write_trace(trace: Trace, stream: typing.BinaryIO, index: 'TraceIndex | None' = None):
+    """Stream a trace as compact JSON to a binary stream (optionally recording the node extents in `index`)."""
+    _write_trace(stream.write, trace.name, trace.traces, trace.properties, trace.unique_objects, default_timer(), index)
+
+
+def write_trace_nodes(
+    stream: typing.BinaryIO,
+    name: str | None,
+    nodes: typing.Iterable[TraceNodeBuilder | TraceNode],
+    properties: dict[str, object],
+    unique_objects: dict[str, object],
+    index: 'TraceIndex | None' = None,
+):
+    """
+    Stream a trace given by its parts as compact JSON to a binary stream.
+
+    `nodes` can be a lazy iterable (e.g. a generator that loads the nodes from other files). `properties` and
+    `unique_objects` are only serialized after all nodes, so they can still be updated while the nodes are produced.
+    """
+    _write_trace(stream.write, name, nodes, properties, unique_objects, default_timer(), index)
+
+
+def dumps_trace(trace: Trace) -> bytes:
+    """Serialize a trace to compact JSON bytes."""
+    stream = io.BytesIO()
+    write_trace(trace, stream)
+    return stream.getvalue()
@@ -0,0 +1,134 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Spilling finished subtrees of a trace builder to disk (see `TraceBuilder.max_resident_nodes`).
+
+A spilled subtree is replaced by a stub `TraceNodeBuilder` (without children and properties) whose `spilled` field
+points into the spill file. The serializer copies the subtree's JSON (and index) verbatim from there, and
+`TraceNodeBuilder.build` loads it back. Spilled nodes refer to the frame infos in the builder's `frame_info_table` by
+`delta_frame_ids`, like the nodes of a serialized trace.
+"""
+import array
+import io
+import operator
+import sys
+import tempfile
+import typing
+from dataclasses import dataclass
+
+from llmtracer.frame_info import FrameInfoTable
+from llmtracer.trace_builder import TraceNodeBuilder
+from llmtracer.trace_index import TraceIndex
+from llmtracer.trace_schema import TraceNode, resolve_delta_frame_ids
+from llmtracer.trace_serializer import json_loads, write_subtree
+from llmtracer.utils.tree_traversal import iter_preorder
+
+_INDEX_COLUMNS = ["event_id", "parent", "subtree_end", "start_offset", "fields_end_offset", "end_offset"]
+
+
+@dataclass
+class SpilledSubtree:
+    """
+    Where a spilled subtree is stored: its JSON at `offset` followed by its (relative) index columns.
+    """
+
+    spill_file: 'SpillFile'
+    offset: int
+    length: int
+    num_nodes: int
+    # Whether any node of the subtree has an `exception` property (for sampling policies).
+    has_exception: bool
+
+    def read_json(self) -> bytes:
+        return self.spill_file.read(self.offset, self.length)
+
+    def read_index(self) -> TraceIndex:
+        data = self.spill_file.read(self.offset + self.length, self.num_nodes * 8 * len(_INDEX_COLUMNS))
+        index = TraceIndex(file_size=self.length)
+        column_size = self.num_nodes * 8
+        for i, column in enumerate(_INDEX_COLUMNS):
+            values: array.array = getattr(index, column)
+            values.frombytes(data[i * column_size : (i + 1) * column_size])
+            if sys.byteorder == "big":
+                values.byteswap()
+        return index
+
+    def load(self) -> TraceNode:
+        node_dict = json_loads(self.read_json())
+        resolve_delta_frame_ids([node_dict], self.spill_file.frame_info_table.frame_infos)
+        return TraceNode.model_validate(node_dict)
+
+
+class SpillFile:
+    """
+    An anonymous temporary file that finished subtrees are appended to.
+    """
+
+    def __init__(self, directory: str | None = None, frame_info_table: FrameInfoTable | None = None):
+        self.file: typing.BinaryIO = tempfile.TemporaryFile(dir=directory)
+        self.size = 0
+        self.frame_info_table = frame_info_table if frame_info_table is not None else FrameInfoTable()
+
+    def read(self, offset: int, length: int) -> bytes:
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def spill(self, node: TraceNodeBuilder) -> TraceNodeBuilder:
+        """
+        Append the (finished) subtree to the spill file and return the stub that replaces it.
+        """
+        assert node.end_time_ms is not None and node.spilled is None
+        buffer = io.BytesIO()
+        index = TraceIndex()
+        write_subtree(buffer.write, node, index, self.frame_info_table)
+        data = buffer.getvalue()
+
+        self.file.seek(self.size)
+        self.file.write(data)
+        for column in _INDEX_COLUMNS:
+            values: array.array = getattr(index, column)
+            if sys.byteorder == "big":
+                values = array.array("q", values)
+                values.byteswap()
+            self.file.write(values.tobytes())
+
+        spilled = SpilledSubtree(
+            spill_file=self,
+            offset=self.size,
+            length=len(data),
+            # Stubs of spilled descendants are copied verbatim, so the index has all nodes.
+            num_nodes=len(index),
+            has_exception=any(
+                "exception" in descendant.get_properties()
+                or (descendant.spilled is not None and descendant.spilled.has_exception)
+                for descendant in iter_preorder([node], operator.attrgetter("children"))
+            ),
+        )
+        self.size = self.file.tell()
+        return TraceNodeBuilder(
+            kind=node.kind,
+            name=node.name,
+            event_id=node.event_id,
+            start_time_ms=node.start_time_ms,
+            end_time_ms=node.end_time_ms,
+            delta_frame_infos=[],
+            stack_height=node.stack_height,
+            tracer_overhead_ms=node.tracer_overhead_ms,
+            spilled=spilled,
+        )
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,105 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from dataclasses import dataclass, field
+
+from llmtracer.utils.tree_traversal import (
+    TreeEvent,
+    iter_enter_exit,
+    iter_preorder,
+    transform_bottom_up,
+    visit_top_down,
+)
+
+
+@dataclass
+class Node:
+    name: str
+    children: list['Node'] = field(default_factory=list)
+
+
+def get_children(node: Node):
+    return node.children
+
+
+TREE = Node("a", [Node("b", [Node("c"), Node("d")]), Node("e")])
+
+
+def make_chain(depth: int) -> Node:
+    root = node = Node("0")
+    for i in range(1, depth):
+        child = Node(str(i))
+        node.children.append(child)
+        node = child
+    return root
+
+
+def test_iter_preorder():
+    assert [node.name for node in iter_preorder([TREE, Node("f")], get_children)] == ["a", "b", "c", "d", "e", "f"]
+
+
+def test_transform_bottom_up():
+    def to_str(node: Node, children: list[str], depth: int):
+        return f"{node.name}{depth}({','.join(children)})"
+
+    assert transform_bottom_up(TREE, get_children, to_str) == "a0(b1(c2(),d2()),e1())"
+
+
+def test_visit_top_down():
+    paths = []
+
+    def visit(node: Node, path: str):
+        path = f"{path}/{node.name}"
+        paths.append(path)
+        return path
+
+    visit_top_down([TREE], get_children, visit, "")
+    assert paths == ["/a", "/a/b", "/a/b/c", "/a/b/d", "/a/e"]
+
+
+def test_iter_enter_exit():
+    events = [(event.value, node.name, index) for event, node, index in iter_enter_exit([TREE], get_children)]
+    assert events == [
+        ("enter", "a", 0),
+        ("enter", "b", 0),
+        ("enter", "c", 0),
+        ("exit", "c", 0),
+        ("enter", "d", 1),
+        ("exit", "d", 1),
+        ("exit", "b", 0),
+        ("enter", "e", 1),
+        ("exit", "e", 1),
+        ("exit", "a", 0),
+    ]
+
+
+def test_deep_trees():
+    depth = 20000
+    chain = make_chain(depth)
+
+    assert sum(1 for _ in iter_preorder([chain], get_children)) == depth
+    assert transform_bottom_up(chain, get_children, lambda node, children, d: 1 + sum(children)) == depth
+    assert sum(1 for event, _, _ in iter_enter_exit([chain], get_children) if event is TreeEvent.EXIT) == depth
+
+    max_depth = 0
+
+    def visit(node: Node, parent_depth: int):
+        nonlocal max_depth
+        max_depth = max(max_depth, parent_depth + 1)
+        return parent_depth + 1
+
+    visit_top_down([chain], get_children, visit, 0)
+    assert max_depth == depth
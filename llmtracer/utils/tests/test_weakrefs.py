@@ -117,6 +117,40 @@ def test_weak_key_id_map():
     assert not weak_key_id_map
 
 
+def test_weak_key_id_map_keep_alive():
+    weak_key_id_map = weakrefs.WeakKeyIdMap()
+
+    with pytest.raises(TypeError):
+        weak_key_id_map[{}] = 1
+
+    a = {}
+    weak_key_id_map.put(a, 1, keep_alive=True)
+    assert weak_key_id_map.get(a) == 1
+    assert weak_key_id_map.get({}) is None
+
+    # The map keeps the key alive, so its id cannot be reused.
+    id_a = id(a)
+    a = None
+    gc.collect()
+    assert list(weak_key_id_map) == [{}]
+    assert id(next(iter(weak_key_id_map))) == id_a
+
+    weak_key_id_map.clear()
+    assert not weak_key_id_map
+
+
+def test_weak_key_id_map_outlives_map():
+    weak_key_id_map = weakrefs.WeakKeyIdMap()
+    a = DummySupportsWeakRefs()
+    weak_key_id_map[a] = 1
+
+    # The weakref callback must not fail once the map is gone.
+    weak_key_id_map = None
+    gc.collect()
+    a = None
+    gc.collect()
+
+
 @dataclass
 class BoxedValue:
     i: int
@@ -0,0 +1,134 @@
+#  LLM Tracer
+#  Copyright (c) 2023. Andreas Kirsch
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Lesser General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+Iterative (explicit-stack) tree traversals.
+
+Traces can be thousands of levels deep (e.g. traced recursive functions), so we do not want to use Python recursion
+to walk them.
+"""
+import enum
+import typing
+
+N = typing.TypeVar("N")
+R = typing.TypeVar("R")
+C = typing.TypeVar("C")
+
+
+def iter_preorder(
+    roots: typing.Iterable[N], get_children: typing.Callable[[N], typing.Iterable[N]]
+) -> typing.Iterator[N]:
+    """
+    Iterate over all nodes of the trees in pre-order (parents before children, siblings in order).
+    """
+    stack = [iter(roots)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+        yield node
+        stack.append(iter(get_children(node)))
+
+
+def transform_bottom_up(
+    root: N,
+    get_children: typing.Callable[[N], typing.Sequence[N]],
+    transform: typing.Callable[[N, list[R], int], R],
+) -> R:
+    """
+    Transform a tree bottom-up.
+
+    `transform(node, transformed_children, depth)` is called for each node after all its children have been
+    transformed.
+
+    Returns:
+        The transformed root.
+    """
+    results: list[R] = []
+    # (node, its children, depth, whether the children have been pushed already)
+    stack: list[tuple[N, typing.Sequence[N], int, bool]] = [(root, get_children(root), 0, False)]
+    while stack:
+        node, children, depth, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, children, depth, True))
+            # Push in reverse, so the first child is transformed first.
+            for child in reversed(children):
+                stack.append((child, get_children(child), depth + 1, False))
+        else:
+            num_children = len(children)
+            if num_children:
+                transformed_children = results[-num_children:]
+                del results[-num_children:]
+            else:
+                transformed_children = []
+            results.append(transform(node, transformed_children, depth))
+
+    assert len(results) == 1
+    return results[0]
+
+
+def visit_top_down(
+    roots: typing.Iterable[N],
+    get_children: typing.Callable[[N], typing.Iterable[N]],
+    visit: typing.Callable[[N, C], C],
+    root_context: C,
+):
+    """
+    Visit all nodes in pre-order, passing a context from each node to its children.
+
+    `visit(node, parent_context)` returns the context that is passed to the node's children. The roots receive
+    `root_context`.
+    """
+    stack = [(iter(roots), root_context)]
+    while stack:
+        siblings, context = stack[-1]
+        node = next(siblings, None)
+        if node is None:
+            stack.pop()
+            continue
+        stack.append((iter(get_children(node)), visit(node, context)))
+
+
+class TreeEvent(enum.Enum):
+    ENTER = "enter"
+    EXIT = "exit"
+
+
+def iter_enter_exit(
+    roots: typing.Iterable[N], get_children: typing.Callable[[N], typing.Iterable[N]]
+) -> typing.Iterator[tuple[TreeEvent, N, int]]:
+    """
+    Iterate over (event, node, sibling index) tuples: each node is entered before its children and exited after them.
+
+    This is useful for streaming nested output (like JSON) without recursion.
+    """
+    stack: list[tuple[typing.Iterator[N], N | None]] = [(iter(roots), None)]
+    sibling_indices = [0]
+    while stack:
+        siblings, parent = stack[-1]
+        node = next(siblings, None)
+        if node is None:
+            stack.pop()
+            sibling_indices.pop()
+            if parent is not None:
+                yield TreeEvent.EXIT, parent, sibling_indices[-1] - 1
+            continue
+
+        index = sibling_indices[-1]
+        sibling_indices[-1] += 1
+        yield TreeEvent.ENTER, node, index
+        stack.append((iter(get_children(node)), node))
+        sibling_indices.append(0)
@@ -14,6 +14,7 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import typing
 import weakref
 from typing import Dict, Generic, Iterator, MutableMapping, MutableSet, TypeVar
 
@@ -117,38 +118,91 @@ class WeakIdSet(MutableSet[T]):
 
 
 class WeakKeyIdMap(MutableMapping[KT, VT]):
+    """
+    A mapping that compares keys by identity and does not keep them alive.
+
+    Entries are removed by a plain weakref callback once their key has been garbage collected (this is much cheaper
+    than a `weakref.finalize` per key). Keys that do not support weak references (e.g. dicts and lists) can be added
+    with `put(key, value, keep_alive=True)`: the map then keeps them alive until they are deleted or the map is
+    cleared, which makes sure their ids cannot be reused in the meantime.
+    """
+
     id_map_to_value: Dict[int, VT]
-    id_map_finalizer: IdMapFinalizer
+    # id(key) -> weakref.KeyedRef to the key, or the key itself if it is kept alive
+    id_map_to_key_ref: Dict[int, object]
 
     def __init__(self):
         self.id_map_to_value = {}
-        self.id_map_finalizer = IdMapFinalizer()
-
-    def _release(self, id_value):
-        del self.id_map_to_value[id_value]
+        self.id_map_to_key_ref = {}
+
+        # Only hold a weak reference to the map in the callback (like weakref.WeakValueDictionary does).
+        def remove(key_ref: weakref.KeyedRef, self_ref=weakref.ref(self)):
+            self = self_ref()
+            if self is not None and self.id_map_to_key_ref.get(key_ref.key) is key_ref:
+                del self.id_map_to_key_ref[key_ref.key]
+                del self.id_map_to_value[key_ref.key]
+
+        self._remove = remove
+
+    def put(self, k: KT, v: VT, *, keep_alive: bool = False) -> None:
+        """
+        Add or update an entry.
+
+        Args:
+            k: The key (compared by identity).
+            v: The value.
+            keep_alive: Whether the map should keep the key alive. This is required for keys that do not support
+                weak references.
+        """
+        id_k = id(k)
+        if keep_alive:
+            self.id_map_to_key_ref[id_k] = k
+        elif id_k not in self.id_map_to_key_ref:
+            if not supports_weakrefs(k):
+                raise TypeError(f"{type(k).__qualname__} does not support weak references, use keep_alive=True!")
+            self.id_map_to_key_ref[id_k] = weakref.KeyedRef(k, self._remove, id_k)
+        self.id_map_to_value[id_k] = v
 
     def __setitem__(self, k: KT, v: VT) -> None:
-        assert supports_weakrefs(k)
+        self.put(k, v)
 
+    def __delitem__(self, k: KT) -> None:
         id_k = id(k)
         if id_k not in self.id_map_to_value:
-            self.id_map_finalizer.register(k, self._release)
-        self.id_map_to_value[id_k] = v
-
-    def __delitem__(self, k: KT) -> None:
-        del self.id_map_to_value[id(k)]
-        self.id_map_finalizer.release(k)
+            raise KeyError(k)
+        # Dropping the KeyedRef also drops its callback.
+        del self.id_map_to_key_ref[id_k]
+        del self.id_map_to_value[id_k]
 
     def __getitem__(self, k: KT) -> VT:
-        return self.id_map_to_value[id(k)]
+        try:
+            return self.id_map_to_value[id(k)]
+        except KeyError:
+            raise KeyError(k) from None
+
+    def get(self, k: KT, default=None):  # type: ignore
+        return self.id_map_to_value.get(id(k), default)
+
+    def __contains__(self, k: object) -> bool:
+        return id(k) in self.id_map_to_value
 
     def __len__(self) -> int:
         return len(self.id_map_to_value)
 
     def __iter__(self) -> Iterator[KT]:
-        # TODO: add a test that shows that this is necessary to avoid deletions
         # Take a snapshot of the keys. This will ensure that the dictionary will be stable during iteration.
-        return iter(self.id_map_finalizer)
+        keys: list[KT] = []
+        for key_ref in list(self.id_map_to_key_ref.values()):
+            if type(key_ref) is weakref.KeyedRef:
+                key_ref = key_ref()
+                if key_ref is None:
+                    continue
+            keys.append(typing.cast(KT, key_ref))
+        return iter(keys)
+
+    def clear(self) -> None:
+        self.id_map_to_key_ref.clear()
+        self.id_map_to_value.clear()
 
     def __repr__(self):
         return f"KeyIdDict{{{', '.join(map(lambda key: f'{repr(key)}:{repr(self[key])}', self))}}}"
@@ -14,6 +14,7 @@
 #  You should have received a copy of the GNU Lesser General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import operator
 from contextlib import contextmanager
 
 import wandb.sdk.wandb_run
@@ -28,6 +29,7 @@ from llmtracer import (  # type: ignore
     build_trace,
     module_filtering,
 )
+from llmtracer.utils.tree_traversal import transform_bottom_up
 
 
 def convert_event_kind_str(kind: TraceNodeKind):
@@ -47,37 +49,40 @@ def convert_result(result: object):
     return [result]
 
 
-def build_span(node: TraceNode):
-    span = trace_tree.Span()
-    span.span_id = str(node.event_id)
-    span.name = node.name if node.name is not None else ''
-    span.span_kind = convert_event_kind_str(node.kind)
-
-    span.start_time_ms = node.start_time_ms
-    span.end_time_ms = node.end_time_ms
-
-    if "exception" not in node.properties:
-        span.status_code = trace_tree.StatusCode.SUCCESS
-    else:
-        span.status_code = trace_tree.StatusCode.ERROR
-        span.status_message = repr(node.properties["exception"])
-
-    span.add_named_result(
-        node.properties.get('arguments', {}), convert_result(node.properties.get('result', None))  # type: ignore
-    )
-
-    properties = dict(node.properties)
-    if "arguments" in properties:
-        del properties["arguments"]
-    if "result" in properties:
-        del properties["result"]
-
-    span.attributes = dict(
-        properties=properties,
-        delta_stack=node.delta_frame_infos,
-    )
-    span.child_spans = [build_span(child) for child in node.children]
-    return span
+def build_span(root: TraceNode):
+    def build_node_span(node: TraceNode, child_spans: list[trace_tree.Span], depth: int):
+        span = trace_tree.Span()
+        span.span_id = str(node.event_id)
+        span.name = node.name if node.name is not None else ''
+        span.span_kind = convert_event_kind_str(node.kind)
+
+        span.start_time_ms = node.start_time_ms
+        span.end_time_ms = node.end_time_ms
+
+        if "exception" not in node.properties:
+            span.status_code = trace_tree.StatusCode.SUCCESS
+        else:
+            span.status_code = trace_tree.StatusCode.ERROR
+            span.status_message = repr(node.properties["exception"])
+
+        span.add_named_result(
+            node.properties.get('arguments', {}), convert_result(node.properties.get('result', None))  # type: ignore
+        )
+
+        properties = dict(node.properties)
+        if "arguments" in properties:
+            del properties["arguments"]
+        if "result" in properties:
+            del properties["result"]
+
+        span.attributes = dict(
+            properties=properties,
+            delta_stack=node.delta_frame_infos,
+        )
+        span.child_spans = child_spans
+        return span
+
+    return transform_bottom_up(root, operator.attrgetter("children"), build_node_span)
 
 
 def wandb_build_trace_trees(trace: Trace):